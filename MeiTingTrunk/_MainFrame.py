@@ -54,6 +54,7 @@ from . import _MainFrameLoadData, _MainFrameDataSlots, _MainFrameToolBarSlots,\
 from .lib.tools import getMinSizePolicy, getXMinYExpandSizePolicy, \
         getXExpandYMinSizePolicy, getXExpandYExpandSizePolicy, getHLine,\
         hasXapian
+from .lib.thumbnail import ThumbnailService
 from .lib.widgets import MyTreeWidget, TableModel,\
         MyHeaderView, MetaTabScroll, CheckDuplicateFrame, NoteTextEdit,\
         SearchResFrame, PDFPreviewer
@@ -81,6 +82,28 @@ class MainFrame(QtWidgets.QWidget,_MainFrameLoadData.MainFrameLoadData,
         tinter=self.settings.value('saving/auto_save_min', 1, int)*60*1000 # in msc
         self.auto_save_timer.setInterval(tinter)
         self.auto_save_timer.timeout.connect(self.saveToDatabase)
+        # worker and thread of an ongoing save, see saveToDatabase()
+        self.save_worker=None
+        self.save_thread=None
+        # xapian indexing service of current lib, see _MainWindow._openDatabase()
+        self.index_service=None
+        self.search_session=None
+        # in-memory index of meta data, see _MainFrameLoadData.setMetaIndex()
+        self.meta_index=None
+        # True while docs are being read, see _MainFrameLoadData.startLoadLib()
+        self.lib_loading=False
+        self._unindexed_ids=set()
+        # renders pdf thumbnails for the PDF tab, see
+        # _MainFrameLoadData.loadPDFThumbnail()
+        self.thumbnail_service=ThumbnailService(
+                done_callback=self.thumbnail_sig.emit)
+        self.thumbnail_service.start()
+        # re-queue thumbnails to pre-render after user activity settles, see
+        # _MainFrameOtherSlots.warmThumbnails()
+        self.thumbnail_warm_timer=QTimer(self)
+        self.thumbnail_warm_timer.setSingleShot(True)
+        self.thumbnail_warm_timer.setInterval(500)
+        self.thumbnail_warm_timer.timeout.connect(self.warmThumbnails)
 
 
     def initUI(self):
@@ -113,6 +136,12 @@ class MainFrame(QtWidgets.QWidget,_MainFrameLoadData.MainFrameLoadData,
         self.search_bar.setFixedWidth(300)
         self.search_bar.setSizePolicy(getMinSizePolicy())
         self.search_bar.returnPressed.connect(self.searchBarClicked)
+        # search as you type, after a pause in typing. See liveSearch()
+        self.search_timer=QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self.liveSearch)
+        self.search_bar.textEdited.connect(lambda: self.search_timer.start())
 
         # search button
         self.search_button=self.createSearchButton()
@@ -216,6 +245,13 @@ class MainFrame(QtWidgets.QWidget,_MainFrameLoadData.MainFrameLoadData,
         self.progressbar.setVisible(False)
         self.status_bar.addPermanentWidget(self.progressbar)
 
+        # status of the xapian indexing service
+        self.index_status_label=QtWidgets.QLabel(self)
+        self.index_status_label.setVisible(False)
+        self.status_bar.addPermanentWidget(self.index_status_label)
+        self.index_status_sig.connect(self.indexStatusChanged)
+        self.thumbnail_sig.connect(self.showPDFThumbnail)
+
         # search_res_frame created before status bar
         self.search_res_frame.search_done_sig.connect(self.status_bar.clearMessage)
 
@@ -553,6 +589,8 @@ class MainFrame(QtWidgets.QWidget,_MainFrameLoadData.MainFrameLoadData,
         tv.setColumnHidden(9,True) # needs review column, shown as bold/normal
 
         tv.selectionModel().currentChanged.connect(self.selDoc)
+        tv.selectionModel().currentChanged.connect(self.noteUserActivity)
+        tv.verticalScrollBar().valueChanged.connect(self.noteUserActivity)
         tv.clicked.connect(self.docTableClicked)
         #tablemodel.rowsInserted.connect(self.model_insert_row)
         tv.setContextMenuPolicy(Qt.CustomContextMenu)
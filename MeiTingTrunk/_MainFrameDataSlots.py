@@ -16,12 +16,14 @@ terms of the GPLv3 license.
 '''
 
 import os
+import sqlite3
 from datetime import datetime
-from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QBrush
 from PyQt5 import QtWidgets
 from .lib import sqlitedb
 from .lib import widgets
+from .lib.tools import getSqlitePath
 from .lib.widgets.zim_dialog import saveToZimNote
 
 
@@ -51,6 +53,23 @@ class MainFrameDataSlots:
     #                      Meta data update functions                      #
     #######################################################################
 
+    def newDocId(self):
+        """Get an id for a new doc
+
+        Returns:
+            docid (int): 1 + the largest doc id in memory or in sqlite.
+
+        Docs in sqlite are checked too, as they may not be read into
+        self.meta_dict yet when the library is still loading.
+        """
+
+        query='''SELECT MAX(rowid) FROM Documents'''
+        docid=max(max(self.meta_dict.keys(), default=0),
+                self.db.execute(query).fetchone()[0] or 0)
+
+        return docid+1
+
+
     def updateTableData(self,docid,meta_dict,field_list=None):
         """Update the in-memory dictionary self.meta_dict
 
@@ -72,10 +91,7 @@ class MainFrameDataSlots:
 
         if docid is None:
 
-            if len(self.meta_dict)==0:
-                docid=1
-            else:
-                docid=max(self.meta_dict.keys())+1
+            docid=self.newDocId()
 
             self.logger.info('Add new doc. Given id=%s' %docid)
 
@@ -126,12 +142,12 @@ class MainFrameDataSlots:
 
                 self.meta_dict[docid]=meta_dict
 
-            # reload doc table
-            self.loadDocTable(docids=self._current_docids,
-                    sel_row=self.doc_table.currentIndex().row(),
-                    sortidx=False)
+            # update the doc's row in doc table
+            self.reloadDocRow(docid)
 
         self.changed_doc_ids.append(docid)
+        if self.meta_index is not None:
+            self.meta_index.updateDoc(docid, self.meta_dict[docid])
 
         return docid
 
@@ -151,9 +167,9 @@ class MainFrameDataSlots:
         if docid:
             self.meta_dict[docid]=meta_dict
             self.changed_doc_ids.append(docid)
-            self.loadDocTable(docids=self._current_docids,
-                    sortidx=False,
-                    sel_row=self.doc_table.currentIndex().row())
+            if self.meta_index is not None:
+                self.meta_index.updateDoc(docid, meta_dict)
+            self.reloadDocRow(docid)
 
         return
 
@@ -174,6 +190,8 @@ class MainFrameDataSlots:
 
         self.meta_dict[docid]['notes']=note_text
         self.changed_doc_ids.append(docid)
+        if self.meta_index is not None:
+            self.meta_index.updateDoc(docid, self.meta_dict[docid])
         self.logger.info('New notes for docid=%s: %s' %(docid,note_text))
 
         use_zim_default=self.settings.value('saving/use_zim_default', type=bool)
@@ -250,74 +268,185 @@ class MainFrameDataSlots:
 
 
     @pyqtSlot()
-    def saveToDatabase(self):
+    def saveToDatabase(self, block=False):
         """Save in-memory data to sqlite file
 
+        Kwargs:
+            block (bool): if True, save in the GUI thread and return when
+                          done, e.g. before searching or closing. Otherwise
+                          save in a separate thread.
+
         self.changed_folder_ids contains ids of folder to update.
         self.changed_doc_ids contains ids of docs to update.
         Clear these two after saving.
+        All changes are written in a single transaction, see
+        sqlitedb.saveToDatabaseBatch().
         """
 
         mtime=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
         self.logger.info('Save called. %s' %mtime)
 
+        #--------------Previous save running--------------
+        if self.save_worker is not None:
+            if not block:
+                self.logger.info('Previous saving not finished. Skip.')
+                return
+            self.logger.info('Waiting for previous saving to finish.')
+            self.save_thread.wait()
+            self.saveDone()
+
         if len(self.changed_folder_ids)==0 and len(self.changed_doc_ids)==0:
             return
 
         # remove duplicates
-        self.changed_folder_ids=list(set(self.changed_folder_ids))
-        self.changed_doc_ids=list(set(self.changed_doc_ids))
+        changed_folder_ids=list(set(self.changed_folder_ids))
+        changed_doc_ids=list(set(self.changed_doc_ids))
+        # changes made during saving are saved next time
+        self.changed_folder_ids=[]
+        self.changed_doc_ids=[]
+        if self.lib_loading and self.meta_index is None:
+            self._unindexed_ids.update(changed_doc_ids)
 
-        self.logger.debug('Folders to save: %s' %self.changed_folder_ids)
-        self.logger.debug('Docs to save: %s' %self.changed_doc_ids)
+        self.logger.debug('Folders to save: %s' %changed_folder_ids)
+        self.logger.debug('Docs to save: %s' %changed_doc_ids)
 
         self.status_bar.setVisible(True)
         self.status_bar.showMessage('Saving. Please standby ...')
-        # progressbar doesn't work in the main thread?
         self.progressbar.setVisible(True)
         self.progressbar.setMaximum(0)
-        QtWidgets.QApplication.processEvents()
-
-        #----------------Save folders first----------------
-        if len(self.changed_folder_ids)>0:
-
-            sqlitedb.saveFoldersToDatabase(self.db,
-                    self.changed_folder_ids, self.folder_dict,
-                    self.settings.value('saving/current_lib_folder'))
-
-            self.changed_folder_ids=[]
-            self.logger.info('Folder changes saved to database.')
-
-        #--------------------Save docs--------------------
-        any_reload_doc=False
-        for docid in self.changed_doc_ids:
-            self.logger.info('Saving doc %s' %docid)
-            rec, reload_doc=sqlitedb.metaDictToDatabase(self.db, docid,
-                    self.meta_dict,
-                    self.meta_dict.get(docid),
-                    self.settings.value('saving/current_lib_folder'),
-                    self.settings.value('saving/rename_files', type=int),
-                    self.settings.value('saving/file_move_manner', type=str)
-                    )
-            any_reload_doc=any_reload_doc or reload_doc
+        if block:
+            QtWidgets.QApplication.processEvents()
+
+        # copy meta data, so editing during saving won't interfere
+        meta_dict={}
+        saved_files={}
+        for docid in changed_doc_ids:
+            metaii=self.meta_dict.get(docid)
+            meta_dict[docid]=None if metaii is None else sqlitedb.DocMeta(metaii)
+            if metaii is not None:
+                # lists are shared by the copy, see saveDone()
+                saved_files[docid]=list(metaii['files_l'])
+
+        folder_dict=dict(self.folder_dict)
+        lib_folder=self.settings.value('saving/current_lib_folder')
+        rename_files=self.settings.value('saving/rename_files', type=int)
+        add_manner=self.settings.value('saving/file_move_manner', type=str)
+        sqlitepath=getSqlitePath(self.db)
+        search_session=self.search_session
+
+        def saveFunc(progress_callback=None):
+            if block:
+                db=self.db
+            else:
+                # sqlite connections can't be shared across threads
+                db=sqlite3.connect(sqlitepath)
+            try:
+                return sqlitedb.saveToDatabaseBatch(db, changed_folder_ids,
+                        folder_dict, changed_doc_ids, meta_dict, lib_folder,
+                        rename_files, add_manner, progress_callback,
+                        search_session)
+            finally:
+                if not block:
+                    db.close()
+
+        self.save_worker=widgets.ProgressWorker(0, saveFunc)
+        self._saving_ids=(changed_folder_ids, changed_doc_ids, saved_files)
+
+        if block:
+            self.save_worker.processJob()
+            self.saveDone()
+        else:
+            self.save_thread=QThread()
+            self.save_worker.moveToThread(self.save_thread)
+            self.save_worker.progress_signal.connect(self.saveProgress)
+            self.save_worker.done_signal.connect(self.save_thread.quit,
+                    Qt.DirectConnection)
+            self.save_worker.done_signal.connect(self.saveDone)
+            self.save_thread.started.connect(self.save_worker.processJob)
+            self.save_thread.start()
+
+        return
+
+
+    @pyqtSlot(int, int)
+    def saveProgress(self, n_done, n_total):
+        """Show saving progress in progressbar
+
+        Args:
+            n_done (int): number of docs saved.
+            n_total (int): number of docs to save.
+        """
+
+        self.progressbar.setMaximum(n_total)
+        self.progressbar.setValue(n_done)
+
+        return
+
+
+    @pyqtSlot()
+    def saveDone(self):
+        """Update GUI after saving to sqlite is done
+        """
+
+        # already handled, e.g. by a blocking save waiting for this one
+        if self.save_worker is None:
+            return
+
+        results=self.save_worker.results
+        changed_folder_ids, changed_doc_ids, saved_files=self._saving_ids
+        self.save_worker=None
 
-        self.changed_doc_ids=[]
-        self.settings.sync()
         self.status_bar.clearMessage()
         self.progressbar.setVisible(False)
 
+        if results is None or results[0]!=0:
+            self.logger.error('Saving failed. Changes are kept for next save.')
+            self.changed_folder_ids.extend(changed_folder_ids)
+            self.changed_doc_ids.extend(changed_doc_ids)
+            self.status_bar.showMessage('Failed to save changes.')
+            return
+
+        #-----------Update docs with changed files-----------
+        _, reload_docs=results
+        edited_ids=set(self.changed_doc_ids)
+        for docid, metaii in reload_docs.items():
+            if docid not in self.meta_dict:
+                continue
+            if docid in edited_ids:
+                # edited during saving: keep the edits, and only take the
+                # saved file paths, unless files are also edited.
+                current=self.meta_dict[docid]
+                if current is not None and\
+                        current['files_l']==saved_files.get(docid):
+                    current['files_l']=metaii['files_l']
+                continue
+            self.meta_dict[docid]=metaii
+            if self.meta_index is not None:
+                self.meta_index.updateDoc(docid, metaii)
+
+        if self.search_session is not None:
+            self.search_session.updateDocs(changed_doc_ids)
+
+        #-------------Index changed attachments-------------
+        if self.index_service is not None:
+            relpaths=[fii for metaii in reload_docs.values() for fii in\
+                    metaii['files_l']]
+            if len(relpaths)>0:
+                self.index_service.addFiles(relpaths)
+
+        self.settings.sync()
+
         self.logger.info('Saving completed.')
 
         #current_folder=self._current_folder
         current_doc_ids=self._current_docids
         #if any_reload_doc and current_folder is not None:
-        if any_reload_doc and current_doc_ids:
+        if len(reload_docs)>0 and current_doc_ids:
             current_row=self.doc_table.currentIndex().row()
             self.logger.debug('Reloading doc table after save. current_row = %s' %(current_row))
             self.loadDocTable(docids=current_doc_ids, sortidx=False,
                     sel_row=current_row)
 
-
         return
 
 
@@ -343,7 +472,7 @@ class MainFrameDataSlots:
     @pyqtSlot(sqlitedb.DocMeta)
     def addDocFromDuplicateMerge(self, meta_dict):
 
-        docid=max(self.meta_dict.keys())+1
+        docid=self.newDocId()
         self.logger.info('Add new doc. Given id=%s' %docid)
 
         # update folder_data
@@ -358,6 +487,8 @@ class MainFrameDataSlots:
         self.meta_dict[docid]=meta_dict
 
         self.changed_doc_ids.append(docid)
+        if self.meta_index is not None:
+            self.meta_index.updateDoc(docid, meta_dict)
 
         msg=QtWidgets.QMessageBox()
         msg.resize(600,500)
@@ -68,8 +68,8 @@ class MainFrameDocTableSlots:
         row=index1.row()
 
         docid=self._tabledata[row][0]
-        fav=self._tabledata[row][1].isChecked()
-        read=self._tabledata[row][2].isChecked()
+        fav=self._tabledata[row][1]
+        read=self._tabledata[row][2]
 
         self.meta_dict[docid]['favourite']='true' if fav else 'false'
         self.meta_dict[docid]['read']='true' if read else 'false'
@@ -617,7 +617,10 @@ class MainFrameDocTableSlots:
                                 %(idii, kk, idii in self.folder_data[kk]))
 
                 self.changed_doc_ids.append(idii)
+                self.thumbnail_service.removeFiles(self.meta_dict[idii]['files_l'])
                 del self.meta_dict[idii]
+                if self.meta_index is not None:
+                    self.meta_index.removeDoc(idii)
 
                 self.logger.info('Deleted %s from meta_dict' %idii)
 
@@ -87,6 +87,11 @@ class MainFrameLibTreeSlots:
                 self.duplicate_check_button.setEnabled(True)
                 self.search_button.setEnabled(True)
 
+        # duplicates can only be checked after all docs are read
+        if self.lib_loading:
+            self.add_button.setDisabled(True)
+            self.duplicate_check_button.setDisabled(True)
+
         # Refresh filter list
         self.filterTypeCombboxChange()
 
@@ -349,7 +354,10 @@ class MainFrameLibTreeSlots:
             for docii in self.folder_data['-3']:
 
                 self.logger.warning('Deleting orphan doc %s from meta_dict' %docii)
+                self.thumbnail_service.removeFiles(self.meta_dict[docii]['files_l'])
                 del self.meta_dict[docii]
+                if self.meta_index is not None:
+                    self.meta_index.removeDoc(docii)
                 self.logger.warning('Deleting orphan doc %s from folder_data[-3]' %docii)
                 self.folder_data['-3'].remove(docii)
                 self.changed_doc_ids.append(docii)
@@ -83,13 +83,12 @@ terms of the GPLv3 license.
 '''
 
 import os
-import subprocess
-import glob
 from PyQt5 import QtWidgets
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSlot
 from PyQt5 import QtGui
 from .lib import sqlitedb
 from .lib import bibparse
+from .lib.metaindex import MetaIndex
 from .lib.tools import getHLine, hasPoppler, ZimNoteNotFoundError
 
 
@@ -125,6 +124,47 @@ def addFolder(parent, folderid, folder_dict):
     return
 
 
+class DocRow(object):
+
+    __slots__=('docid', 'favourite', 'read', 'has_file', 'authors', 'title',
+            'publication', 'year', 'added', 'confirmed')
+
+    def __init__(self, docid, meta):
+        '''A row of the doc table
+
+        Args:
+            docid (int): id of doc.
+            meta (DocMeta): meta data dict of doc.
+
+        Holds the plain values of the 10 table columns, favourite and read
+        as bools. Columns are accessed by index as in a list, e.g. row[0]
+        gives the doc id. Display values are made by TableModel.data().
+        '''
+
+        self.docid=docid
+        self.favourite=meta['favourite']=='true'
+        self.read=meta['read']=='true'
+        self.has_file=meta['has_file']
+        self.authors='; '.join(meta['authors_l'])
+        self.title=meta['title']
+        self.publication=meta['publication']
+        self.year=meta['year']
+        self.added=meta['added']
+        self.confirmed=meta['confirmed']
+
+
+    def __getitem__(self, idx):
+        return getattr(self, self.__slots__[idx])
+
+
+    def __setitem__(self, idx, value):
+        setattr(self, self.__slots__[idx], value)
+
+
+    def __len__(self):
+        return len(self.__slots__)
+
+
 def prepareDocs(meta_dict, docids):
     """Format meta data of docs for display in the doc table
 
@@ -137,30 +177,11 @@ def prepareDocs(meta_dict, docids):
                           where DocMeta is a dict. See sqlitedb.py for details.
         docids (list): list of doc ids to format.
 
-    Returns: data (list): each element is a list containing 10 fields of a
-                          doc to feed into the doc_table QTableView.
+    Returns: data (list): each element is a DocRow containing 10 fields of
+                          a doc to feed into the doc_table QTableView.
     """
 
-    data=[]
-    for ii in docids:
-        entryii=meta_dict[ii]
-        fav_check=QtWidgets.QCheckBox()
-        read_check=QtWidgets.QCheckBox()
-        fav_check.setChecked(True if entryii['favourite']=='true' else False)
-        read_check.setChecked(True if entryii['read']=='true' else False)
-        aii=[ii,
-            fav_check,
-            read_check,
-            entryii['has_file'],
-            '; '.join(entryii['authors_l']),
-            entryii['title'],
-            entryii['publication'],
-            entryii['year'],
-            entryii['added'],
-            entryii['confirmed']
-            ]
-
-        data.append(aii)
+    data=[DocRow(ii, meta_dict[ii]) for ii in docids]
 
     return data
 
@@ -190,6 +211,7 @@ class MainFrameLoadData:
         self.meta_dict=meta_dict
         self.folder_data=folder_data
         self.folder_dict=folder_dict
+        self.meta_index=MetaIndex(meta_dict)
         #self.inv_folder_dict={v[0]:k for k,v in self.folder_dict.items()}
 
         style=QtWidgets.QApplication.style()
@@ -248,6 +270,86 @@ class MainFrameLoadData:
         return
 
 
+    def startLoadLib(self, db, folder_dict, folder_data):
+        """Load folders of a library whose docs are still being read
+
+        Args:
+            db (sqlite connection): sqlite connection of the library.
+            folder_dict (dict): dict containing folder info in the library.
+            folder_data (dict): dict containing doc ids in a folder, with
+                                empty lists to be filled by loadDocChunk().
+
+        Docs are added by loadDocChunk() as they are read from sqlite, and
+        loadLibDone() is called after the last chunk. See
+        _MainWindow.loadSqlite().
+        """
+
+        self.lib_loading=True
+        self.loadLibTree(db, {}, folder_data, folder_dict)
+        # built in the loading worker, see setMetaIndex(). Searches before
+        # that go to sqlite.
+        self.meta_index=None
+        # ids of docs changed and saved before the index is ready
+        self._unindexed_ids=set()
+
+        return
+
+
+    def loadDocChunk(self, meta_dict, folder_data):
+        """Add a chunk of docs to a library being loaded
+
+        Args:
+            meta_dict (dict): meta data of docs in the chunk.
+            folder_data (dict): dict containing ids of docs in the chunk in
+                                each folder.
+        """
+
+        is_first=len(self.meta_dict)==0
+        self.meta_dict.update(meta_dict)
+        for fii, docids in folder_data.items():
+            self.folder_data.setdefault(fii, []).extend(docids)
+
+        # show the 1st page of the current folder, the rest are shown when
+        # all are loaded, to not reload the table for each chunk
+        if is_first:
+            self.selFolder()
+
+        return
+
+
+    def setMetaIndex(self, meta_index):
+        """Use the meta data index built while loading a library
+
+        Args:
+            meta_index (MetaIndex): index of docs as read from sqlite.
+
+        Docs changed during loading are re-indexed, as the index is built
+        from the docs read from sqlite.
+        """
+
+        docids=self._unindexed_ids.union(self.changed_doc_ids)
+        for docid in docids:
+            meta_index.updateDoc(docid, self.meta_dict.get(docid))
+        self._unindexed_ids=set()
+        self.meta_index=meta_index
+
+        return
+
+
+    def loadLibDone(self):
+        """Finish loading a library after all docs are read"""
+
+        self.lib_loading=False
+        self._unindexed_ids=set()
+        if self.meta_index is None:
+            self.logger.warning('No meta data index. Search in sqlite.')
+        self.selFolder()
+
+        self.logger.info('Library loaded. %d docs.' %len(self.meta_dict))
+
+        return
+
+
     def loadDocTable(self, folder=None, docids=None, sortidx=None,
             sortorder=0, sel_row=None):
         """Load the doc table
@@ -343,6 +445,35 @@ class MainFrameLoadData:
         return
 
 
+    def reloadDocRow(self, docid):
+        """Update the row of an edited doc in the doc table
+
+        Args:
+            docid (int): id of doc to update.
+
+        Instead of reloading the whole table, only the row of the doc is
+        re-created and moved to its sorted position. The selected doc is kept
+        selected.
+        """
+
+        current_doc=self._current_doc
+        current_row=self.doc_table.currentIndex().row()
+
+        row=self.doc_table.model().updateRow(
+                prepareDocs(self.meta_dict, [docid,])[0])
+        if row is None or current_doc is None:
+            return
+
+        sel_row=row if docid==current_doc else\
+                self._current_docids.index(current_doc)
+        self.doc_table.selectRow(sel_row)
+
+        if current_row==sel_row:
+            self.selDoc(self.doc_table.currentIndex(),None)
+
+        return
+
+
     def loadMetaTab(self, docid=None):
         """Load meta data tab of a doc
 
@@ -457,10 +588,14 @@ class MainFrameLoadData:
 
 
     def loadPDFThumbnail(self, docid=None):
-        """Load a thumbnail of the 1st page of a pdf
+        """Load thumbnails of the first pages of a pdf
 
         Kwargs:
             docid (int or None): if int, the id of the doc to load.
+
+        Thumbnails not in the cache folder are rendered by
+        self.thumbnail_service in the background, and shown by
+        showPDFThumbnail() when done.
         """
 
         if docid is None:
@@ -468,28 +603,21 @@ class MainFrameLoadData:
 
         files=self.meta_dict[docid]['files_l']
         if len(files)==0:
+            self.thumbnail_service.cancel()
             self.pdf_viewer.clearLayout()
             return
 
         dpi=self.settings.value('view/thumbnail_dpi', type=str)
-
-        lib_folder=self.settings.value('saving/current_lib_folder', type=str)
-        cache_folder=os.path.join(lib_folder, '_cache')
+        n_pages=self.settings.value('view/thumbnail_pages', 1, type=int)
 
         # get the 1st file
-        filepath=files[0]
-        filepath=os.path.join(lib_folder, filepath)
-        filename=os.path.split(filepath)[1]
-        outfile=os.path.join(cache_folder, '%s-%s' %(filename, dpi))
+        relpath=files[0]
 
-        self.logger.debug('outfile = %s' %outfile)
+        self.logger.debug('relpath = %s' %relpath)
 
         # prefer poppler over imagemagic
         # NO, imagemagic for some reason doesn't allow pdf conversion, so f it.
-        if hasPoppler():
-            cmd=['pdftoppm', filepath, outfile, '-jpeg',
-                    '-r', dpi]
-        else:
+        if not hasPoppler():
             #if hasImageMagic():
                 #cmd=['convert', '-density', dpi, filepath, outfile]
             #else:
@@ -505,30 +633,44 @@ class MainFrameLoadData:
             return
 
         #-----------Try finding saved thumbnail-----------
-        glob_paths=os.path.join(cache_folder, '%s-%s*.jpg' %(filename, dpi))
-        outfiles=glob.glob(glob_paths)
-        if len(outfiles)>0:
-            outfiles.sort()
-            tb_imgs=(QtGui.QPixmap(fii) for fii in outfiles)
+        outfiles=self.thumbnail_service.cached(relpath, dpi, 1, n_pages)
+        images=[QtGui.QImage(fii) for fii in outfiles]
+        if len(images)>0 and not any([imgii.isNull() for imgii in images]):
             self.logger.debug('Using cached thumbnail.')
+            self.showPDFThumbnail(docid, images)
         else:
-            try:
-                proc=subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE)
-                proc.wait()
-            except:
-                return
-            else:
-                outfiles=glob.glob(glob_paths)
-                outfiles.sort()
-                tb_imgs=(QtGui.QPixmap(fii) for fii in outfiles)
-                self.logger.debug('Generate a new thumbnail.')
+            # cache files may have been removed since indexed
+            self.thumbnail_service.discard(relpath, dpi)
+            self.logger.debug('Request a new thumbnail.')
+            self.pdf_viewer.clearLayout()
+            self.pdf_viewer.layout.addWidget(
+                    QtWidgets.QLabel('Creating preview ...', self))
+            self.thumbnail_service.request(docid, relpath, dpi, 1, n_pages)
+
+        return
+
+
+    @pyqtSlot(int, object)
+    def showPDFThumbnail(self, docid, images):
+        """Show pdf thumbnails in the PDF tab
+
+        Args:
+            docid (int): id of the doc the thumbnails belong to.
+            images (list): QImage of pages.
+
+        This is also the slot to thumbnail_sig, emitted by
+        self.thumbnail_service when a render is done. Thumbnails of a doc
+        that is no longer selected are ignored.
+        """
+
+        if docid!=self._current_doc or self.tabs.currentWidget()!=self.t_pdf:
+            return
 
         #--------------------Add images--------------------
         self.pdf_viewer.clearLayout()
-        for pii in tb_imgs:
+        for imgii in images:
             labelii=QtWidgets.QLabel(self)
-            labelii.setPixmap(pii)
+            labelii.setPixmap(QtGui.QPixmap.fromImage(imgii))
             self.pdf_viewer.layout.addWidget(labelii)
 
         return
@@ -15,11 +15,9 @@ terms of the GPLv3 license.
 '''
 
 import os
-import glob
-import resource
-import subprocess
-from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QThread, QTimer
+from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QThread
 from .lib.tools import hasPoppler
+from .lib.thumbnail import ThumbnailCache
 
 
 class SettingsThread(QThread):
@@ -43,6 +41,8 @@ class MainFrameOtherSlots:
 
 
     view_change_sig=pyqtSignal(str,bool)
+    index_status_sig=pyqtSignal(str,int) # status, NO. of queued files
+    thumbnail_sig=pyqtSignal(int,object) # docid, list of QImage
 
     #######################################################################
     #                             Other slots                             #
@@ -313,6 +313,52 @@ class MainFrameOtherSlots:
         return
 
 
+    @pyqtSlot(str,int)
+    def indexStatusChanged(self, status, queue_size):
+        '''Show status of the xapian indexing service in status bar
+
+        Args:
+            status (str): 'idle' or 'indexing'.
+            queue_size (int): number of files waiting to be indexed.
+
+        This is a slot to the index_status_sig, which is emitted from the
+        thread of xapiandb.IndexService.
+        '''
+
+        if status=='indexing':
+            self.index_status_label.setText('Indexing attachments ...')
+            self.index_status_label.setVisible(True)
+        elif queue_size>0:
+            self.index_status_label.setText('%d attachment(s) to index'\
+                    %queue_size)
+            self.index_status_label.setVisible(True)
+        else:
+            self.index_status_label.setVisible(False)
+
+        return
+
+
+    def stopIndexService(self, cancel=False):
+        '''Stop the xapian indexing service and close the search session
+
+        Kwargs:
+            cancel (bool): if False, stop after indexing queued files.
+                           If True, stop after files in progress, the rest
+                           are indexed after the library is re-opened.
+        '''
+
+        if self.index_service is not None:
+            self.index_service.stop(cancel=cancel)
+            self.index_service=None
+            self.index_status_label.setVisible(False)
+
+        if self.search_session is not None:
+            self.search_session.close()
+            self.search_session=None
+
+        return
+
+
     def clearData(self):
         '''Clear data from meta tab, doc table, folder tree and filter list
 
@@ -332,6 +378,12 @@ class MainFrameOtherSlots:
         self.doc_table.model().layoutChanged.emit()
         self.libtree.clear()
         self.filter_item_list.clear()
+        self.meta_index=None
+        self.lib_loading=False
+        self._unindexed_ids=set()
+        self.thumbnail_warm_timer.stop()
+        self.thumbnail_service.cancel(warm=True)
+        self.thumbnail_service.setCache(None)
 
         self.add_button.setEnabled(False)
         self.add_folder_button.setEnabled(False)
@@ -342,75 +394,103 @@ class MainFrameOtherSlots:
         return
 
 
-    def createThumbnails(self):
-        '''Create PDF thumbnails in the background.
-
-        This is supposed to run in a separate thread when a library is opened,
-        and stopped when a library is closed. See
+    def startThumbnailWarmer(self):
+        '''Start pre-rendering PDF thumbnails in the background
 
-        _MainWindow._openDatabase()
-        _MainWindow.closeDatabaseTriggered()
+        This is called when a library is opened, see
+        _MainWindow._openDatabase(). The thumbnail cache of the library is
+        loaded, thumbnails of files no longer in the library are deleted,
+        all pdfs in the library are queued to self.thumbnail_service at a
+        low priority, and docs around the visible rows of the doc table are
+        put in front of them by warmThumbnails(). Pre-rendering is stopped
+        in clearData() when the library is closed.
         '''
 
-        if not hasPoppler():
-            return
-
         lib_folder=self.settings.value('saving/current_lib_folder', type=str)
-        cache_folder=os.path.join(lib_folder, '_cache')
         file_folder=os.path.join(lib_folder, '_collections')
         dpi=self.settings.value('view/thumbnail_dpi', type=str)
+        n_pages=self.settings.value('view/thumbnail_pages', 1, type=int)
+        max_mb=self.settings.value('view/thumbnail_cache_mb', 200, type=int)
 
-        files=os.listdir(file_folder)
-
-        def setlimits():
-            # Set maximum CPU time to n second in child process,
-            # after fork() but before exec()
-            #print("Setting resource limit in child (pid %d)" % os.getpid())
-            resource.setrlimit(resource.RLIMIT_CPU, (0.2, 0.3))
-
-        def _createTN():
-
-            if len(files)==0:
-                return
-
-            fii=files.pop()
-
-            #-----------Try finding saved thumbnail-----------
-            glob_paths=os.path.join(cache_folder, '%s-%s*.jpg' %(fii, dpi))
-            outfiles=glob.glob(glob_paths)
-            if len(outfiles)>0:
-                # if exists, call itself after short delay
-                QTimer.singleShot(5, lambda : _createTN())
-                return
-
-            pii=os.path.join(file_folder, fii)
-            outfileii=os.path.join(cache_folder, '%s-%s' %(fii, dpi))
-            cmd=['pdftoppm', pii, outfileii, '-jpeg', '-r', dpi]
-
-            try:
-                proc=subprocess.Popen(cmd, stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE)
-                    #preexec_fn=setlimits)
-                proc.wait()
-            except Exception as e:
-                self.logger.exception('e = %s' %e)
-                # if fail, call itself after short delay
-                QTimer.singleShot(5, lambda : _createTN())
-                return
-            else:
-                self.logger.debug('Generated a new thumbnail for %s' %fii)
-                # if success, call itself after longer delay
-                QTimer.singleShot(4000, lambda : _createTN())
-                return
+        try:
+            files=sorted(os.listdir(file_folder))
+        except OSError:
+            files=[]
+        relpaths=[os.path.join('_collections', fii) for fii in files]
 
-        # stop on lib closing
-        if not self.parent.is_loaded:
+        cache=ThumbnailCache(lib_folder, max_size=max_mb<<20)
+        cache.prune(relpaths)
+        self.thumbnail_service.setCache(cache)
+
+        if not hasPoppler():
             return
 
-        # the setlimits() doesn't seem to be enough, this is taking
-        # too much resource and then fan goes crazy.
-        # Can't use sleep which will block
-        QTimer.singleShot(5, lambda : _createTN())
+        jobs=[(relii, dpi, 1, n_pages) for relii in relpaths
+                if relii.lower().endswith('.pdf')]
+        self.thumbnail_service.warm(jobs, priority=False)
+        self.logger.info('Queued %d pdfs to pre-render thumbnails' %len(jobs))
+
+        self.thumbnail_warm_timer.start()
+
+        return
+
+
+    def warmThumbnails(self, n_rows=200):
+        '''Put docs around the visible doc table rows first to pre-render
+
+        Kwargs:
+            n_rows (int): max number of rows below and above the visible
+                          ones to queue.
+
+        This is the slot to self.thumbnail_warm_timer, which is restarted
+        on user activity, see noteUserActivity().
+        '''
+
+        if not hasPoppler() or not self.parent.is_loaded or self.lib_loading:
+            return
+
+        dpi=self.settings.value('view/thumbnail_dpi', type=str)
+        n_pages=self.settings.value('view/thumbnail_pages', 1, type=int)
+
+        rows=self._tabledata
+        if len(rows)==0:
+            self.thumbnail_service.warm([])
+            return
+
+        top=max(0, self.doc_table.rowAt(0))
+        bottom=self.doc_table.rowAt(self.doc_table.viewport().height())
+        if bottom<0:
+            bottom=len(rows)-1
+
+        # visible rows, then the ones below, then the ones above
+        order=list(range(top, bottom+1))+\
+                list(range(bottom+1, min(len(rows), bottom+1+n_rows)))+\
+                list(range(top-1, max(-1, top-1-n_rows), -1))
+
+        jobs=[]
+        for rii in order:
+            meta=self.meta_dict.get(rows[rii][0])
+            if meta is None or not meta['has_file']:
+                continue
+            relii=meta['files_l'][0]
+            if relii.lower().endswith('.pdf'):
+                jobs.append((relii, dpi, 1, n_pages))
+
+        self.thumbnail_service.warm(jobs)
+
+        return
+
+
+    def noteUserActivity(self, *args):
+        '''Pause pre-rendering thumbnails and re-queue visible docs
+
+        This is called on doc table selection and scrolling, see
+        warmThumbnails().
+        '''
+
+        self.thumbnail_service.touch()
+        if self.parent.is_loaded:
+            self.thumbnail_warm_timer.start()
 
         return
 
@@ -473,34 +473,21 @@ class MainFrameToolBarSlots:
         these are passed as input args to the search function defined in
         lib/widgets/search_res_frame.py
 
-        NOTE that as search is done in the sqlite data, a saving is first
-        called.
+        NOTE that as full text search is done in the sqlite data, a saving is
+        first called if 'PDF' is among the search fields.
         """
 
         if not self.parent.is_loaded:
             return
 
+        self.search_timer.stop()
         text=self.search_bar.text()
         self.logger.info('Searched term = %s' %text)
 
         if len(text)==0:
             return
 
-        #-----------Get search fields and option-----------
-        menu=self.search_button.menu()
-        actions=menu.findChildren(QtWidgets.QWidgetAction)
-        new_search_fields=[]
-
-        for actii in actions:
-            wii=actii.defaultWidget()
-            self.logger.info('action %s isChecked() = %s'\
-                    %(actii.text(), wii.isChecked()))
-
-            if actii.text()=='Include sub-folders':
-                desend=wii.isChecked()
-            else:
-                if wii.isChecked():
-                    new_search_fields.append(actii.text())
+        new_search_fields, desend=self.getSearchOptions()
 
         self.settings.setValue('search/search_fields',new_search_fields)
         self.settings.setValue('search/desend_folder',desend)
@@ -514,15 +501,88 @@ class MainFrameToolBarSlots:
             msg.exec_()
             return
 
-        current_folder=self._current_folder
+        # NOTE: need to write to sqlite before searching in sqlite. Meta data
+        # are searched in the in-memory index, if available.
+        if 'PDF' in new_search_fields or self.meta_index is None or\
+                not self.meta_index.hasFields(new_search_fields):
+            self.saveToDatabase(block=True)
+
+        self.startSearch(text, new_search_fields, desend)
+
+        return
+
+
+    @pyqtSlot()
+    def liveSearch(self):
+        """Search meta data as the search bar is being edited
+
+        This is a slot to the timeout signal of self.search_timer, which is
+        restarted on every edit in the search bar, so a search is done after
+        a pause in typing.
+
+        Only the in-memory meta data index is searched. Full text search
+        ('PDF' field), and fields not indexed in a lazily loaded library, are
+        left to the search button and returnPressed.
+        """
+
+        if not self.parent.is_loaded or self.meta_index is None:
+            return
+
+        text=self.search_bar.text().strip()
+        if len(text)<2:
+            return
+
+        search_fields, desend=self.getSearchOptions()
+        search_fields=[ii for ii in search_fields if ii!='PDF']
+        if len(search_fields)==0 or not self.meta_index.hasFields(search_fields):
+            return
+
+        self.logger.debug('Live search term = %s' %text)
+        self.startSearch(text, search_fields, desend)
+
+        return
 
-        # NOTE: need to write to sqlite before searching
-        self.saveToDatabase()
+
+    def getSearchOptions(self):
+        """Get search fields and option from the search button menu
+
+        Returns:
+            search_fields (list): names of checked fields, e.g. 'Authors',
+                                  'Title', 'PDF'.
+            desend (bool): whether to include sub-folders.
+        """
+
+        menu=self.search_button.menu()
+        actions=menu.findChildren(QtWidgets.QWidgetAction)
+        search_fields=[]
+        desend=False
+
+        for actii in actions:
+            wii=actii.defaultWidget()
+            if actii.text()=='Include sub-folders':
+                desend=wii.isChecked()
+            else:
+                if wii.isChecked():
+                    search_fields.append(actii.text())
+
+        return search_fields, desend
+
+
+    def startSearch(self, text, search_fields, desend):
+        """Search in current folder and show results
+
+        Args:
+            text (str): searched term.
+            search_fields (list): names of fields to search.
+            desend (bool): whether to include sub-folders.
+        """
+
+        current_folder=self._current_folder
 
         # NOTE: order matters here:
         self.status_bar.showMessage('Searching ...')
         self.doc_table.setVisible(False)
-        self.search_res_frame.search(self.db, text, new_search_fields,
+        self.search_res_frame.search(self.db, text, search_fields,
                 current_folder[1], self.meta_dict, self.folder_data, desend)
 
         return
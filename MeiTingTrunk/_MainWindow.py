@@ -28,8 +28,9 @@ from PyQt5.QtGui import QIcon, QFont, QBrush, QColor
 from . import _MainFrame
 from . import resources
 from .lib import sqlitedb, tools
+from .lib.metaindex import MetaIndex
 from .lib.widgets import PreferenceDialog, ExportDialog, ThreadRunDialog,\
-        ImportDialog, AboutDialog, MergeNameDialog, SimpleWorker,\
+        ImportDialog, AboutDialog, MergeNameDialog, StreamWorker,\
         ZimDialog
 if tools.isXapianReady():
     from .lib import xapiandb
@@ -64,6 +65,9 @@ New session started
         ''')
         self.settings=self.initSettings()
         self.is_loaded=False  # is any database opended
+        # worker and thread reading an opening database, see loadSqlite()
+        self.load_worker=None
+        self.load_thread=None
 
         self.main_frame=_MainFrame.MainFrame(self.settings, self)
         self.main_frame.view_change_sig.connect(self.viewChangeResponse)
@@ -124,6 +128,8 @@ New session started
             settings.setValue('file/recent_open', [])
             settings.setValue('file/recent_open_num', 2)
             settings.setValue('file/auto_open_last', 1)
+            # keep only light meta data fields in memory
+            settings.setValue('file/lazy_load_meta', 0)
 
             # default storage folder
             storage_folder=os.path.join(str(pathlib.Path.home()),
@@ -164,6 +170,10 @@ New session started
 
             # pdf thumbnail dpi
             settings.setValue('view/thumbnail_dpi', 30)
+            # number of pdf pages shown in the PDF tab
+            settings.setValue('view/thumbnail_pages', 1)
+            # max size of pdf thumbnail cache, in MB
+            settings.setValue('view/thumbnail_cache_mb', 200)
 
             # use zim as default note source
             settings.setValue('saving/use_zim_default', False)
@@ -343,7 +353,11 @@ New session started
             choice=QtWidgets.QMessageBox.Discard
 
         if choice==QtWidgets.QMessageBox.Yes:
-            self.saveDatabaseTriggered()
+            self.stopLoadSqlite()
+            # save in the GUI thread, so it finishes before quitting
+            self.main_frame.saveToDatabase(block=True)
+            self.main_frame.stopIndexService(cancel=True)
+            self.main_frame.thumbnail_service.stop()
             #self.closeDatabaseTriggered(ask=False)
             self.logger.info('settings.sync()')
             self.settings.sync()
@@ -351,6 +365,9 @@ New session started
         elif choice==QtWidgets.QMessageBox.Cancel:
             event.ignore()
         elif choice==QtWidgets.QMessageBox.Discard:
+            self.stopLoadSqlite()
+            self.main_frame.stopIndexService(cancel=True)
+            self.main_frame.thumbnail_service.stop()
             #self.closeDatabaseTriggered(ask=False)
             self.logger.info('settings.sync()')
             self.settings.sync()
@@ -593,6 +610,18 @@ New session started
             if tools.isXapianReady():
                 self.main_frame.enablePDFSearch()
 
+        #-------------Start xapian indexing service-------------
+        if tools.isXapianReady() and os.path.exists(lib_xapian_folder):
+            self.main_frame.search_session=xapiandb.SearchSession(
+                    lib_xapian_folder, fname, self.current_lib_folder)
+            self.main_frame.index_service=xapiandb.IndexService(
+                    lib_xapian_folder, self.current_lib_folder, fname,
+                    status_callback=self.main_frame.index_status_sig.emit,
+                    changed_callback=self.main_frame.search_session.markChanged)
+            self.main_frame.index_service.start()
+            # pick up files changed outside MTT, unchanged ones are skipped
+            self.main_frame.index_service.addFolder()
+
         #---------------Create cache folder---------------
         lib_cache_folder=os.path.join(self.current_lib_folder,'_cache')
         if not os.path.exists(lib_cache_folder):
@@ -601,7 +630,7 @@ New session started
 
         #---------------------Actions---------------------
         self.main_frame.auto_save_timer.start()
-        self.startThumbnailThread()
+        self.main_frame.startThumbnailWarmer()
 
         self.logger.info('Start auto save timer.')
 
@@ -640,15 +669,13 @@ New session started
         Args:
             fname (str): file path to the sqlite database.
         Kwargs:
-            load_to_gui (bool): if True, call main_frame.loadLibTree() to
-                update GUI data. Otherwise only store data.
+            load_to_gui (bool): if True, read data in a separate thread and
+                load into GUI as it comes, see loadSqliteData(). Otherwise
+                only store data.
         '''
 
         self.main_frame.status_bar.showMessage('Opening database...')
         QtWidgets.QApplication.processEvents() # needed?
-        # progressbar won't work atm, as the sqlitedb is in the same GUI thread.
-        #self.main_frame.progressbar.setVisible(True)
-        #self.main_frame.progressbar.setMaximum(0)
         try:
             db = sqlite3.connect(fname)
             self.logger.info('Connected to database: %s' %fname)
@@ -657,29 +684,139 @@ New session started
             return
 
         self.db=db
-        # read and parse data
-        meta_dict,folder_data,folder_dict=sqlitedb.readSqlite(db)
-
-        # clear 'Opening database' message. This has to happen before loadLibTree()
-        # otherwise table row message will be cleared.
-        self.main_frame.status_bar.clearMessage()
+        # upgrade older libraries, e.g. add indexes
+        sqlitedb.migrateDatabase(db)
+        lazy=self.settings.value('file/lazy_load_meta',0,type=int)==1
 
         # load data into GUI
         if load_to_gui:
-            self.main_frame.loadLibTree(db,meta_dict,folder_data,folder_dict)
+
+            def loadFunc(progress_callback=None):
+                # sqlite connections can't be shared across threads
+                dbii=sqlite3.connect(fname)
+                meta_dict={}
+                try:
+                    for resii in sqlitedb.iterSqlite(dbii, lazy,
+                            progress_callback=progress_callback):
+                        if resii[0]=='docs':
+                            meta_dict.update(resii[1])
+                        yield resii
+                finally:
+                    dbii.close()
+
+                # index here to not block the gui thread on large libraries
+                yield ('index', MetaIndex(meta_dict))
+
+            self.main_frame.progressbar.setVisible(True)
+            self.main_frame.progressbar.setMaximum(0)
+
+            self.load_thread=QThread()
+            self.load_worker=StreamWorker(0, loadFunc)
+            self.load_worker.moveToThread(self.load_thread)
+            self.load_worker.data_signal.connect(self.loadSqliteData)
+            self.load_worker.progress_signal.connect(self.loadSqliteProgress)
+            self.load_worker.done_signal.connect(self.load_thread.quit,
+                    Qt.DirectConnection)
+            self.load_worker.done_signal.connect(self.loadSqliteDone)
+            self.load_thread.started.connect(self.load_worker.processJob)
+            self.load_thread.start()
         else:
             # this is for updating some data from sqlite without re-loading
             # gui
+            meta_dict,folder_data,folder_dict=sqlitedb.readSqlite(db, lazy)
+            self.main_frame.status_bar.clearMessage()
             self.main_frame.db=db
             self.main_frame.meta_dict=meta_dict
             self.main_frame.folder_data=folder_data
             self.main_frame.folder_dict=folder_dict
+            self.main_frame.meta_index=MetaIndex(meta_dict)
 
         self.is_loaded=True
 
         return
 
 
+    @pyqtSlot(object)
+    def loadSqliteData(self, data):
+        '''Load a piece of data read from sqlite into GUI
+
+        Args:
+            data (tuple): ('folders', folder_dict, folder_data) or
+                ('docs', meta_dict, folder_data), see sqlitedb.iterSqlite(),
+                or ('index', meta_index) after all docs are read.
+
+        This is the slot to the data_signal of the worker started in
+        loadSqlite(). The folder tree is shown first, and the doc table once
+        the 1st chunk of docs arrives.
+        '''
+
+        # from a worker stopped by closing the library
+        if self.load_worker is None or self.sender() is not self.load_worker:
+            return
+
+        if data[0]=='folders':
+            _, folder_dict, folder_data=data
+            # clear 'Opening database' message. This has to happen before
+            # loadLibTree() otherwise table row message will be cleared.
+            self.main_frame.status_bar.clearMessage()
+            self.main_frame.startLoadLib(self.db, folder_dict, folder_data)
+        elif data[0]=='index':
+            self.main_frame.setMetaIndex(data[1])
+        else:
+            _, meta_dict, folder_data=data
+            self.main_frame.loadDocChunk(meta_dict, folder_data)
+
+        return
+
+
+    @pyqtSlot(int, int)
+    def loadSqliteProgress(self, n_done, n_total):
+        '''Show the number of docs read from sqlite in progressbar'''
+
+        if self.load_worker is None or self.sender() is not self.load_worker:
+            return
+
+        self.main_frame.progressbar.setMaximum(n_total)
+        self.main_frame.progressbar.setValue(n_done)
+
+        return
+
+
+    @pyqtSlot()
+    def loadSqliteDone(self):
+        '''Finish loading after all data are read from sqlite'''
+
+        if self.load_worker is None or self.sender() is not self.load_worker:
+            return
+
+        failed=self.load_worker.failed
+        self.load_worker=None
+        self.main_frame.progressbar.setVisible(False)
+        self.main_frame.loadLibDone()
+
+        if failed:
+            self.main_frame.status_bar.showMessage(
+                    'Failed to read all data from database.')
+
+        return
+
+
+    def stopLoadSqlite(self):
+        '''Stop reading sqlite in the worker started in loadSqlite()'''
+
+        if self.load_worker is None:
+            return
+
+        self.logger.info('Stop loading database.')
+        self.load_worker.abort=True
+        self.load_worker=None
+        self.load_thread.quit()
+        self.load_thread.wait()
+        self.main_frame.progressbar.setVisible(False)
+
+        return
+
+
     @pyqtSlot()
     def saveDatabaseTriggered(self):
         self.main_frame.saveToDatabase()
@@ -696,10 +833,10 @@ New session started
 
         if not ask or (ask and choice==QtWidgets.QMessageBox.Yes):
 
+            self.stopLoadSqlite()
             self.main_frame.clearData()
+            self.main_frame.stopIndexService(cancel=True)
             self.is_loaded=False
-            self.thumbnail_td.quit()
-            self.thumbnail_td.wait()
 
             self.import_action.setEnabled(True)
             self.export_action.setEnabled(False)
@@ -832,20 +969,3 @@ New session started
         """
 
         self.view_action_dict[view_name].setChecked(state)
-
-
-    def startThumbnailThread(self):
-        '''Start the thumbnail generation thread
-
-        Will start a QThread to call function createThumbnails(), which is
-        stopped by setting is_loaded=False and calling the quit() and wait()
-        on the thread. See closeDatabaseTriggered().
-        '''
-
-        self.thumbnail_td=QThread()
-        self.thumbnail_worker=SimpleWorker(0,self.main_frame.createThumbnails)
-        self.thumbnail_worker.moveToThread(self.thumbnail_td)
-        self.thumbnail_td.started.connect(self.thumbnail_worker.processJob)
-        self.thumbnail_td.start()
-
-        return
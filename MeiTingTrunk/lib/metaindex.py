@@ -0,0 +1,300 @@
+'''
+In-memory inverted index of doc meta data, for search-as-you-type.
+
+MeiTing Trunk
+An open source reference management tool developed in PyQt5 and Python3.
+
+Copyright 2018-2019 Guang-zhi XU
+
+This file is distributed under the terms of the
+GPLv3 licence. See the LICENSE file for details.
+You may use, distribute and modify this code under the
+terms of the GPLv3 license.
+'''
+
+import re
+import logging
+from bisect import bisect_left, insort
+from .sqlitedb import LazyDocMeta
+
+LOGGER=logging.getLogger(__name__)
+
+
+# search bar field name: field name in results
+FIELDS={
+        'Authors'     : 'authors',
+        'Title'       : 'title',
+        'Keywords'    : 'keywords',
+        'Tags'        : 'tag',
+        'Notes'       : 'note',
+        'Publication' : 'publication',
+        'Abstract'    : 'abstract',
+        'Citationkey' : 'citationkey'
+        }
+
+# fields of LazyDocMeta not kept in memory, left to sqlite fts
+LAZY_FIELDS=['Notes', 'Abstract']
+
+TOKEN_RE=re.compile(r'\w+')
+
+
+def tokenize(text):
+    '''Split a text into lower case word tokens
+
+    Args:
+        text (str or None): text to split.
+
+    Returns:
+        tokens (set): set of tokens.
+    '''
+
+    if not text:
+        return set()
+
+    return set(TOKEN_RE.findall(text.lower()))
+
+
+def getFieldTexts(meta, fields=None):
+    '''Get the searchable texts of a doc
+
+    Args:
+        meta (DocMeta): meta data dict of a doc.
+    Kwargs:
+        fields (list or None): field names in results to get. If None, get
+                               all.
+
+    Returns:
+        texts (dict): {field name in results: text}.
+    '''
+
+    getters={
+            'authors'     : lambda: ' '.join(meta['firstNames_l']+meta['lastName_l']),
+            'title'       : lambda: meta['title'],
+            'keywords'    : lambda: ' '.join(meta['keywords_l']),
+            'tag'         : lambda: ' '.join(meta['tags_l']),
+            'note'        : lambda: meta['notes'],
+            'publication' : lambda: meta['publication'],
+            'abstract'    : lambda: meta['abstract'],
+            'citationkey' : lambda: meta['citationkey']
+            }
+
+    if fields is None:
+        fields=FIELDS.values()
+
+    return dict([(fii, getters[fii]()) for fii in fields])
+
+
+class MetaIndex(object):
+
+    def __init__(self, meta_dict=None):
+        '''Token and prefix inverted index of doc meta data
+
+        Kwargs:
+            meta_dict (dict or None): meta data of all docs in the library.
+                                      keys: docid, values: DocMeta dict.
+
+        For each field, a token maps to the set of docs having it, and a
+        sorted list of tokens is kept to find tokens by prefix. The index
+        is built from the meta_dict read by the library loading worker, see
+        _MainWindow.loadSqlite(), and each edited doc is re-indexed by
+        updateDoc(), so unsaved changes are searchable.
+
+        If the library is loaded lazily (docs are LazyDocMeta), fields in
+        LAZY_FIELDS are not indexed, see hasFields().
+        '''
+
+        self.fields=dict(FIELDS)
+        self.clear()
+        if meta_dict is not None:
+            self.build(meta_dict)
+
+
+    def clear(self):
+
+        self.postings=dict([(ii, {}) for ii in self.fields.values()])
+        self.vocabs=dict([(ii, []) for ii in self.fields.values()])
+        # texts indexed for each doc, to find its tokens when removing it
+        self.doc_texts={}
+
+        return
+
+
+    def build(self, meta_dict):
+        '''Index all docs
+
+        Args:
+            meta_dict (dict): meta data of all docs in the library.
+        '''
+
+        lazy=any(isinstance(vv, LazyDocMeta) for vv in meta_dict.values())
+        self.fields=dict([(kk, vv) for kk, vv in FIELDS.items()
+            if not (lazy and kk in LAZY_FIELDS)])
+
+        self.clear()
+        fields=list(self.fields.values())
+        findall=TOKEN_RE.findall
+        for docid, meta in meta_dict.items():
+            if meta is None:
+                continue
+            texts=getFieldTexts(meta, fields)
+            self.doc_texts[docid]=texts
+            for fieldii, textii in texts.items():
+                if not textii:
+                    continue
+                postings=self.postings[fieldii]
+                for tii in findall(textii.lower()):
+                    docs=postings.get(tii)
+                    if docs is None:
+                        postings[tii]={docid}
+                    else:
+                        docs.add(docid)
+
+        for fieldii, postings in self.postings.items():
+            self.vocabs[fieldii]=sorted(postings.keys())
+
+        LOGGER.info('Indexed %d docs' %len(self.doc_texts))
+
+        return
+
+
+    def removeDoc(self, docid):
+        '''Remove a doc from index
+
+        Args:
+            docid (int): id of doc.
+        '''
+
+        texts=self.doc_texts.pop(docid, None)
+        if texts is None:
+            return
+
+        for fieldii, textii in texts.items():
+            postings=self.postings[fieldii]
+            for tii in tokenize(textii):
+                docs=postings[tii]
+                docs.discard(docid)
+                if len(docs)==0:
+                    del postings[tii]
+                    vocab=self.vocabs[fieldii]
+                    del vocab[bisect_left(vocab, tii)]
+
+        return
+
+
+    def updateDoc(self, docid, meta):
+        '''Re-index a doc
+
+        Args:
+            docid (int): id of doc.
+            meta (DocMeta or None): new meta data of doc. If None, remove doc.
+        '''
+
+        if meta is None:
+            self.removeDoc(docid)
+            return
+
+        texts=getFieldTexts(meta, list(self.fields.values()))
+        if texts==self.doc_texts.get(docid):
+            return
+
+        self.removeDoc(docid)
+        self.doc_texts[docid]=texts
+        for fieldii, textii in texts.items():
+            postings=self.postings[fieldii]
+            for tii in tokenize(textii):
+                if tii not in postings:
+                    postings[tii]=set()
+                    insort(self.vocabs[fieldii], tii)
+                postings[tii].add(docid)
+
+        return
+
+
+    def hasFields(self, field_list):
+        '''Check all given search fields are indexed
+
+        Args:
+            field_list (list): list of search bar field names, e.g. 'Title'.
+                               Fields not searched by the index, e.g. 'PDF',
+                               are ignored.
+
+        Returns:
+            result (bool): False if any field can't be searched in the index.
+        '''
+
+        return all([kk in self.fields for kk in field_list if kk in FIELDS])
+
+
+    def matchPrefix(self, field, prefix):
+        '''Get docs having a token starting with a given prefix in a field
+
+        Args:
+            field (str): field name in results, e.g. 'title'.
+            prefix (str): lower case token prefix.
+
+        Returns:
+            docs (set): ids of matched docs.
+        '''
+
+        postings=self.postings[field]
+        vocab=self.vocabs[field]
+
+        idx=bisect_left(vocab, prefix)
+        docs=set()
+        while idx<len(vocab) and vocab[idx].startswith(prefix):
+            docs.update(postings[vocab[idx]])
+            idx+=1
+
+        return docs
+
+
+    def search(self, text, field_list, docids=None):
+        '''Search docs by words
+
+        Args:
+            text (str): search text.
+            field_list (list): list of fields to search, including 'Authors',
+                              'Title', 'Keywords', 'Tags', 'Notes',
+                              'Publication', 'Abstract', 'Citationkey'.
+        Kwargs:
+            docids (list or None): only search within these docs. If None,
+                                   search all docs.
+
+        Returns: rec (list): list of doc ids matching search, together with
+            the field names where the match is found, in the same format as
+            sqlitefts.searchMultipleLike2(). E.g.
+
+            [(1, 'authors,title'),
+             (10, 'title,keywords'),
+             ...
+            ]
+
+        Each word in <text> is matched as a token prefix, and a doc matches
+        if all words are found in the searched fields.
+        '''
+
+        words=sorted(tokenize(text))
+        fields=[self.fields[kk] for kk in field_list if kk in self.fields]
+        if len(words)==0 or len(fields)==0:
+            return []
+
+        matched=None
+        field_hits=dict([(fii, set()) for fii in fields])
+        for wii in words:
+            docsii=set()
+            for fii in fields:
+                hitsii=self.matchPrefix(fii, wii)
+                docsii.update(hitsii)
+                field_hits[fii].update(hitsii)
+            matched=docsii if matched is None else matched & docsii
+
+        if docids is not None:
+            matched=matched.intersection(docids)
+
+        # fields where any word is found
+        field_hits=[(fii, hitsii) for fii, hitsii in field_hits.items()
+                if len(hitsii)>0]
+        results=[(docid, ','.join([fii for fii, hitsii in field_hits
+            if docid in hitsii])) for docid in sorted(matched)]
+
+        return results
@@ -18,14 +18,14 @@ import os
 import shutil
 import time
 import re
-import multiprocessing
 from urllib.parse import quote
 from datetime import datetime
 import sqlite3
 import logging
+import threading
 from send2trash import send2trash
-from collections import MutableMapping
-from .tools import autoRename, isXapianReady, parseAuthors, delThumbnails
+from collections import MutableMapping, OrderedDict
+from .tools import autoRename, isXapianReady, parseAuthors, getSqlitePath
 if isXapianReady():
     from . import xapiandb
 
@@ -48,6 +48,132 @@ DOC_ATTRS=[\
 
 INT_COLUMNS=['month', 'year', 'day']
 
+# single-valued fields read from the Documents table into DocMeta
+META_FIELDS=['citationkey','title','issue','pages',\
+        'publication','volume','year','doi','abstract',\
+        'arxivId','chapter','city','country','edition','institution',\
+        'isbn','issn','month','day','publisher','series','type',\
+        'read','favourite','pmid','added','confirmed', 'deletionPending']
+
+# keys of DocMeta
+DOC_KEYS=['id', 'title', 'issue', 'pages', 'publication', 'volume', 'year',
+        'doi', 'abstract', 'arxivId', 'chapter', 'city', 'country',
+        'edition', 'institution', 'isbn', 'issn', 'month', 'day',
+        'publisher', 'series', 'type', 'read', 'favourite', 'pmid', 'added',
+        'confirmed', 'firstNames_l', 'lastName_l', 'keywords_l', 'files_l',
+        'folders_l', 'tags_l', 'urls_l', 'deletionPending', 'notes']
+DOC_KEY_SET=frozenset(DOC_KEYS)
+
+# default values of DocMeta keys other than None. '_l' keys default to [],
+# 'added' to the current time.
+DOC_DEFAULTS={'type': 'article', 'read': 'false', 'favourite': 'false',
+        'confirmed': 'false', 'deletionPending': 'false'}
+
+# fields not kept in memory when a library is loaded lazily, see LazyDocMeta.
+# Fields shown in the doc table, or needed to build folders, filters and the
+# in-memory search index are kept.
+LAZY_FIELDS=['issue', 'pages', 'volume', 'doi', 'abstract', 'arxivId',
+        'chapter', 'city', 'country', 'edition', 'institution', 'isbn',
+        'issn', 'month', 'day', 'publisher', 'series', 'type', 'pmid',
+        'notes', 'urls_l', 'files_l']
+
+# re-compute the DocumentSearch row of a doc, given by %(did)s. The old row
+# is deleted first by the triggers: no 'OR REPLACE' here, as a trigger takes
+# the conflict policy of the outer statement, e.g. the 'INSERT OR IGNORE' in
+# insertToTable(), and fts5 raises on a duplicate rowid.
+SEARCH_INDEX_SYNC='''INSERT INTO DocumentSearch (rowid, title,
+    authors, keywords, tags, notes, publication, abstract, citationkey)
+    SELECT Documents.id, Documents.title,
+    (SELECT group_concat(ifnull(firstNames,'') || ' ' || ifnull(lastName,''), '; ')
+        FROM DocumentContributors WHERE did=Documents.id),
+    (SELECT group_concat(text, '; ') FROM DocumentKeywords
+        WHERE did=Documents.id),
+    (SELECT group_concat(tag, '; ') FROM DocumentTags
+        WHERE did=Documents.id),
+    (SELECT group_concat(note, '; ') FROM DocumentNotes
+        WHERE did=Documents.id),
+    Documents.publication, Documents.abstract, Documents.citationKey
+    FROM Documents WHERE %(did)s'''
+
+SEARCH_INDEX_TABLES=['DocumentContributors', 'DocumentKeywords',
+        'DocumentTags', 'DocumentNotes']
+
+def _searchIndexTriggers():
+    '''Triggers keeping the DocumentSearch fts5 table in sync'''
+
+    def body(did):
+        return '''DELETE FROM DocumentSearch WHERE rowid=%s; %s;'''\
+                %(did, SEARCH_INDEX_SYNC %{'did': 'Documents.id=%s' %did})
+
+    triggers=[
+        '''CREATE TRIGGER IF NOT EXISTS DocumentSearch_Documents_ai
+        AFTER INSERT ON Documents BEGIN %s END''' %body('NEW.id'),
+        '''CREATE TRIGGER IF NOT EXISTS DocumentSearch_Documents_au
+        AFTER UPDATE ON Documents BEGIN %s END''' %body('NEW.id'),
+        '''CREATE TRIGGER IF NOT EXISTS DocumentSearch_Documents_ad
+        AFTER DELETE ON Documents BEGIN
+        DELETE FROM DocumentSearch WHERE rowid=OLD.id; END'''
+        ]
+
+    for tii in SEARCH_INDEX_TABLES:
+        for eventjj, rowjj in [('INSERT', 'NEW'), ('UPDATE', 'NEW'),
+                ('DELETE', 'OLD')]:
+            triggers.append('''CREATE TRIGGER IF NOT EXISTS DocumentSearch_%s_%s
+            AFTER %s ON %s BEGIN %s END''' %(tii, eventjj[0].lower(), eventjj,
+                tii, body('%s.did' %rowjj)))
+
+    return triggers
+
+
+def _dropSearchIndexTriggers():
+    '''Drop the DocumentSearch triggers, to re-create them'''
+
+    triggers=['DROP TRIGGER IF EXISTS DocumentSearch_Documents_a%s' %eii
+            for eii in 'iud']
+    for tii in SEARCH_INDEX_TABLES:
+        for eii in 'iud':
+            triggers.append('DROP TRIGGER IF EXISTS DocumentSearch_%s_%s'\
+                    %(tii, eii))
+
+    return triggers
+
+
+# schema migration steps. Step ii upgrades schema version ii to ii+1.
+SCHEMA_MIGRATIONS=[
+    # version 1: indexes on the doc id and folder id columns
+    ['CREATE INDEX IF NOT EXISTS DocumentTags_did ON DocumentTags (did)',
+     'CREATE INDEX IF NOT EXISTS DocumentNotes_did ON DocumentNotes (did)',
+     'CREATE INDEX IF NOT EXISTS DocumentKeywords_did ON DocumentKeywords (did)',
+     'CREATE INDEX IF NOT EXISTS DocumentFolders_did ON DocumentFolders (did)',
+     'CREATE INDEX IF NOT EXISTS DocumentFolders_folderid ON DocumentFolders (folderid)',
+     'CREATE INDEX IF NOT EXISTS DocumentContributors_did ON DocumentContributors (did)',
+     'CREATE INDEX IF NOT EXISTS DocumentFiles_did ON DocumentFiles (did)',
+     'CREATE INDEX IF NOT EXISTS DocumentUrls_did ON DocumentUrls (did)'],
+    # version 2: manifest of attachment files in the xapian index
+    ['''CREATE TABLE IF NOT EXISTS IndexManifest (
+     relpath TEXT PRIMARY KEY,
+     size INT,
+     mtime REAL,
+     hash TEXT,
+     xapian_docid INT,
+     state TEXT
+     )''',
+     'CREATE INDEX IF NOT EXISTS DocumentFiles_relpath ON DocumentFiles (relpath)'],
+    # version 3: fts5 index of doc meta data, see sqlitefts.searchMultipleFTS()
+    ['''CREATE VIRTUAL TABLE IF NOT EXISTS DocumentSearch USING fts5(
+     title, authors, keywords, tags, notes, publication, abstract,
+     citationkey, prefix='2 3')''',
+     'DELETE FROM DocumentSearch',
+     SEARCH_INDEX_SYNC %{'did': '1'}]+_searchIndexTriggers(),
+    # version 4: walk down folder tree, see sqlitefts.SUBFOLDERS_CTE
+    ['CREATE INDEX IF NOT EXISTS Folders_parentId ON Folders (parentId)'],
+    # version 5: re-create DocumentSearch triggers of version 3, which used
+    # 'INSERT OR REPLACE' and failed inside 'INSERT OR IGNORE' statements
+    _dropSearchIndexTriggers()+_searchIndexTriggers(),
+    ]
+
+SCHEMA_VERSION=len(SCHEMA_MIGRATIONS)
+
 LOGGER=logging.getLogger(__name__)
 
 
@@ -59,54 +185,73 @@ class DocMeta(MutableMapping):
     Some values are returned in a getter manner.
 
     keys ending with '_l' suffix denotes a list value, e.g. 'authors_l'.
+
+    Values are held in slots rather than a per-doc dict. Keys with the
+    default value are not stored, lists are created on first access and the
+    default 'added' time is taken then. The derived 'authors_l' and
+    'citationkey' are cached until their inputs are re-assigned, so author
+    lists should be replaced, not edited in place.
     '''
 
+    __slots__=DOC_KEYS+['_authors', '_citationkey', '_deleted']
+
     def __init__(self, *args, **kwargs):
-        # set defaults
-        self.store = {
-                'id': None, 'title': None, 'issue': None, 'pages': None,
-                'publication': None, 'volume': None, 'year': None,
-                'doi': None, 'abstract': None, 'arxivId': None, 'chapter': None,
-                'city': None, 'country': None, 'edition': None,
-                'institution': None, 'isbn': None, 'issn': None, 'month': None,
-                'day': None, 'publisher': None, 'series': None,
-                'type': 'article',
-                'read': 'false', 'favourite': 'false',
-                'pmid': None, 'added': str(int(time.time())),
-                'confirmed': 'false',
-                'firstNames_l': [],
-                'lastName_l': [],
-                'keywords_l': [],
-                'files_l': [],
-                'folders_l': [],
-                'tags_l': [],
-                'urls_l': [],
-                'deletionPending': 'false',
-                'notes': None
-                }
-
-        self.update(dict(*args, **kwargs))  # use the free update to set keys
+        self._deleted=()
+        if len(args)==1 and not kwargs and isinstance(args[0], DocMeta):
+            # copy stored values only, leaving defaults unset
+            other=args[0]
+            for kk in other:
+                vv=other._stored(kk)
+                if vv is not None:
+                    self[kk]=vv
+        elif args or kwargs:
+            for kk, vv in dict(*args, **kwargs).items():
+                self[kk]=vv
+
+    def _stored(self, key):
+        if key == 'added':
+            return self['added']
+        return getattr(self, key, None)
+
+    def _default(self, key):
+        if key.endswith('_l'):
+            value=[]
+        elif key == 'added':
+            value=str(int(time.time()))
+        else:
+            return DOC_DEFAULTS.get(key)
+        setattr(self, key, value)
+        return value
 
     def __getitem__(self, key):
-        if key == 'has_file':
-            return True if len(self.store['files_l']) > 0 else False
+        if key in DOC_KEY_SET and key not in self._deleted:
+            value=getattr(self, key, None)
+            if value is None:
+                return self._default(key)
+            return value
+        elif key == 'has_file':
+            return bool(getattr(self, 'files_l', None))
         elif key == 'authors_l':
-            return zipAuthors(self.store['firstNames_l'],
-                    self.store['lastName_l'])
+            authors=getattr(self, '_authors', None)
+            if authors is None:
+                authors=tuple(zipAuthors(
+                    getattr(self, 'firstNames_l', None) or [],
+                    getattr(self, 'lastName_l', None) or []))
+                self._authors=authors
+            return list(authors)
         elif key == 'citationkey':
-            ck = self.store.get('citationkey',None)
-            if ck:
-                return ck
-            else:
-                last = self.store.get('lastName_l',[])
-                year = self.store.get('year',None)
+            ck=getattr(self, '_citationkey', None)
+            if ck is None:
+                last=getattr(self, 'lastName_l', None) or []
+                year=getattr(self, 'year', None)
                 if len(last) > 0 and year:
                     ck='%s%s' %(last[0],str(year))
-                    return ck
                 else:
-                    return ''
+                    ck=''
+                self._citationkey=ck
+            return ck
         else:
-            return self.store[key]
+            raise KeyError(key)
 
     def __setitem__(self, key, value):
         if not isinstance(key,str):
@@ -115,32 +260,184 @@ class DocMeta(MutableMapping):
         if key.endswith('_l'):
             if not isinstance(value,(tuple,list)):
                 raise Exception("keys end with '_l' accepts only list or tuple. key: %s, value: %s" %(key, value))
-        if key not in self.store.keys():
+        if key not in DOC_KEY_SET or key in self._deleted:
             return
         if value is None:
             return
 
-        self.store[key] = value
+        setattr(self, key, value)
+        if key in ('firstNames_l', 'lastName_l'):
+            self._authors=None
+        if key in ('lastName_l', 'year'):
+            self._citationkey=None
 
     def __delitem__(self, key):
-        del self.store[key]
+        if key not in DOC_KEY_SET or key in self._deleted:
+            raise KeyError(key)
+        self._deleted=self._deleted+(key,)
+        if hasattr(self, key):
+            delattr(self, key)
 
     def __iter__(self):
-        return iter(self.store)
+        deleted=self._deleted
+        return iter([kk for kk in DOC_KEYS if kk not in deleted])
 
     def __len__(self):
-        return len(self.store)
+        return len(DOC_KEYS)-len(self._deleted)
 
     def __repr__(self):
-        return self.store.__repr__()
+        return dict(self.items()).__repr__()
+
+
+
+class LazyLoader(object):
+
+    def __init__(self, sqlitepath, maxsize=512):
+        '''Read the lazy fields of docs from sqlite, with a LRU cache
+
+        Args:
+            sqlitepath (str): abspath to sqlite database file.
+        Kwargs:
+            maxsize (int): max number of docs to keep in cache.
+
+        Uses its own connection, so that docs can be read outside of the
+        thread that opened the library.
+        '''
+
+        self.sqlitepath=sqlitepath
+        self.maxsize=maxsize
+        self._columns=[kk for kk in META_FIELDS if kk in LAZY_FIELDS]
+        self._db=None
+        self._cache=OrderedDict()
+        self._lock=threading.Lock()
+
+
+    def getSqlite(self):
+
+        if self._db is None:
+            self._db=sqlite3.connect(self.sqlitepath, check_same_thread=False)
+
+        return self._db
+
+
+    def fetch(self, did):
+        '''Query the lazy fields of a doc from sqlite
+
+        Args:
+            did (int): id of doc.
+
+        Returns: result (dict): keys: LAZY_FIELDS, values: values formatted
+            as in getMetaData().
+        '''
+
+        db=self.getSqlite()
+        result={}
+        row=db.execute('SELECT %s FROM Documents WHERE (id=?)'\
+                %', '.join(self._columns), (did,)).fetchone() or []
+        for kii, vii in zip(self._columns, row):
+            result[kii]=DOC_DEFAULTS.get(kii) if vii is None else str(vii)
+
+        result['notes']=fetchField(db,
+                'SELECT note FROM DocumentNotes WHERE (did=?)', (did,))
+        result['urls_l']=fetchField(db,
+                'SELECT url FROM DocumentUrls WHERE (did=?)', (did,),
+                1, 'list')
+        result['files_l']=fetchField(db,
+                'SELECT relpath FROM DocumentFiles WHERE (did=?)', (did,),
+                1, 'list')
+
+        return result
+
+
+    def get(self, did):
+        '''Get the lazy fields of a doc, from cache if possible
+
+        Args:
+            did (int): id of doc.
+
+        Returns: result (dict): keys: LAZY_FIELDS. This is the cached dict,
+            and should not be modified.
+        '''
+
+        with self._lock:
+            result=self._cache.get(did)
+            if result is None:
+                result=self.fetch(did)
+                self._cache[did]=result
+                if len(self._cache)>self.maxsize:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(did)
+
+        return result
+
+
+    def discard(self, did):
+
+        with self._lock:
+            self._cache.pop(did, None)
+
+        return
+
+
+    def clear(self):
+
+        with self._lock:
+            self._cache.clear()
+            if self._db is not None:
+                self._db.close()
+                self._db=None
+
+        return
+
+
+
+class LazyDocMeta(DocMeta):
+    '''A DocMeta dict keeping only the light fields in memory
+
+    Fields in LAZY_FIELDS are read through a LazyLoader when needed (lists
+    are returned as copies of the cached ones), and pinned in the dict once
+    assigned a new value, so edits are not lost when the doc is evicted from
+    the loader's cache. Iterating over the dict gives all keys, so a copy,
+    e.g. DocMeta(lazy_meta), is complete.
+    '''
+
+    __slots__=['loader', '_has_file']
+    lazy_keys=frozenset(LAZY_FIELDS)
 
+    def __init__(self, loader, has_file=False, *args, **kwargs):
+        super(LazyDocMeta, self).__init__(*args, **kwargs)
+        self.loader=loader
+        self._has_file=has_file
 
+    def _stored(self, key):
+        if key in self.lazy_keys and getattr(self, key, None) is None:
+            return self._default(key)
+        return super(LazyDocMeta, self)._stored(key)
 
-def readSqlite(dbin):
+    def _default(self, key):
+        if key in self.lazy_keys:
+            value=self.loader.get(self.id)[key]
+            if value is None:
+                return DOC_DEFAULTS.get(key)
+            return list(value) if key.endswith('_l') else value
+        return super(LazyDocMeta, self)._default(key)
+
+    def __getitem__(self, key):
+        if key == 'has_file' and getattr(self, 'files_l', None) is None:
+            return self._has_file
+        return super(LazyDocMeta, self).__getitem__(key)
+
+
+
+def readSqlite(dbin, lazy=False):
     """Read sqlite data
 
     Args:
         dbin (sqlite connection): connection to sqlite.
+    Kwargs:
+        lazy (bool): if True, don't read the fields in LAZY_FIELDS into
+                     memory, see getMetaDataBulk().
 
     Returns:
         meta (dict): meta data of all documents. keys: docid,
@@ -156,36 +453,110 @@ def readSqlite(dbin):
     LOGGER.debug('Got %d folders from database.' %len(folder_dict))
 
     #-------------------Get metadata-------------------
-    meta={}
+    meta=getMetaDataBulk(dbin, lazy)
+    folder_data=getFolderData(meta)
+
+    #----------------Add empty folders----------------
+    empty_folderids=list(set(folder_dict.keys()).difference(folder_data.keys()))
+    for fii in empty_folderids:
+        folder_data[fii]=[]
+
+    LOGGER.info('Done reading in sqlite database.')
+    LOGGER.info('len(meta) = %d. len(folder_dict) = %d'\
+            %(len(meta), len(folder_dict)))
 
-    # this is when I tried fts5 tables in sqlite where 'rowid' was hardwared
-    # by sqlite, and eventually switched back to normal table.
-    cursor=dbin.execute('SELECT * FROM Documents')
+    return meta, folder_data, folder_dict
+
+
+def iterSqlite(dbin, lazy=False, chunk_size=5000, progress_callback=None):
+    """Read sqlite data in chunks of docs
+
+    Args:
+        dbin (sqlite connection): connection to sqlite.
+    Kwargs:
+        lazy (bool): if True, don't read the fields in LAZY_FIELDS into
+                     memory, see getMetaDataBulk().
+        chunk_size (int): number of doc ids in each chunk.
+        progress_callback (callable or None): if callable, called as
+            progress_callback(n_done, n_total) after each chunk.
+
+    Yields:
+        ('folders', folder_dict, folder_data): first, the folders, with
+            empty doc lists in folder_data.
+        ('docs', meta, folder_data): then each chunk of docs, in id order,
+            with folder_data listing only the docs in the chunk.
+
+    Gives the same data as readSqlite(), so the folder tree and the first
+    docs can be shown before a large library is fully read.
+    """
+
+    #-------------------Get folders-------------------
+    folder_dict=getFolders(dbin)
+    folder_data=dict([(fii, []) for fii in list(folder_dict)+['-2', '-3']])
+    LOGGER.debug('Got %d folders from database.' %len(folder_dict))
+
+    yield 'folders', folder_dict, folder_data
+
+    #-------------------Get metadata-------------------
+    # only to get column names. Close it to not hold a read lock while
+    # the chunks are read, which would block saving.
+    cursor=dbin.execute('SELECT * FROM Documents LIMIT 0')
     names=list(map(lambda x:x[0], cursor.description))
-    query='''SELECT DISTINCT %s
-    FROM Documents
-    ''' %('id' if 'id' in names else 'rowid')
+    cursor.close()
+    id_col='id' if 'id' in names else 'rowid'
+    first, last, n_total=dbin.execute('SELECT MIN(%s), MAX(%s), COUNT(*) FROM Documents'\
+            %(id_col, id_col)).fetchone()
 
-    docids=dbin.execute(query).fetchall()
-    docids=[ii[0] for ii in docids]
-    docids.sort()
+    if n_total==0:
+        return
 
-    folder_data={}
-    folder_data['-2']=[] # needs review folder
-    folder_data['-3']=[] # trash can folder
+    # share values and the lazy loader across chunks
+    pool={}
+    loader=LazyLoader(getSqlitePath(dbin)) if lazy else None
+    n_done=0
+    for startii in range(first, last+1, chunk_size):
+        meta=getMetaDataBulk(dbin, lazy, (startii, startii+chunk_size-1),
+                pool, loader)
+        n_done+=len(meta)
+        if progress_callback is not None:
+            progress_callback(n_done, n_total)
+        if len(meta)>0:
+            yield 'docs', meta, getFolderData(meta)
+
+    LOGGER.info('Done reading in %d docs.' %n_done)
 
-    for idii in docids:
 
-        metaii=getMetaData(dbin,idii)
-        meta[idii]=metaii
+def getFolderData(meta, folder_data=None):
+    """Collect the ids of docs in each folder
+
+    Args:
+        meta (dict): meta data of documents. keys: docid,
+            values: DocMeta dict.
+    Kwargs:
+        folder_data (dict or None): if dict, add docs in <meta> to it.
+
+    Returns:
+        folder_data (dict): documents in each folder. keys: folder id in str,
+            values: list of doc ids. Includes the Needs Review ('-2') and
+            Trash ('-3') folders. Empty folders are not included.
+    """
+
+    if folder_data is None:
+        folder_data={}
+    folder_data.setdefault('-2', []) # needs review folder
+    folder_data.setdefault('-3', []) # trash can folder
+
+    for idii in sorted(meta.keys()):
+
+        metaii=meta[idii]
+        # (folderid, foldername) list, not creating an empty default one
+        folderii=metaii._stored('folders_l') or []
 
         if metaii['confirmed'] is None or metaii['confirmed']=='false':
             folder_data['-2'].append(idii)
-        if metaii['deletionPending']=='true' and len(metaii['folders_l'])==0:
+        if metaii['deletionPending']=='true' and len(folderii)==0:
             folder_data['-3'].append(idii)
 
-        folderii=metaii['folders_l'] # (folderid, foldername)
-
         # convert folder id to str, as QListWidgetItem request str. very annoying
         # remember to convert back to int when writing to sqlite
         folderids=[str(ff[0]) for ff in folderii]
@@ -195,16 +566,7 @@ def readSqlite(dbin):
             else:
                 folder_data[fii]=[idii]
 
-    #----------------Add empty folders----------------
-    empty_folderids=list(set(folder_dict.keys()).difference(folder_data.keys()))
-    for fii in empty_folderids:
-        folder_data[fii]=[]
-
-    LOGGER.info('Done reading in sqlite database.')
-    LOGGER.info('len(meta) = %d. len(folder_dict) = %d'\
-            %(len(meta), len(folder_dict)))
-
-    return meta, folder_data, folder_dict
+    return folder_data
 
 
 def fetchField(db, query, values, ncol=1, ret_type='str'):
@@ -335,12 +697,6 @@ def getMetaData(db, did):
     '''
 
     #------------------Get file meta data------------------
-    fields=['citationkey','title','issue','pages',\
-            'publication','volume','year','doi','abstract',\
-            'arxivId','chapter','city','country','edition','institution',\
-            'isbn','issn','month','day','publisher','series','type',\
-            'read','favourite','pmid','added','confirmed', 'deletionPending']
-
     result=DocMeta()
 
     if 'id' in names:
@@ -351,7 +707,7 @@ def getMetaData(db, did):
         result['rowid']=vii
 
     # query single-worded fields, e.g. year, city
-    for kii in fields:
+    for kii in META_FIELDS:
         vii=fetchField(db,query_base %(kii), (did,))
         result[kii]=vii
 
@@ -372,6 +728,142 @@ def getMetaData(db, did):
     return result
 
 
+def getMetaDataBulk(db, lazy=False, did_range=None, pool=None, loader=None):
+    """Get meta data of all documents from sqlite in a single pass
+
+    Args:
+        db (sqlite connection): sqlite connection.
+    Kwargs:
+        lazy (bool): if True, return LazyDocMeta dicts, which read the
+                     fields in LAZY_FIELDS from sqlite only when needed.
+                     Saves memory for large libraries.
+        did_range (tuple or None): (first, last) ids of docs to read,
+                                   inclusive. If None, read all docs.
+        pool (dict or None): dict of shared values, to share values across
+                             calls reading different ranges.
+        loader (LazyLoader or None): loader of lazy docs, to share across
+                                     calls. If None, create a new one.
+
+    Returns: results (dict): meta data of all documents. keys: docid,
+             values: DocMeta dict.
+
+    Gives the same results as calling getMetaData() on each doc, but each
+    table is read with 1 ordered scan, rather than ~36 queries per doc.
+    Equal values, e.g. 'true', years, tags or author names, are shared by
+    all docs, rather than being a new str for each doc.
+    """
+
+    # value: the same value, to share equal values
+    if pool is None:
+        pool={}
+    share=pool.setdefault
+
+    params=() if did_range is None else tuple(did_range)
+
+    def where(did_col):
+        if did_range is None:
+            return ''
+        return 'WHERE %s BETWEEN ? AND ?' %did_col
+
+    def groupByDid(query, ncol=1, did_col='did'):
+        # rows are (did, col1, ...), ordered by did then insertion order
+        groups={}
+        for row in db.execute(query %where(did_col), params):
+            value=row[1] if ncol==1 else tuple(row[1:])
+            value=share(value, value)
+            groups.setdefault(row[0],[]).append(value)
+        return groups
+
+    def joinStr(values):
+        # same formatting as fetchField(..., ret_type='str')
+        if len(values)==0:
+            return None
+        if len(values)==1:
+            return None if values[0] is None else str(values[0])
+        return '; '.join(values)
+
+    cursor=db.execute('SELECT * FROM Documents LIMIT 0')
+    names=list(map(lambda x:x[0], cursor.description))
+    id_col='id' if 'id' in names else 'rowid'
+    # lazy fields are read by id
+    lazy=lazy and id_col=='id'
+
+    #------------------Get list fields------------------
+    contributors=groupByDid('''
+    SELECT did, firstNames, lastName FROM DocumentContributors %s
+    ORDER BY did, rowid''', 2)
+    keywords=groupByDid('''
+    SELECT did, text FROM DocumentKeywords %s ORDER BY did, rowid''')
+    tags=groupByDid('''
+    SELECT did, tag FROM DocumentTags %s ORDER BY did, rowid''')
+    if lazy:
+        if loader is None:
+            loader=LazyLoader(getSqlitePath(db))
+        has_files=set([row[0] for row in db.execute('''
+        SELECT DISTINCT did FROM DocumentFiles %s''' %where('did'),
+        params)])
+    else:
+        files=groupByDid('''
+        SELECT did, relpath FROM DocumentFiles %s ORDER BY did, rowid''')
+        urls=groupByDid('''
+        SELECT did, url FROM DocumentUrls %s ORDER BY did, rowid''')
+        notes=groupByDid('''
+        SELECT did, note FROM DocumentNotes %s ORDER BY did, rowid''')
+    folders=groupByDid('''
+    SELECT DocumentFolders.did, Folders.id, Folders.name
+    FROM DocumentFolders
+    JOIN Folders ON DocumentFolders.folderid=Folders.id %s
+    ORDER BY DocumentFolders.did, DocumentFolders.rowid''', 2,
+    'DocumentFolders.did')
+
+    #------------------Get file meta data------------------
+    fields=[kk for kk in META_FIELDS if not (lazy and kk in LAZY_FIELDS)]
+    list_fields=[('keywords_l', keywords), ('folders_l', folders),
+            ('tags_l', tags)]
+    if not lazy:
+        list_fields.extend([('files_l', files), ('urls_l', urls)])
+    query='SELECT %s, %s FROM Documents %s ORDER BY %s'\
+            %(id_col, ', '.join(fields), where(id_col), id_col)
+
+    results={}
+    for row in db.execute(query, params):
+        did=row[0]
+        if lazy:
+            result=LazyDocMeta(loader, did in has_files)
+        else:
+            result=DocMeta()
+        if id_col=='id':
+            result['id']=int(did)
+        else:
+            result['rowid']=str(did)
+
+        # single-worded fields, e.g. year, city
+        for kii, vii in zip(fields, row[1:]):
+            if vii is not None:
+                vii=str(vii)
+                result[kii]=share(vii, vii)
+
+        # list fields, .e.g firstnames, tags. Empty ones are left to
+        # DocMeta defaults.
+        authors=contributors.get(did)
+        if authors:
+            result['firstNames_l']=[aii[0] for aii in authors]
+            result['lastName_l']=[aii[1] for aii in authors]
+        for kii, groupii in list_fields:
+            valuesii=groupii.get(did)
+            if valuesii:
+                result[kii]=valuesii
+
+        if not lazy:
+            result['notes']=joinStr(notes.get(did,[]))
+
+        results[did]=result
+
+    LOGGER.debug('Done fetching meta data for %d docs' %len(results))
+
+    return results
+
+
 def zipAuthors(firstnames, lastnames):
     """Create author name list from lists of first names and last names.
 
@@ -402,6 +894,157 @@ def zipAuthors(firstnames, lastnames):
     return authors
 
 
+class FolderIndex(object):
+
+    def __init__(self, folder_dict):
+        '''Parent-children index of the folder tree
+
+        Args:
+            folder_dict (dict): folder structure info. keys: folder id in str,
+                values: (foldername, parentid) tuple.
+
+        Children are found in a pre-built adjacency dict, and the
+        descendants and ancestors of a folder are cached once walked. An
+        index is only valid for the folder_dict it is built from, see
+        FolderDict and getFolderIndex().
+        '''
+
+        self.parents={}  # folderid: parentid
+        self.children={} # folderid: sorted list of child ids
+        for idii, (_, pii) in folder_dict.items():
+            pii=str(pii)
+            self.parents[idii]=pii
+            self.children.setdefault(pii, []).append(idii)
+        for vv in self.children.values():
+            vv.sort()
+
+        self._descendants={}
+        self._ancestors={}
+
+
+    def getChildren(self, folderid):
+        '''Get ids of direct child folders, sorted'''
+
+        return list(self.children.get(folderid, []))
+
+
+    def getDescendants(self, folderid):
+        '''Get ids of all folders under a folder, walked level by level'''
+
+        if folderid not in self._descendants:
+            results=[]
+            visited=set([folderid,])
+            idx=0
+            current=folderid
+            while True:
+                for cii in self.children.get(current, []):
+                    # guard against a loop in the tree
+                    if cii not in visited:
+                        visited.add(cii)
+                        results.append(cii)
+                if idx>=len(results):
+                    break
+                current=results[idx]
+                idx+=1
+            self._descendants[folderid]=tuple(results)
+
+        return list(self._descendants[folderid])
+
+
+    def getAncestors(self, folderid):
+        '''Get ids of folders above a folder, from parent up to a top level
+        folder'''
+
+        if folderid not in self._ancestors:
+            results=[]
+            visited=set([folderid,])
+            pid=self.parents.get(folderid)
+            # stop at a top level folder, or a loop in the tree
+            while pid in self.parents and pid not in visited:
+                visited.add(pid)
+                results.append(pid)
+                pid=self.parents[pid]
+            self._ancestors[folderid]=tuple(results)
+
+        return list(self._ancestors[folderid])
+
+
+class FolderDict(dict):
+
+    def __init__(self, *args, **kwargs):
+        '''A dict of folder structure info, keeping a FolderIndex of itself
+
+        keys: folder id in str, values: (foldername, parentid) tuple.
+
+        The index is dropped whenever a folder is added, renamed, moved or
+        removed, and rebuilt on next use, see getFolderIndex().
+        '''
+
+        super(FolderDict, self).__init__(*args, **kwargs)
+        self._index=None
+
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index=FolderIndex(self)
+        return self._index
+
+
+    def __setitem__(self, key, value):
+        if key not in self or self[key]!=value:
+            self._index=None
+        super(FolderDict, self).__setitem__(key, value)
+
+
+    def __delitem__(self, key):
+        self._index=None
+        super(FolderDict, self).__delitem__(key)
+
+
+    def pop(self, *args):
+        self._index=None
+        return super(FolderDict, self).pop(*args)
+
+
+    def popitem(self):
+        self._index=None
+        return super(FolderDict, self).popitem()
+
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._index=None
+        return super(FolderDict, self).setdefault(key, default)
+
+
+    def update(self, *args, **kwargs):
+        self._index=None
+        super(FolderDict, self).update(*args, **kwargs)
+
+
+    def clear(self):
+        self._index=None
+        super(FolderDict, self).clear()
+
+
+def getFolderIndex(folder_dict):
+    """Get the parent-children index of a folder tree
+
+    Args:
+        folder_dict (dict): folder structure info. keys: folder id in str,
+            values: (foldername, parentid) tuple.
+
+    Returns: index (FolderIndex): cached index if <folder_dict> is a
+             FolderDict, otherwise a newly built one.
+    """
+
+    if isinstance(folder_dict, FolderDict):
+        return folder_dict.index
+
+    return FolderIndex(folder_dict)
+
+
 def getSubFolders(folder_dict, folderid):
     """Get all subfolders of a give folder
 
@@ -414,16 +1057,7 @@ def getSubFolders(folder_dict, folderid):
              folder.
     """
 
-    results=[kk for kk,vv in folder_dict.items() if vv[1]==folderid]
-
-    subs=[]
-    for fii in results:
-        subids=getSubFolders(folder_dict,fii)
-        subs.extend(subids)
-
-    results.extend(subs)
-
-    return results
+    return getFolderIndex(folder_dict).getDescendants(folderid)
 
 
 def getTrashedFolders(folder_dict):
@@ -490,13 +1124,10 @@ def walkFolderTree(folder_dict, folder_data, folderid, docids=None,
     if folderids is None:
         folderids=[]
 
-    docids.extend(folder_data[folderid])
-    folderids.append(folderid)
-
-    subfolderids=getChildFolders(folder_dict,folderid)
-    for sii in subfolderids:
-        folderids,docids=walkFolderTree(folder_dict,folder_data,sii,
-                docids,folderids)
+    walked=[folderid,]+getSubFolders(folder_dict, folderid)
+    folderids.extend(walked)
+    for fii in walked:
+        docids.extend(folder_data[fii])
 
     folderids=list(set(folderids))
     docids=list(set(docids))
@@ -570,7 +1201,7 @@ def getFolders(db):
 
     # dict, key: folderid, value: (folder_name, parent_id)
     # note: convert id to str
-    df=dict([(str(ii[0]), (ii[1], str(ii[2]))) for ii in data])
+    df=FolderDict([(str(ii[0]), (ii[1], str(ii[2]))) for ii in data])
 
     return df
 
@@ -671,13 +1302,7 @@ def getChildFolders(folder_dict, folderid):
     tree.
     """
 
-    results=[]
-    for idii in folder_dict:
-        fii,pii=folder_dict[idii]
-        if pii==folderid:
-            results.append(idii)
-    results.sort()
-    return results
+    return getFolderIndex(folder_dict).getChildren(folderid)
 
 
 def getFolderTree(folder_dict, folderid):
@@ -693,21 +1318,10 @@ def getFolderTree(folder_dict, folderid):
         folder (str): path of the given folder in the tree.
     """
 
-    getFolderName=lambda folder_dict,id: folder_dict[id][0]
-    getParentId=lambda folder_dict,id: folder_dict[id][1]
-
-    folder=getFolderName(folder_dict,folderid)
-
     #------------Back track tree structure------------
-    cid=folderid
-    while True:
-        pid=str(getParentId(folder_dict,cid))
-        if pid=='-1':
-            break
-        else:
-            pfolder=getFolderName(folder_dict,pid)
-            folder=os.path.join(pfolder,folder)
-        cid=pid
+    ancestors=getFolderIndex(folder_dict).getAncestors(folderid)
+    names=[folder_dict[ii][0] for ii in ancestors[::-1]+[folderid,]]
+    folder=os.path.join(*names)
 
     return folderid,folder
 
@@ -790,7 +1404,8 @@ def renameFile(fname, meta_dict, replace_space=False):
     return fname2
 
 
-def saveFoldersToDatabase(db, folder_ids, folder_dict, lib_folder):
+def saveFoldersToDatabase(db, folder_ids, folder_dict, lib_folder,
+        commit=True):
     """Save folder changes to sqlite
 
     Args:
@@ -801,6 +1416,9 @@ def saveFoldersToDatabase(db, folder_ids, folder_dict, lib_folder):
         lib_folder (str): abspath to the folder of the library. By design
                           this should point to the folder CONTAINING the
                           sqlite database file.
+    Kwargs:
+        commit (bool): if True, commit changes. If False, leave it to the
+                       caller, e.g. saveToDatabaseBatch().
 
     Returns: 0
     """
@@ -832,7 +1450,8 @@ def saveFoldersToDatabase(db, folder_ids, folder_dict, lib_folder):
                      VALUES (?,?,?,?)'''
             cout.execute(query, (idii, nameii, pidii, pathii))
 
-    db.commit()
+    if commit:
+        db.commit()
     LOGGER.info('Done saving folders')
 
     return 0
@@ -985,6 +1604,9 @@ def createNewDatabase(file_path):
     cout.execute(query, (0, 'Default', -1, os.path.join(lib_name,'Default')))
     dbout.commit()
 
+    #-----------------Create indexes-----------------
+    migrateDatabase(dbout)
+
     LOGGER.info('Created empty table.')
 
     #-----------------Add sample file-----------------
@@ -1005,8 +1627,43 @@ def createNewDatabase(file_path):
     return dbout, dirname, lib_name
 
 
+def migrateDatabase(db):
+    """Upgrade the schema of a sqlite database to SCHEMA_VERSION
+
+    Args:
+        db (sqlite connection): sqlite connection.
+
+    Returns: version (int): schema version after upgrading.
+
+    The schema version is stored in the user_version pragma of the sqlite
+    file. Libraries created before versioning was added have version 0.
+    Steps in SCHEMA_MIGRATIONS that have not been applied are run in order,
+    each committed together with its new version number.
+    """
+
+    version=db.execute('PRAGMA user_version').fetchone()[0]
+    LOGGER.info('Database schema version = %s' %version)
+
+    if version>len(SCHEMA_MIGRATIONS):
+        LOGGER.warning('Database schema version %s is newer than supported version %s'\
+                %(version, len(SCHEMA_MIGRATIONS)))
+        return version
+
+    cout=db.cursor()
+    for ii in range(version, len(SCHEMA_MIGRATIONS)):
+        LOGGER.info('Migrating database schema to version %d' %(ii+1))
+        for query in SCHEMA_MIGRATIONS[ii]:
+            cout.execute(query)
+        # pragma doesn't accept bound parameters
+        cout.execute('PRAGMA user_version = %d' %(ii+1))
+        db.commit()
+        version=ii+1
+
+    return version
+
+
 def metaDictToDatabase(db, docid, meta_dict_all, meta_dict, lib_folder,
-        rename_files, add_manner):
+        rename_files, add_manner, commit=True, search_session=None):
     """Save document changes to sqlite
 
     Args:
@@ -1023,6 +1680,12 @@ def metaDictToDatabase(db, docid, meta_dict_all, meta_dict, lib_folder,
         add_manner (int): file adding manner. If 'copy', copy added attachment
                           into lib_folder/_collections/. If 'link', create
                           symbolic link.
+    Kwargs:
+        commit (bool): if True, commit changes. If False, leave it to the
+                       caller, e.g. saveToDatabaseBatch().
+        search_session (xapiandb.SearchSession or None): open full text
+                       search session of the library, used to delete docs
+                       from xapian. See delDocFromDatabase().
 
     Returns: rec (int): 0 if success, None otherwise.
              reload_doc (bool): if True, call loadDocTable() to refresh changes
@@ -1036,19 +1699,17 @@ def metaDictToDatabase(db, docid, meta_dict_all, meta_dict, lib_folder,
                   updateToDatabase() is called.
     """
 
-    query='''SELECT DISTINCT rowid
-    FROM Documents
-    '''
-    docids=db.execute(query).fetchall()
-    docids=[ii[0] for ii in docids]
+    # probe the rowid (primary key) index, rather than reading all ids
+    query='''SELECT 1 FROM Documents WHERE rowid=?'''
+    in_db=db.execute(query, (docid,)).fetchone() is not None
 
     LOGGER.debug('rename_files = %s' %rename_files)
 
-    if docid in docids:
+    if in_db:
 
         if meta_dict is None:
             LOGGER.info('docid %s in database. New meta=None. Deleting...' %docid)
-            rec=delDocFromDatabase(db,docid,lib_folder)
+            rec=delDocFromDatabase(db,docid,lib_folder,search_session)
             reload_doc=False
         else:
             LOGGER.info('docid %s in database. Updating...' %docid)
@@ -1058,27 +1719,89 @@ def metaDictToDatabase(db, docid, meta_dict_all, meta_dict, lib_folder,
         if meta_dict is None:
             LOGGER.info('docid %s not in database. New meta=None. Ignore.' %docid)
             rec=0
+            reload_doc=False
         else:
             LOGGER.info('docid %s not in database. Inserting...' %docid)
             rec,reload_doc=addToDatabase(db, docid, meta_dict, lib_folder,
                     rename_files, add_manner)
 
+    if commit:
+        db.commit()
+
     if reload_doc:
         meta_dict_all[docid]=getMetaData(db,docid)
 
-    #----------------Call xapian index----------------
-    xapian_folder=os.path.join(lib_folder,'_xapian_db')
-    if isXapianReady() and os.path.exists(xapian_folder):
-        proc=multiprocessing.Process(target=xapiandb.indexFolder, args=(
-            xapian_folder, lib_folder), daemon=False)
-        LOGGER.debug('Start indexing process')
-        proc.start()
-
     LOGGER.info('Done updating doc to database. Need to reload_doc = %s' %reload_doc)
 
     return rec, reload_doc
 
 
+def saveToDatabaseBatch(db, folder_ids, folder_dict, docids, meta_dict_all,
+        lib_folder, rename_files, add_manner, progress_callback=None,
+        search_session=None):
+    """Save folder and document changes to sqlite in a single transaction
+
+    Args:
+        db (sqlite connection): sqlite connection.
+        folder_ids (list): list of ids (in str) of folders to save.
+        folder_dict (dict): folder structure info. keys: folder id in str,
+            values: (foldername, parentid) tuple.
+        docids (list): ids of docs to save changes.
+        meta_dict_all (dict): meta data of docs to save. keys: docid,
+            values: DocMeta dict, or None for a deleted doc.
+        lib_folder (str): abspath to the folder of the library. By design
+                          this should point to the folder CONTAINING the
+                          sqlite database file.
+        rename_files (int): 1 for renaming attachment files when saving, 0
+                            for using original file name.
+        add_manner (int): file adding manner. If 'copy', copy added attachment
+                          into lib_folder/_collections/. If 'link', create
+                          symbolic link.
+    Kwargs:
+        progress_callback (callable or None): if not None, called as
+            progress_callback(n_done, n_total) after each doc is saved.
+        search_session (xapiandb.SearchSession or None): open full text
+            search session of the library, used to delete docs from xapian.
+
+    Returns: rec (int): 0 if success, 1 if failed and rolled back.
+             reload_docs (dict): meta data re-read from sqlite for docs whose
+                                 'files_l' field has changed. keys: docid,
+                                 values: DocMeta dict.
+
+    All changes are committed at the end, or rolled back if any doc fails.
+    Note that attachment files copied or moved on disk are not restored on
+    a roll back.
+    Attachment files in <reload_docs> are to be indexed by the caller, see
+    xapiandb.IndexService.
+    """
+
+    reload_docs={}
+    n_total=len(docids)
+
+    try:
+        if len(folder_ids)>0:
+            saveFoldersToDatabase(db, folder_ids, folder_dict, lib_folder,
+                    commit=False)
+
+        for ii, docid in enumerate(docids):
+            LOGGER.info('Saving doc %s' %docid)
+            metaDictToDatabase(db, docid, reload_docs,
+                    meta_dict_all.get(docid), lib_folder, rename_files,
+                    add_manner, commit=False, search_session=search_session)
+            if progress_callback is not None:
+                progress_callback(ii+1, n_total)
+
+        db.commit()
+    except:
+        LOGGER.exception('Failed to save changes. Rolling back.')
+        db.rollback()
+        return 1, {}
+
+    LOGGER.info('Done saving %d docs in batch.' %n_total)
+
+    return 0, reload_docs
+
+
 def insertToDocuments(db, docid, meta_dict, action):
     """Insert or update columns in the Documents table
 
@@ -1114,7 +1837,6 @@ def insertToDocuments(db, docid, meta_dict, action):
         raise Exception("action not defined.")
 
     cout.execute(query,[docid,]+value_list)
-    db.commit()
 
     LOGGER.info('Done inserting doc %s to Documents table.' %docid)
 
@@ -1137,9 +1859,7 @@ def insertToTable(db, table, columns, values):
         cout=db.cursor()
         query='INSERT OR IGNORE INTO %s (%s) VALUES (%s)' %\
                 (table, ','.join(columns), ','.join(['?',]*len(columns)))
-        for vii in values:
-            cout.execute(query, vii)
-        db.commit()
+        cout.executemany(query, values)
 
     LOGGER.info('Done inserting to %s table.' %table)
 
@@ -1160,7 +1880,6 @@ def delFromTable(db, table, docid):
     cout=db.cursor()
     query='DELETE FROM %s WHERE (%s.did=?)' %(table,table)
     cout.execute(query, (docid,))
-    db.commit()
     LOGGER.debug('Deleted old rows in table %s with docid = %s' %(table,docid))
 
     return 0
@@ -1188,7 +1907,8 @@ def insertToDocumentFiles(db, docid, meta_dict, lib_folder, rename_files,
     The path of each attachment file of the give doc is renamed if required,
     and copied to a specified folder corresponding to the library.
     A relative file path, relative to <lib_folder>, is obtained, and saved
-    to sqlite.
+    to sqlite. <meta_dict> is not changed, the new paths are read back from
+    sqlite, see metaDictToDatabase().
     """
 
     cout=db.cursor()
@@ -1208,7 +1928,6 @@ def insertToDocumentFiles(db, docid, meta_dict, lib_folder, rename_files,
         os.makedirs(abs_file_folder)
 
     files=meta_dict['files_l']
-    files_updated=[]
     if len(files)>0:
         query='''INSERT OR IGNORE INTO DocumentFiles (did, relpath)
         VALUES (?,?)'''
@@ -1255,8 +1974,6 @@ def insertToDocumentFiles(db, docid, meta_dict, lib_folder, rename_files,
             rel_fii=os.path.join(rel_file_folder,newfilename)
             cout.execute(query,(docid,rel_fii))
 
-            files_updated.append(rel_fii)
-
             LOGGER.debug('new abspath = %s' %newabsii)
             LOGGER.debug('new relpath = %s' %rel_fii)
 
@@ -1291,10 +2008,6 @@ def insertToDocumentFiles(db, docid, meta_dict, lib_folder, rename_files,
                     LOGGER.exception('Failed to index attachment %s' %fii)
             '''
 
-        db.commit()
-
-    # update meta_dict
-    meta_dict['files_l']=files_updated
     LOGGER.info('Done inserting doc %s to DocumentFiles' %docid)
 
     return 0
@@ -1483,9 +2196,6 @@ def updateToDatabase(db, docid, meta_dict, lib_folder, rename_files,
             xapian_folder=os.path.join(lib_folder,'_xapian_db')
             LOGGER.info('Deleting old files: %s' %del_files)
             for fii in del_files:
-                # del thumbnail if exists:
-                delThumbnails(lib_folder, os.path.split(fii)[1])
-
                 # del from xapian
                 if isXapianReady() and os.path.exists(xapian_folder):
                     try:
@@ -1575,7 +2285,7 @@ def updateToDatabase(db, docid, meta_dict, lib_folder, rename_files,
     return 0, reload_doc
 
 
-def delDocFromDatabase(db, docid, lib_folder):
+def delDocFromDatabase(db, docid, lib_folder, search_session=None):
     """Delete existing document from sqlite
 
     Args:
@@ -1584,6 +2294,11 @@ def delDocFromDatabase(db, docid, lib_folder):
         lib_folder (str): abspath to the folder of the library. By design
                           this should point to the folder CONTAINING the
                           sqlite database file.
+    Kwargs:
+        search_session (xapiandb.SearchSession or None): if not None, delete
+                       the doc's files from xapian with it. Otherwise open
+                       the xapian and sqlite databases again, see
+                       xapiandb.delByDocid2().
 
     Returns: rec (int): 0 if success, None otherwise.
     """
@@ -1614,16 +2329,27 @@ def delDocFromDatabase(db, docid, lib_folder):
     #-----------------Del from xapian-----------------
     xapian_folder=os.path.join(lib_folder,'_xapian_db')
     sqlitepath=db.execute('PRAgMA database_list').fetchall()[0][2]
-    if isXapianReady() and os.path.exists(xapian_folder):
+    if search_session is not None:
+        # use the open reader, and the files read above
+        try:
+            search_session.delByDocid(docid, old_files)
+        except:
+            LOGGER.exception('Failed to delete from xapian.')
+        # in this transaction, not in another connection waiting for it
+        try:
+            query='''DELETE FROM IndexManifest WHERE relpath IN (%s)'''\
+                    %','.join(['?']*len(old_files))
+            db.execute(query, old_files)
+        except sqlite3.OperationalError:
+            # no manifest table
+            pass
+    elif isXapianReady() and os.path.exists(xapian_folder):
         try:
             xapiandb.delByDocid2(xapian_folder, sqlitepath, docid)
         except:
             LOGGER.exception('Failed to delete from xapian.')
 
     for ii, fii in enumerate(old_files):
-        # del thumbnail if exists:
-        delThumbnails(lib_folder, os.path.split(fii)[1])
-
         # prepend folder path
         absii=os.path.join(lib_folder,fii)
         if os.path.exists(absii):
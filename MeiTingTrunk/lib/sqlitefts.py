@@ -18,6 +18,20 @@ import logging
 
 LOGGER=logging.getLogger(__name__)
 
+# ids of a folder and all its sub-folders, found by walking down
+# Folders.parentId (indexed, see sqlitedb.SCHEMA_MIGRATIONS).
+# Bind the id of the top folder.
+SUBFOLDERS_CTE='''WITH RECURSIVE SubFolders(id) AS (
+    SELECT CAST(? AS INT)
+    UNION
+    SELECT Folders.id FROM Folders
+    JOIN SubFolders ON Folders.parentId=SubFolders.id)
+    '''
+
+# id of a single folder, in the same form as SUBFOLDERS_CTE
+FOLDER_CTE='''WITH SubFolders(id) AS (SELECT CAST(? AS INT))
+    '''
+
 
 
 #######################################################################
@@ -241,6 +255,68 @@ def getSubFolders(folder_dict, folderid):
     return results
 
 
+def getFolderCTE(folderid, desend=False):
+    '''Get a CTE defining the SubFolders table of folder ids to search in
+
+    Args:
+        folderid (str): id of folder.
+
+    Kwargs:
+        desend (bool): whether to include subfolders of given folder.
+
+    Returns:
+        cte (str): WITH clause defining the SubFolders(id) table, to be put
+                   before the query using it.
+        values (tuple): values to bind to <cte>.
+    '''
+
+    cte=SUBFOLDERS_CTE if desend else FOLDER_CTE
+
+    return cte, (folderid,)
+
+
+def getSubFolderIds(db, folderid, desend=True):
+    '''Get ids of a folder and its subfolders in one query
+
+    Args:
+        db (sqlite connection): sqlite connection.
+        folderid (str): id of folder.
+
+    Kwargs:
+        desend (bool): whether to include subfolders of given folder.
+
+    Returns:
+        subfolderids (list): ids in str of <folderid> and its subfolders.
+    '''
+
+    cte, values=getFolderCTE(folderid, desend)
+    ret=db.execute(cte+'SELECT id FROM SubFolders', values)
+
+    return [str(ii[0]) for ii in ret]
+
+
+def getFolderDocCount(db, folderid, desend=True):
+    '''Count docs in a folder, or in a folder and all its subfolders
+
+    Args:
+        db (sqlite connection): sqlite connection.
+        folderid (str): id of folder.
+
+    Kwargs:
+        desend (bool): whether to include subfolders of given folder.
+
+    Returns:
+        count (int): number of distinct docs.
+    '''
+
+    cte, values=getFolderCTE(folderid, desend)
+    query=cte+'''SELECT COUNT(DISTINCT DocumentFolders.did)
+    FROM DocumentFolders
+    WHERE DocumentFolders.folderid IN (SELECT id FROM SubFolders)'''
+
+    return db.execute(query, values).fetchone()[0]
+
+
 #######################################################################
 #             LIKE search ONLY searchMultipleLike2 IN USE             #
 #######################################################################
@@ -249,26 +325,16 @@ def searchTitleLike(db, text, folderid, desend=False):
 
     cin=db.cursor()
 
-    query='''SELECT Documents.id, Documents.title
+    cte, folder_value=getFolderCTE(folderid, desend)
+    query=cte+'''SELECT Documents.id, Documents.title
     FROM Documents
-    LEFT JOIN DocumentFolders
-    ON DocumentFolders.did=Documents.id
     WHERE (Documents.title LIKE ?) AND
-    %s
+    Documents.id IN (SELECT did FROM DocumentFolders
+        WHERE DocumentFolders.folderid IN (SELECT id FROM SubFolders))
     ORDER BY Documents.title
     '''
 
-    if desend:
-        folder_dict=getFolders(db)
-        subfolderids=getSubFolders(folder_dict, folderid)+[folderid,]
-        print('# <searchTitleLike>: subfolderids=',subfolderids)
-        folder_str='(DocumentFolders.folderid IN (%s))' %','.join(['?']*len(subfolderids))
-        folder_value=tuple(subfolderids)
-    else:
-        folder_str='(DocumentFolders.folderid = ?)'
-        folder_value=(folderid,)
-
-    ret=cin.execute(query %folder_str,('%%%s%%' %text,) + folder_value)
+    ret=cin.execute(query, folder_value+('%%%s%%' %text,))
     ret=ret.fetchall()
 
     return ret
@@ -546,19 +612,17 @@ def searchMultipleLike2(db, text, field_list, folderid, desend=False):
         ret=cin.execute(query)
         subfolderids=folderid
     else:
-        if desend:
-            folder_dict=getFolders(db)
-            subfolderids=getSubFolders(folder_dict, folderid)+[folderid,]
-        else:
-            subfolderids=[folderid,]
-
+        # the whole sub-tree is resolved within the query
+        cte, values=getFolderCTE(folderid, desend)
+        query=cte+query %'''
+        WHERE search_res.did IN (SELECT did FROM DocumentFolders
+            WHERE DocumentFolders.folderid IN (SELECT id FROM SubFolders))
+        '''
+        ret=cin.execute(query, values).fetchall()
+        subfolderids=getSubFolderIds(db, folderid, desend)
         LOGGER.debug('subfolder ids = %s' %subfolderids)
 
-        query=query %'''
-        LEFT JOIN DocumentFolders ON DocumentFolders.did=search_res.did
-        WHERE (DocumentFolders.folderid IN (%s))
-        ''' %','.join(['?']*len(subfolderids))
-        ret=cin.execute(query, subfolderids)
+        return ret, subfolderids
 
     ret=ret.fetchall()
 
@@ -568,6 +632,136 @@ def searchMultipleLike2(db, text, field_list, folderid, desend=False):
 
 
 
+#######################################################################
+#                   fts5 search on DocumentSearch table               #
+#######################################################################
+
+# search bar field name: (column in DocumentSearch, field name in results)
+FTS_FIELDS={
+        'Authors'     : ('authors', 'authors'),
+        'Title'       : ('title', 'title'),
+        'Keywords'    : ('keywords', 'keywords'),
+        'Tags'        : ('tags', 'tag'),
+        'Notes'       : ('notes', 'note'),
+        'Publication' : ('publication', 'publication'),
+        'Abstract'    : ('abstract', 'abstract'),
+        'Citationkey' : ('citationkey', 'citationkey')
+        }
+
+
+def composeFTSQuery(text, columns, any_token=False):
+    '''Compose a fts5 query string for a search text
+
+    Args:
+        text (str): search text.
+        columns (list): column names of DocumentSearch to search in.
+
+    Kwargs:
+        any_token (bool): if True, match any word in <text>, otherwise all.
+
+    Returns:
+        query (str or None): fts5 query string, e.g.
+            '{title authors} : ("enso"* "model"*)'. None if <text> has no
+            tokens.
+
+    Each word in <text> is a prefix token.
+    '''
+
+    tokens=[ii.replace('"', '') for ii in text.split()]
+    tokens=['"%s"*' %ii for ii in tokens if len(ii)>0]
+    if len(tokens)==0 or len(columns)==0:
+        return None
+
+    joiner=' OR ' if any_token else ' '
+
+    return '{%s} : (%s)' %(' '.join(columns), joiner.join(tokens))
+
+
+def searchMultipleFTS(db, text, field_list, folderid, desend=False):
+    """Search doc meta data using the DocumentSearch fts5 index
+
+    Args:
+        db (sqlite connection): sqlite connection.
+        text (str): search text.
+        field_list (list): list of fields to search, including 'Authors',
+                          'Title', 'Keywords', 'Tags', 'Notes', 'Publication',
+                          'Abstract', 'Citationkey'.
+        folderid (str): id of folder, search in done within docs in this folder.
+
+    Kwargs:
+        desend (bool): whether to include subfolders (by walking done folder
+                       tree) of given folder.
+
+    Returns: rec (list): list of doc ids matching search, together with the
+        field names where the match is found, ordered by relevance. E.g.
+
+        [(1, 'authors,title'),
+         (10, 'title,keywords'),
+         (214, 'abstract,tag'),
+         ...
+        ]
+
+    Words in <text> are matched as tokens or token prefixes, instead of
+    substrings as in searchMultipleLike2(), which is used as a fallback if
+    the DocumentSearch table doesn't exist.
+    """
+
+    #---------Compose folder filtering string---------
+    # NOTE: the unary + keeps fts5 from using the rowid IN (...) constraint
+    # as the lookup, which runs the MATCH again for every rowid.
+    cte=''
+    if folderid=='-1':
+        filter_str=''
+        filter_values=()
+    elif folderid=='-2':
+        filter_str='''AND +DocumentSearch.rowid IN
+        (SELECT id FROM Documents WHERE Documents.confirmed='false')'''
+        filter_values=()
+    else:
+        cte, filter_values=getFolderCTE(folderid, desend)
+        filter_str='''AND +DocumentSearch.rowid IN
+        (SELECT did FROM DocumentFolders
+            WHERE DocumentFolders.folderid IN (SELECT id FROM SubFolders))
+        '''
+
+    fields=[FTS_FIELDS[kk] for kk in field_list if kk in FTS_FIELDS]
+    match=composeFTSQuery(text, [ii[0] for ii in fields])
+    if match is None:
+        return []
+
+    #------------Get matched docs by rank------------
+    query=cte+'''SELECT DocumentSearch.rowid FROM DocumentSearch
+    WHERE DocumentSearch MATCH ? %s
+    ORDER BY rank''' %filter_str
+
+    try:
+        ret=db.execute(query, filter_values+(match,)).fetchall()
+    except sqlite3.OperationalError:
+        LOGGER.exception('Failed to search DocumentSearch. Fall back to LIKE search.')
+        return searchMultipleLike2(db, text, field_list, folderid, desend)[0]
+
+    docids=[ii[0] for ii in ret]
+    if len(docids)==0:
+        return []
+
+    #----------Get matched fields of each doc----------
+    # one indexed query per field, only needed for the detail rows.
+    # words may be found in different fields, so match any word.
+    matched_fields={}
+    query='''SELECT rowid FROM DocumentSearch WHERE DocumentSearch MATCH ?'''
+    for columnii, fieldii in fields:
+        matchii=composeFTSQuery(text, [columnii], any_token=True)
+        for rowjj in db.execute(query, (matchii,)):
+            matched_fields.setdefault(rowjj[0], []).append(fieldii)
+
+    results=[(ii, ','.join(matched_fields.get(ii, []))) for ii in docids]
+
+    return results
+
+
+
+
+
 if __name__=='__main__':
 
     dbfile='../nonfts3.sqlite'
@@ -0,0 +1,800 @@
+'''
+Rendering and caching PDF thumbnails with poppler in background threads.
+
+MeiTing Trunk
+An open source reference management tool developed in PyQt5 and Python3.
+
+Copyright 2018-2019 Guang-zhi XU
+
+This file is distributed under the terms of the
+GPLv3 licence. See the LICENSE file for details.
+You may use, distribute and modify this code under the
+terms of the GPLv3 license.
+'''
+
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import logging
+import subprocess
+import threading
+from collections import deque, OrderedDict
+from PyQt5.QtGui import QImage
+from .tools import fileHash, delThumbnails
+
+LOGGER=logging.getLogger(__name__)
+
+# thumbnail file name: <content hash>-<dpi>-<page>.jpg
+THUMBNAIL_RE=re.compile(r'^([0-9a-f]+)-(\d+)-(\d+)\.jpg$')
+NICE_CMD=shutil.which('nice')
+
+
+def getThumbnailCmd(filepath, outbase, dpi, first_page=1, last_page=1):
+    '''Get the pdftoppm command rendering pages of a pdf to jpg
+
+    Args:
+        filepath (str): abspath of the pdf.
+        outbase (str): path prefix of the output files.
+        dpi (int or str): resolution of thumbnails.
+    Kwargs:
+        first_page, last_page (int): range of pages to render, 1-based and
+                                     inclusive.
+
+    Returns: cmd (list): command args.
+    '''
+
+    return ['pdftoppm', filepath, outbase, '-jpeg', '-r', str(dpi),
+            '-f', str(first_page), '-l', str(last_page)]
+
+
+def findThumbnails(outbase, first_page=1, last_page=1):
+    '''Find the thumbnail files of a range of pages rendered by pdftoppm
+
+    Args:
+        outbase (str): path prefix of the thumbnail files given to pdftoppm.
+    Kwargs:
+        first_page, last_page (int): range of pages, 1-based and inclusive.
+
+    Returns: paths (list): paths of thumbnail files in the page range,
+                           sorted by page.
+    '''
+
+    page_re=re.compile(r'%s-(\d+)\.jpg$' %re.escape(outbase))
+    pages=[]
+    for pathii in glob.glob(glob.escape(outbase)+'-*.jpg'):
+        matchii=page_re.match(pathii)
+        if matchii is None:
+            continue
+        pageii=int(matchii.group(1))
+        if first_page<=pageii<=last_page:
+            pages.append((pageii, pathii))
+
+    return [pathii for _, pathii in sorted(pages)]
+
+
+
+class ThumbnailCache(object):
+
+    def __init__(self, lib_folder, max_size=200<<20, save_every=50):
+        '''Size-bounded LRU cache of thumbnail files
+
+        Args:
+            lib_folder (str): path to the library folder. Thumbnails are
+                              saved in <lib_folder>/_cache/thumbnails.
+        Kwargs:
+            max_size (int): max total size of thumbnail files in bytes.
+                            Least recently used thumbnails are deleted
+                            beyond this.
+            save_every (int): save the index to disk after this many
+                              renders are added, see save().
+
+        Thumbnails are keyed by (content hash, dpi) of the pdf, so they
+        are kept when a file is renamed, and not reused when it is
+        modified. The hash of each file is memoized by its relpath with the
+        size and mtime, like the IndexManifest of xapiandb, so a lookup is
+        a stat() and a few dict accesses, and the cache folder is never
+        globbed. The index is saved to index.json in the cache folder.
+
+        Not thread-safe by itself, access is guarded by the lock of
+        ThumbnailService.
+        '''
+
+        self.lib_folder=lib_folder
+        self.folder=os.path.join(lib_folder, '_cache', 'thumbnails')
+        self.index_path=os.path.join(self.folder, 'index.json')
+        self.max_size=max_size
+        self.save_every=save_every
+
+        self.files={}                # relpath: (size, mtime, hash)
+        self.entries=OrderedDict()   # (hash, dpi): {page: (name, nbytes)}
+        self.total=0
+        self._n_changes=0
+
+        self.load()
+
+
+    def load(self):
+        '''Load the index, reconciled with files in the cache folder
+
+        Thumbnail files missing from the index, e.g. after a crash, are
+        added as least recently used. Left-over temporary files and
+        thumbnails of the old flat cache layout are deleted.
+        '''
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+            # thumbnails of the old layout were saved in _cache as
+            # <file name>-<dpi>-<page>.jpg
+            delThumbnails(self.lib_folder)
+
+        try:
+            with open(self.index_path, 'r') as fin:
+                data=json.load(fin)
+            files=data['files']
+            entries=data['entries']
+        except:
+            files={}
+            entries=[]
+
+        names=set(os.listdir(self.folder))
+        names.discard(os.path.basename(self.index_path))
+
+        self.files=dict([(kk, tuple(vv)) for kk, vv in files.items()])
+        self.entries=OrderedDict()
+        self.total=0
+        known={}
+
+        for hashii, dpiii, pagesii in entries:
+            pages={}
+            for pageii, (nameii, nbytesii) in pagesii.items():
+                if nameii in names:
+                    pages[int(pageii)]=(nameii, nbytesii)
+                    known[nameii]=nbytesii
+            if len(pages)>0:
+                self.entries[(hashii, dpiii)]=pages
+
+        for nameii in names.difference(known):
+            pathii=os.path.join(self.folder, nameii)
+            matchii=THUMBNAIL_RE.match(nameii)
+            try:
+                if matchii is None:
+                    os.remove(pathii)
+                    continue
+                nbytesii=os.path.getsize(pathii)
+            except OSError:
+                continue
+            keyii=(matchii.group(1), matchii.group(2))
+            if keyii not in self.entries:
+                self.entries[keyii]={}
+                self.entries.move_to_end(keyii, last=False)
+            self.entries[keyii][int(matchii.group(3))]=(nameii, nbytesii)
+            known[nameii]=nbytesii
+
+        self.total=sum(known.values())
+        self.evict()
+
+        LOGGER.info('Loaded %d thumbnails, %d bytes' %(len(known), self.total))
+
+        return
+
+
+    def save(self):
+        '''Save the index to disk'''
+
+        data={'files': self.files,
+                'entries': [(hashii, dpiii, pagesii) for (hashii, dpiii),\
+                        pagesii in self.entries.items()]}
+        tmp_path=self.index_path+'.tmp'
+        try:
+            with open(tmp_path, 'w') as fout:
+                json.dump(data, fout)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            LOGGER.exception('Failed to save thumbnail index.')
+        else:
+            self._n_changes=0
+
+        return
+
+
+    def getBase(self, file_hash, dpi):
+        '''Get the path prefix of the thumbnail files of a pdf
+
+        Args:
+            file_hash (str): content hash of the pdf.
+            dpi (int or str): resolution of thumbnails.
+
+        Returns: outbase (str): pdftoppm saves page N to '<outbase>-N.jpg'.
+        '''
+
+        return os.path.join(self.folder, '%s-%s' %(file_hash, dpi))
+
+
+    def getHash(self, relpath, check=True):
+        '''Get the memoized content hash of a file
+
+        Args:
+            relpath (str): path of the pdf relative to the library folder.
+        Kwargs:
+            check (bool): if True, return None if the size or mtime of the
+                          file has changed since hashed.
+
+        Returns: file_hash (str or None): None if not known.
+        '''
+
+        rec=self.files.get(relpath)
+        if rec is None:
+            return None
+        if check:
+            try:
+                stat=os.stat(os.path.join(self.lib_folder, relpath))
+            except OSError:
+                return None
+            if (stat.st_size, stat.st_mtime)!=rec[:2]:
+                return None
+
+        return rec[2]
+
+
+    def hashFile(self, relpath):
+        '''Compute the content hash of a file, not changing the cache
+
+        Args:
+            relpath (str): path of the pdf relative to the library folder.
+
+        Returns: rec (tuple): (size, mtime, hash), pass to setHash().
+
+        This reads the whole file, so is called without holding the lock.
+        '''
+
+        abspath=os.path.join(self.lib_folder, relpath)
+        stat=os.stat(abspath)
+
+        return stat.st_size, stat.st_mtime, fileHash(abspath)
+
+
+    def setHash(self, relpath, rec):
+        '''Memoize the content hash of a file, see hashFile()'''
+
+        self.files[relpath]=tuple(rec)
+
+        return
+
+
+    def find(self, file_hash, dpi, first_page=1, last_page=1):
+        '''Find thumbnails of a range of pages, marking them recently used
+
+        Args:
+            file_hash (str): content hash of the pdf.
+            dpi (int or str): resolution of thumbnails.
+        Kwargs:
+            first_page, last_page (int): range of pages, 1-based and inclusive.
+
+        Returns: paths (list): paths of thumbnail files in the page range,
+                               sorted by page.
+        '''
+
+        key=(file_hash, str(dpi))
+        pages=self.entries.get(key)
+        if not pages:
+            return []
+        self.entries.move_to_end(key)
+
+        return [os.path.join(self.folder, pages[kk][0]) for kk in sorted(pages)
+                if first_page<=kk<=last_page]
+
+
+    def lookup(self, relpath, dpi, first_page=1, last_page=1, check=True):
+        '''Find thumbnails of a range of pages of a file
+
+        Args:
+            relpath (str): path of the pdf relative to the library folder.
+            dpi (int or str): resolution of thumbnails.
+        Kwargs:
+            first_page, last_page (int): range of pages, 1-based and inclusive.
+            check (bool): see getHash().
+
+        Returns: paths (list): paths of thumbnail files in the page range,
+                               sorted by page. Empty if the file hasn't been
+                               hashed, or has changed since.
+        '''
+
+        file_hash=self.getHash(relpath, check)
+        if file_hash is None:
+            return []
+
+        return self.find(file_hash, dpi, first_page, last_page)
+
+
+    def add(self, file_hash, dpi, paths):
+        '''Add rendered thumbnail files, evicting old ones beyond max_size
+
+        Args:
+            file_hash (str): content hash of the pdf.
+            dpi (int or str): resolution of thumbnails.
+            paths (list): paths of thumbnail files in the cache folder.
+        '''
+
+        key=(file_hash, str(dpi))
+        pages=self.entries.setdefault(key, {})
+        self.entries.move_to_end(key)
+        for pathii in paths:
+            nameii=os.path.basename(pathii)
+            matchii=THUMBNAIL_RE.match(nameii)
+            if matchii is None:
+                continue
+            pageii=int(matchii.group(3))
+            try:
+                nbytesii=os.path.getsize(pathii)
+            except OSError:
+                continue
+            if pageii in pages:
+                self.total-=pages[pageii][1]
+            pages[pageii]=(nameii, nbytesii)
+            self.total+=nbytesii
+
+        self.evict()
+
+        self._n_changes+=1
+        if self._n_changes>=self.save_every:
+            self.save()
+
+        return
+
+
+    def discard(self, file_hash, dpi=None):
+        '''Delete thumbnails of a pdf
+
+        Args:
+            file_hash (str): content hash of the pdf.
+        Kwargs:
+            dpi (int or str or None): if None, delete thumbnails of all dpis.
+        '''
+
+        if dpi is None:
+            keys=[kk for kk in self.entries if kk[0]==file_hash]
+        else:
+            keys=[(file_hash, str(dpi))]
+
+        for kk in keys:
+            for nameii, nbytesii in self.entries.pop(kk, {}).values():
+                try:
+                    os.remove(os.path.join(self.folder, nameii))
+                except OSError:
+                    pass
+                self.total-=nbytesii
+            self._n_changes+=1
+
+        return
+
+
+    def evict(self):
+        '''Delete least recently used thumbnails until within max_size
+
+        The most recently used pdf is always kept.
+        '''
+
+        while self.total>self.max_size and len(self.entries)>1:
+            hashii, dpiii=next(iter(self.entries))
+            LOGGER.debug('Evicting thumbnails of %s-%s' %(hashii, dpiii))
+            self.discard(hashii, dpiii)
+
+        return
+
+
+    def removeFiles(self, relpaths):
+        '''Forget files and delete their thumbnails
+
+        Args:
+            relpaths (list): paths of pdfs relative to the library folder,
+                             e.g. of deleted docs.
+
+        Thumbnails are kept if another file has the same content.
+        '''
+
+        hashes=set()
+        for relii in relpaths:
+            rec=self.files.pop(relii, None)
+            if rec is not None:
+                hashes.add(rec[2])
+
+        if len(hashes)==0:
+            return
+
+        hashes.difference_update([recii[2] for recii in self.files.values()])
+        for hashii in hashes:
+            self.discard(hashii)
+
+        return
+
+
+    def prune(self, relpaths):
+        '''Delete thumbnails of files no longer in the library
+
+        Args:
+            relpaths (iterable): paths of known pdfs in the library, relative
+                                 to the library folder, e.g. files in
+                                 _collections. Other files are checked on
+                                 disk.
+        '''
+
+        orphans=[relii for relii in set(self.files).difference(relpaths)
+                if not os.path.exists(os.path.join(self.lib_folder, relii))]
+        if len(orphans)>0:
+            LOGGER.info('Removing thumbnails of %d orphan files' %len(orphans))
+            self.removeFiles(orphans)
+
+        return
+
+
+
+class ThumbnailService(object):
+
+    def __init__(self, n_workers=2, warm_workers=1, idle_secs=3, nice=10,
+            done_callback=None):
+        '''Background service rendering pdf thumbnails
+
+        Kwargs:
+            n_workers (int): number of worker threads, i.e. max number of
+                             pdftoppm processes running at the same time.
+            warm_workers (int): max number of pdftoppm processes
+                                pre-rendering at the same time, see warm().
+            idle_secs (float): pre-rendering is paused until no user activity
+                               is reported for this many seconds, see touch().
+            nice (int): niceness of pre-rendering processes, if the nice
+                        command is available.
+            done_callback (callable or None): if not None, called as
+                done_callback(key, images) from a worker thread after a
+                render finishes, where key is the one given to request(),
+                and images a list of QImage of the pages. QImage is used as
+                QPixmap can only be made in the GUI thread.
+
+        A new request() makes all earlier ones obsolete: those still queued
+        are dropped, and pdftoppm processes still running for them are
+        killed, so quickly moving through docs doesn't build up a backlog.
+        Pages are rendered to temporary files, which are renamed to the
+        thumbnail paths only when pdftoppm succeeds, so a killed render
+        never leaves broken thumbnails in the cache.
+
+        Requested renders always go first. Without any, pdfs queued by
+        warm() are pre-rendered, the priority queue before the background
+        one, skipping those already cached.
+
+        Thumbnails are saved to and looked up in the ThumbnailCache of the
+        current library, see setCache(). Nothing is rendered without one.
+        '''
+
+        self.warm_workers=warm_workers
+        self.idle_secs=idle_secs
+        self.nice=nice
+        self.done_callback=done_callback
+        self.cache=None
+
+        self._jobs=deque()
+        self._warm_jobs=deque()
+        self._background_jobs=deque()
+        self._running={} # job id: (Popen, is pre-render)
+        self._n_warm=0
+        self._generation=0
+        self._warm_generation=0
+        self._job_id=0
+        self._last_active=0
+        self._stopping=False
+        self._lock=threading.Condition()
+        self._threads=[threading.Thread(target=self._run, daemon=True)
+                for ii in range(n_workers)]
+
+
+    def start(self):
+
+        for tii in self._threads:
+            tii.start()
+        LOGGER.info('Thumbnail service started.')
+
+        return
+
+
+    def setCache(self, cache):
+        '''Set the thumbnail cache, saving the index of the previous one
+
+        Args:
+            cache (ThumbnailCache or None): cache of the current library.
+        '''
+
+        with self._lock:
+            if self.cache is not None:
+                self.cache.save()
+            self.cache=cache
+
+        return
+
+
+    def cached(self, relpath, dpi, first_page=1, last_page=1):
+        '''Find saved thumbnail files of a range of pages
+
+        Args:
+            relpath (str): path of the pdf relative to the library folder.
+            dpi (int or str): resolution of thumbnails.
+        Kwargs:
+            first_page, last_page (int): range of pages, 1-based and inclusive.
+
+        Returns: paths (list): paths of thumbnail files in the page range,
+                               sorted by page.
+        '''
+
+        with self._lock:
+            if self.cache is None:
+                return []
+            return self.cache.lookup(relpath, dpi, first_page, last_page)
+
+
+    def discard(self, relpath, dpi):
+        '''Delete thumbnails of a pdf, e.g. if they are broken'''
+
+        with self._lock:
+            if self.cache is not None:
+                file_hash=self.cache.getHash(relpath, check=False)
+                if file_hash is not None:
+                    self.cache.discard(file_hash, dpi)
+
+        return
+
+
+    def removeFiles(self, relpaths):
+        '''Delete thumbnails of files, see ThumbnailCache.removeFiles()'''
+
+        with self._lock:
+            if self.cache is not None:
+                self.cache.removeFiles(relpaths)
+
+        return
+
+
+    def request(self, key, relpath, dpi, first_page=1, last_page=1):
+        '''Render thumbnails of a pdf, cancelling earlier requests
+
+        Args:
+            key: id of the request passed to done_callback, e.g. docid.
+            relpath (str): path of the pdf relative to the library folder.
+            dpi (int or str): resolution of thumbnails.
+        Kwargs:
+            first_page, last_page (int): range of pages to render, 1-based
+                                         and inclusive.
+
+        If the content of the pdf is found in the cache, e.g. the file has
+        been renamed, the saved thumbnails are passed to done_callback
+        without rendering.
+        '''
+
+        with self._lock:
+            self._cancel()
+            self._last_active=time.monotonic()
+            self._job_id+=1
+            self._jobs.append((self._job_id, self._generation, False, key,
+                relpath, dpi, first_page, last_page))
+            self._lock.notify()
+
+        return
+
+
+    def warm(self, jobs, priority=True):
+        '''Queue pdfs to pre-render thumbnails of
+
+        Args:
+            jobs (list): list of (relpath, dpi, first_page, last_page)
+                         tuples, see request(), in the order to render.
+        Kwargs:
+            priority (bool): if True, replace the priority queue, e.g. docs
+                             shown in the doc table. If False, replace the
+                             background queue, e.g. all pdfs in the library,
+                             which is rendered after the former.
+        '''
+
+        with self._lock:
+            if priority:
+                self._warm_jobs=deque(jobs)
+            else:
+                self._background_jobs=deque(jobs)
+            self._lock.notify_all()
+
+        return
+
+
+    def touch(self):
+        '''Report user activity, pausing pre-rendering for idle_secs'''
+
+        with self._lock:
+            self._last_active=time.monotonic()
+
+        return
+
+
+    def cancel(self, warm=False):
+        '''Drop queued renders and kill running ones
+
+        Kwargs:
+            warm (bool): if True, also drop and kill pre-renders, e.g. when
+                         closing the library.
+        '''
+
+        with self._lock:
+            self._cancel(warm)
+
+        return
+
+
+    def stop(self, wait=True):
+        '''Stop the service, cancelling all renders
+
+        Kwargs:
+            wait (bool): if True, block until worker threads have stopped.
+        '''
+
+        with self._lock:
+            self._stopping=True
+            self._cancel(True)
+            self._lock.notify_all()
+        if wait:
+            for tii in self._threads:
+                if tii.is_alive():
+                    tii.join()
+        self.setCache(None)
+        LOGGER.info('Thumbnail service stopped.')
+
+        return
+
+
+    def _cancel(self, warm=False):
+        # call with self._lock held
+
+        self._generation+=1
+        self._jobs.clear()
+        if warm:
+            self._warm_generation+=1
+            self._warm_jobs.clear()
+            self._background_jobs.clear()
+        for procii, is_warm in self._running.values():
+            if is_warm and not warm:
+                continue
+            try:
+                procii.kill()
+            except OSError:
+                pass
+
+        return
+
+
+    def _isObsolete(self, generation, is_warm):
+        # call with self._lock held
+
+        if is_warm:
+            return generation!=self._warm_generation
+        return generation!=self._generation
+
+
+    def _nextJob(self):
+        # call with self._lock held. Returns (job or None, secs to wait)
+
+        if self.cache is None:
+            return None, None
+
+        if len(self._jobs)>0:
+            return self._jobs.popleft(), None
+
+        if self._n_warm>=self.warm_workers or\
+                len(self._warm_jobs)+len(self._background_jobs)==0:
+            return None, None
+
+        wait=self._last_active+self.idle_secs-time.monotonic()
+        if wait>0:
+            return None, wait
+
+        for queue in [self._warm_jobs, self._background_jobs]:
+            while len(queue)>0:
+                relpath, dpi, first, last=queue.popleft()
+                # trust memoized hashes here, to not stat() every file
+                if len(self.cache.lookup(relpath, dpi, first, last,
+                        check=False))>0:
+                    continue
+                self._job_id+=1
+                return (self._job_id, self._warm_generation, True, None,
+                        relpath, dpi, first, last), None
+
+        return None, None
+
+
+    def _run(self):
+
+        while True:
+            with self._lock:
+                while True:
+                    if self._stopping:
+                        return
+                    job, wait=self._nextJob()
+                    if job is not None:
+                        break
+                    self._lock.wait(wait)
+
+                job_id, generation, is_warm, key, relpath, dpi, first, last=job
+                cache=self.cache
+                file_hash=cache.getHash(relpath)
+
+            #------------------Get content hash------------------
+            if file_hash is None:
+                try:
+                    rec=cache.hashFile(relpath)
+                except OSError:
+                    LOGGER.warning('Failed to read %s' %relpath)
+                    continue
+                file_hash=rec[2]
+                with self._lock:
+                    cache.setHash(relpath, rec)
+
+            with self._lock:
+                if self._isObsolete(generation, is_warm) or cache is not self.cache:
+                    continue
+
+                #----------Same content may be already cached----------
+                outfiles=cache.find(file_hash, dpi, first, last)
+                if len(outfiles)==0:
+                    outbase=cache.getBase(file_hash, dpi)
+                    tmpbase='%s.tmp%d' %(outbase, job_id)
+                    cmd=getThumbnailCmd(os.path.join(cache.lib_folder, relpath),
+                            tmpbase, dpi, first, last)
+                    if is_warm and NICE_CMD is not None:
+                        cmd=[NICE_CMD, '-n', str(self.nice)]+cmd
+                    try:
+                        # started with lock held, so _cancel() can kill it
+                        proc=subprocess.Popen(cmd, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+                    except:
+                        LOGGER.exception('Failed to run %s' %cmd)
+                        continue
+                    self._running[job_id]=(proc, is_warm)
+                    if is_warm:
+                        self._n_warm+=1
+
+            #---------------------Render---------------------
+            if len(outfiles)==0:
+                proc.wait()
+
+                with self._lock:
+                    del self._running[job_id]
+                    if is_warm:
+                        self._n_warm-=1
+                        # a waiting worker can take the next pre-render
+                        self._lock.notify()
+
+                tmpfiles=findThumbnails(tmpbase, first, last)
+                if proc.returncode!=0:
+                    LOGGER.debug('pdftoppm stopped with %s for %s'\
+                            %(proc.returncode, relpath))
+                    for fii in tmpfiles:
+                        os.remove(fii)
+                    continue
+
+                # keep renders finished after cancelling, for later use
+                for fii in tmpfiles:
+                    outii=outbase+fii[len(tmpbase):]
+                    os.replace(fii, outii)
+                    outfiles.append(outii)
+
+                with self._lock:
+                    cache.add(file_hash, dpi, outfiles)
+                    # the LRU may have evicted them at once if max_size is tiny
+                    outfiles=[fii for fii in outfiles if os.path.exists(fii)]
+
+                LOGGER.debug('Rendered %d page(s) of %s' %(len(outfiles), relpath))
+
+            with self._lock:
+                if is_warm or self._isObsolete(generation, is_warm):
+                    continue
+
+            if self.done_callback is not None:
+                images=[QImage(fii) for fii in outfiles]
+                self.done_callback(key, images)
+
+        return
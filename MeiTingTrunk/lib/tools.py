@@ -18,8 +18,12 @@ import re
 import time
 import platform
 import glob
+import hashlib
 import logging
 import subprocess
+import importlib
+import multiprocessing
+import concurrent.futures
 from functools import reduce
 from fuzzywuzzy import fuzz
 from PyQt5 import QtWidgets
@@ -304,6 +308,273 @@ def fuzzyMatch(jobid, doc1_list, doc2_list, min_score):
     return 0,jobid, ((id1,id2), round(score))
 
 
+def fuzzRatio(jobid, text1, text2):
+    """Compute fuzzy ratio between 2 strings
+
+    Args:
+        jobid (int): job id.
+        text1 (str): 1st string.
+        text2 (str): 2nd string.
+
+    Returns:
+        rec (int): 0 for success.
+        jobid (int): input jobid.
+        match_result (tuple): in the format ((text1, text2), score).
+    """
+
+    return 0, jobid, ((text1, text2), fuzz.ratio(text1, text2))
+
+
+def runJobChunk(func, chunk):
+    """Call a function on a chunk of jobs
+
+    Args:
+        func (callable): function to call on each job, as func(*job). Return
+                         is assumed to have the format (rec, jobid, results).
+        chunk (list): list of jobs, each in the format (jobid, jobargs...).
+
+    Returns:
+        results (list): returns of <func> on jobs in <chunk>. A failed job
+                        gives (1, jobid, None).
+    """
+
+    results=[]
+    for jobii in chunk:
+        try:
+            results.append(func(*jobii))
+        except:
+            results.append((1, jobii[0], None))
+
+    return results
+
+
+def poolJobs(func, joblist, chunk_size=500, n_workers=None,
+        progress_callback=None):
+    """Run jobs in chunks in a pool of processes
+
+    Args:
+        func (callable): module level function to call on each job, as
+                         func(*job), see runJobChunk().
+        joblist (list): list of jobs, each in the format (jobid, jobargs...).
+    Kwargs:
+        chunk_size (int): number of jobs sent to a process at a time.
+        n_workers (int or None): number of processes. If None, use the number
+                                 of cores.
+        progress_callback (callable or None): if not None, called as
+                                    progress_callback(n_done, n_total) after
+                                    each chunk.
+
+    Yields:
+        results (list): returns of <func> on a chunk of jobs, in the order
+                        chunks are finished.
+
+    For cpu bound jobs like fuzzy matching, which can't run in parallel in
+    threads. At most 2*<n_workers> chunks are in flight. If there is only 1
+    chunk, it is run in the calling thread to save the process start up.
+    Processes are spawned instead of forked, as the app is running other
+    threads. Closing the generator cancels chunks not yet started.
+    """
+
+    if n_workers is None:
+        n_workers=os.cpu_count() or 1
+
+    n_total=len(joblist)
+    chunks=[joblist[ii:ii+chunk_size] for ii in range(0, n_total, chunk_size)]
+    n_workers=min(n_workers, len(chunks))
+    n_done=0
+
+    if n_workers<=1:
+        for chunkii in chunks:
+            resii=runJobChunk(func, chunkii)
+            n_done+=len(chunkii)
+            if progress_callback is not None:
+                progress_callback(n_done, n_total)
+            yield resii
+        return
+
+    # import sqlitedb first in the new processes, as the app does: importing
+    # tools first, to unpickle <func>, fails in the tools-sqlitedb cycle.
+    executor=concurrent.futures.ProcessPoolExecutor(n_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=importlib.import_module,
+            initargs=(sqlitedb.__name__,))
+    chunks=iter(chunks)
+    running=set()
+    try:
+        while True:
+            while len(running)<2*n_workers:
+                chunkii=next(chunks, None)
+                if chunkii is None:
+                    break
+                running.add(executor.submit(runJobChunk, func, chunkii))
+
+            if len(running)==0:
+                break
+
+            finished, running=concurrent.futures.wait(running,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for fii in finished:
+                resii=fii.result()
+                n_done+=len(resii)
+                if progress_callback is not None:
+                    progress_callback(n_done, n_total)
+                yield resii
+    finally:
+        for fii in running:
+            fii.cancel()
+        executor.shutdown(wait=False)
+
+    return
+
+
+# words ignored in title shingles for duplicate candidates
+TITLE_STOPWORDS=frozenset(['a', 'an', 'and', 'are', 'as', 'at', 'by', 'for',
+    'from', 'in', 'into', 'is', 'of', 'on', 'or', 'the', 'to', 'with'])
+
+
+def duplicateKeys(meta_dict, n_bands=10, band_size=3):
+    """Get blocking keys of a doc to find duplicate candidates
+
+    Args:
+        meta_dict (DocMeta): meta data dict of doc.
+    Kwargs:
+        n_bands (int): number of minhash bands of title.
+        band_size (int): number of minhashes in each band.
+
+    Returns:
+        exact_keys (list): keys of identifiers, ('doi', doi) and
+                           ('arxiv', arxiv id), docs sharing any are
+                           duplicates.
+        keys (list): keys of likely duplicates: ('ay', first author last
+                     name, year) for the year and the next, and ('title',
+                     band id, minhashes) for each locality-sensitive hashing
+                     band of title shingles.
+
+    Title shingles are pairs of adjacent words of the lower case title with
+    stop words removed. Docs whose shingle sets have a Jaccard similarity of
+    0.5 share a band at a chance of ~75%, and those with 0.8 at ~99.9%.
+    """
+
+    exact_keys=[]
+    keys=[]
+
+    doi=(meta_dict['doi'] or '').strip().lower()
+    doi=re.sub(r'^(https?://(dx\.)?doi\.org/|doi:\s*)', '', doi)
+    if doi:
+        exact_keys.append(('doi', doi))
+
+    arxiv=(meta_dict['arxivId'] or '').strip().lower()
+    arxiv=re.sub(r'^arxiv:\s*|v\d+$', '', arxiv)
+    if arxiv:
+        exact_keys.append(('arxiv', arxiv))
+
+    last_names=meta_dict['lastName_l']
+    if last_names and last_names[0]:
+        author=re.sub(r'\W+', '', last_names[0].lower())
+        year=str(meta_dict['year'] or '').strip()
+        if author and year.isdigit():
+            # so that docs 1 year apart, e.g. preprint and paper, share a key
+            keys.append(('ay', author, int(year)))
+            keys.append(('ay', author, int(year)+1))
+        elif author:
+            keys.append(('ay', author, year))
+
+    words=[wii for wii in re.findall(r'\w+', (meta_dict['title'] or '').lower())
+            if wii not in TITLE_STOPWORDS]
+    if len(words)>1:
+        shingles=set(zip(words[:-1], words[1:]))
+    else:
+        shingles=set(words)
+
+    if len(shingles)>0:
+        # the ii-th hash function of a shingle is the hash of (ii, shingle),
+        # stable within a session, which is all that is needed
+        hashes=[hash(sii) for sii in shingles]
+        minhashes=[min([hash((ii, hii)) for hii in hashes])
+            for ii in range(n_bands*band_size)]
+        for ii in range(n_bands):
+            keys.append(('title', ii,
+                tuple(minhashes[ii*band_size:(ii+1)*band_size])))
+
+    return exact_keys, keys
+
+
+def findDuplicateCandidates(meta_dict, docids1, docids2=None,
+        max_block=1000):
+    """Find pairs of docs likely to be duplicates, without comparing all pairs
+
+    Args:
+        meta_dict (dict): meta data of all documents. keys: docid,
+                          values: DocMeta dict.
+        docids1 (list): ids of docs in group 1.
+    Kwargs:
+        docids2 (list or None): if list, ids of docs in group 2, and pairs
+                                across group 1, 2 are found. If None, pairs
+                                among group 1 are found.
+        max_block (int): when checking among group 1, blocks of non-exact
+                         keys larger than this are skipped, as such a key,
+                         e.g. a common name in a year, says little about
+                         duplicates.
+
+    Returns:
+        exact (set): pairs sharing a DOI or arXiv id.
+        candidates (set): other pairs sharing a key, see duplicateKeys().
+
+    Pairs are (id1, id2) tuples, where id1<id2 if <docids2> is None, otherwise
+    id1 is from group 2 and id2 from group 1. Docs are grouped into blocks by
+    their keys, and only pairs within a block are returned, so the cost
+    grows with the number of docs rather than pairs.
+    """
+
+    group1=set(docids1)
+    group2=None if docids2 is None else set(docids2)
+    alldocs=group1 if group2 is None else group1.union(group2)
+
+    blocks={}
+    exact_blocks={}
+    for docii in alldocs:
+        exact_keys, keys=duplicateKeys(meta_dict[docii])
+        for kii in exact_keys:
+            exact_blocks.setdefault(kii, []).append(docii)
+        for kii in keys:
+            blocks.setdefault(kii, []).append(docii)
+
+    def getPairs(docs, results):
+        if group2 is None:
+            docs=sorted(docs)
+            for ii, docii in enumerate(docs):
+                for docjj in docs[ii+1:]:
+                    results.add((docii, docjj))
+        else:
+            docs2=[dii for dii in docs if dii in group2]
+            docs1=[dii for dii in docs if dii in group1]
+            for docii in docs2:
+                for docjj in docs1:
+                    if docii!=docjj:
+                        results.add((docii, docjj))
+        return
+
+    exact=set()
+    for docs in exact_blocks.values():
+        if len(docs)>1:
+            getPairs(docs, exact)
+
+    candidates=set()
+    for kii, docs in blocks.items():
+        if group2 is None and len(docs)>max_block:
+            LOGGER.info('Skip duplicate block %s of %d docs' %(kii[:2], len(docs)))
+            continue
+        if len(docs)>1:
+            getPairs(docs, candidates)
+
+    candidates.difference_update(exact)
+    LOGGER.info('%d exact and %d candidate duplicate pairs among %d docs'\
+            %(len(exact), len(candidates), len(alldocs)))
+
+    return exact, candidates
+
+
 def dfsCC(edges):
     '''Get connected components in undirected graph using DFS
 
@@ -498,6 +769,29 @@ def autoRename(abpath):
     return newname
 
 
+def fileHash(abspath, block_size=1<<20):
+    '''Compute the sha1 hash of a file's content
+
+    Args:
+        abspath (str): abs path to file.
+    Kwargs:
+        block_size (int): bytes to read at a time.
+
+    Returns:
+        hash (str): hex digest.
+    '''
+
+    sha=hashlib.sha1()
+    with open(abspath, 'rb') as fin:
+        while True:
+            block=fin.read(block_size)
+            if not block:
+                break
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
 def hasBin(bin_name):
     '''Check the existance of a binary'''
 
@@ -627,6 +921,9 @@ def clearLayout(layout):
 def delThumbnails(lib_folder, filename=None):
     '''Delete thumbnail files in cache folder
 
+    These are thumbnails saved directly in the _cache folder by older
+    versions, see thumbnail.ThumbnailCache for the current cache.
+
     Args:
         lib_folder (str): path to library folder.
     Kwargs:
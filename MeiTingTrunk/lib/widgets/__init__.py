@@ -4,7 +4,8 @@ from .meta_tab import MetaTabScroll, NoteTextEdit
 from .preference_dialog import PreferenceDialog
 from .export_dialog import ExportDialog
 from .duplicate_frame import CheckDuplicateFrame
-from .threadrun_dialog import ThreadRunDialog, Master, SimpleWorker
+from .threadrun_dialog import ThreadRunDialog, Master, PoolMaster, SimpleWorker,\
+        ProgressWorker, StreamWorker
 from .fail_dialog import FailDialog
 from .search_res_frame import SearchResFrame
 from .import_dialog import ImportDialog
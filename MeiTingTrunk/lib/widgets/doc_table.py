@@ -13,7 +13,6 @@ terms of the GPLv3 license.
 '''
 
 from datetime import datetime
-import operator
 import logging
 from queue import Queue
 from PyQt5 import QtWidgets, QtCore
@@ -26,17 +25,42 @@ from ..._MainFrameOtherSlots import SettingsThread
 LOGGER=logging.getLogger(__name__)
 
 
+def getSortKey(value, numeric=False):
+    '''Get a typed sort key of a table cell
+
+    Args:
+        value (str, int, bool or None): value in a table cell.
+
+    Kwargs:
+        numeric (bool): if True, sort by numerical value, e.g. for years.
+
+    Returns: key (float or str): float for numerical values, with missing
+             values as -inf, otherwise str, with missing values as ''.
+    '''
+
+    if numeric:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return float('-inf')
+
+    return '' if value is None else str(value)
+
+
 
 class TableModel(QAbstractTableModel):
 
     sort_change_sig=pyqtSignal(int, int)  # column idx, sort order
+    # columns sorted by numerical values
+    numeric_columns=['docid', 'favourite', 'read', 'has_file', 'year',
+            'added']
 
     def __init__(self, parent, datain, headerdata, settings):
         '''
         Args:
             parent (QWidget): parent widget.
-            datain (list): data for the table, a list of lists, each
-                           element list for a row. Created by
+            datain (list): data for the table, a list of DocRows, each
+                           for a row. Created by
                            _MainFrameLoadData.prepareDocs().
             headerdata (list): table column names.
             settings (QSettings): application settings. See _MainWindow.py
@@ -44,6 +68,9 @@ class TableModel(QAbstractTableModel):
 
         QAbstractTableModel.__init__(self, parent)
 
+        # current sorting, None if rows are not sorted
+        self.sort_col=None
+        self.sort_order=Qt.AscendingOrder
         self.ncol=len(headerdata)
         if datain is None:
             self.arraydata=[None]*self.ncol
@@ -51,6 +78,9 @@ class TableModel(QAbstractTableModel):
             self.arraydata=datain
         self.headerdata=headerdata
         self.settings=settings
+        self.added_col=self.headerdata.index('added')
+        # (normal, bold) fonts, see getFonts()
+        self._fonts=None
 
         self.icon_section={
                 'has_file': QIcon(':/file_icon.png')
@@ -67,6 +97,23 @@ class TableModel(QAbstractTableModel):
         self.sort_change_sig.connect(self.saveSort, Qt.QueuedConnection)
 
 
+    @property
+    def arraydata(self):
+        return self._arraydata
+
+
+    @arraydata.setter
+    def arraydata(self, value):
+        self._arraydata=value
+        # {column idx: {row: sort key}} for rows in current data
+        self._sort_keys={}
+        # {docid: row}, see updateRow()
+        self._doc_rows=None
+        # {row: formatted added date}, see formatAdded()
+        self._added_strs={}
+        self.sort_col=None
+
+
     def rowCount(self,p):
         return len(self.arraydata)
 
@@ -75,6 +122,61 @@ class TableModel(QAbstractTableModel):
         return self.ncol
 
 
+    def getFonts(self):
+        '''Get the normal and bold fonts of table entries
+
+        Returns:
+            fonts (tuple): (normal font, bold font), read from settings once
+                           and cached till clearRenderCache().
+        '''
+
+        if self._fonts is None:
+            font=self.settings.value('display/fonts/doc_table',QFont)
+            bold=QFont(font)
+            font.setBold(False)
+            bold.setBold(True)
+            self._fonts=(font, bold)
+
+        return self._fonts
+
+
+    def formatAdded(self, row):
+        '''Get the display str of the added time of a row
+
+        Args:
+            row (DocRow): a table row.
+
+        Returns: added (str): date like 'Mar-02' for this year, otherwise
+                 like 'Mar-02-18'. '' if no added time. Cached per row.
+        '''
+
+        added=self._added_strs.get(row)
+        if added is None:
+            added=row[self.added_col]
+            if added:
+                # convert time to str
+                added=datetime.fromtimestamp(int(added[:10]))
+                if added.year==datetime.today().year:
+                    added=added.strftime('%b-%d')
+                else:
+                    added=added.strftime('%b-%d-%y')
+            else:
+                added=''
+            self._added_strs[row]=added
+
+        return added
+
+
+    def clearRenderCache(self):
+        '''Drop cached fonts and display strs, e.g. when settings change'''
+
+        self._fonts=None
+        self._added_strs={}
+        self.layoutChanged.emit()
+
+        return
+
+
     def data(self, index, role):
         if not index.isValid():
             return QVariant()
@@ -85,26 +187,19 @@ class TableModel(QAbstractTableModel):
                 #pass
 
         if role == Qt.FontRole:
-            font=self.settings.value('display/fonts/doc_table',QFont)
+            font, bold=self.getFonts()
             if self.arraydata[index.row()][9] in [None, 'false']:
-                font.setBold(True)
+                return bold
             else:
-                font.setBold(False)
-            return font
+                return font
 
         if role==Qt.DisplayRole:
-            if index.column() in self.icon_sec_indices:
+            if index.column() in self.icon_sec_indices or\
+                    index.column() in self.check_sec_indices:
                 return
-            elif index.column()==self.headerdata.index('added'):
-                added=self.arraydata[index.row()][index.column()]
+            elif index.column()==self.added_col:
+                added=self.formatAdded(self.arraydata[index.row()])
                 if added:
-                    # convert time to str
-                    added=int(added[:10])
-                    added=datetime.fromtimestamp(added)
-                    if added.year==datetime.today().year:
-                        added=added.strftime('%b-%d')
-                    else:
-                        added=added.strftime('%b-%d-%y')
                     return QVariant(added)
                 else:
                     return
@@ -117,7 +212,7 @@ class TableModel(QAbstractTableModel):
         #if role==Qt.TextAlignmentRole:
             #return Qt.AlignCenter
         if index.column() in self.check_sec_indices and role==Qt.CheckStateRole:
-            if self.arraydata[index.row()][index.column()].isChecked():
+            if self.arraydata[index.row()][index.column()]:
                 return Qt.Checked
             else:
                 return Qt.Unchecked
@@ -135,10 +230,8 @@ class TableModel(QAbstractTableModel):
         if not index.isValid():
             return False
         if index.column() in self.check_sec_indices and role==Qt.CheckStateRole:
-            if value == Qt.Checked:
-                self.arraydata[index.row()][index.column()].setChecked(True)
-            else:
-                self.arraydata[index.row()][index.column()].setChecked(False)
+            self.arraydata[index.row()][index.column()]=value==Qt.Checked
+            self._sort_keys.pop(index.column(), None)
         self.dataChanged.emit(index,index)
 
         return True
@@ -170,15 +263,33 @@ class TableModel(QAbstractTableModel):
         return None
 
 
+    def getSortKeys(self, col):
+        '''Get sort keys of all rows in a column, computed once per data load
+
+        Args:
+            col (int): column index.
+
+        Returns: keys (dict): {row: sort key}.
+        '''
+
+        keys=self._sort_keys.get(col)
+        if keys is None:
+            numeric=self.headerdata[col] in self.numeric_columns
+            keys=dict(zip(self._arraydata, [getSortKey(rii[col], numeric)
+                for rii in self._arraydata]))
+            self._sort_keys[col]=keys
+
+        return keys
+
+
     def sort(self,col,order):
         self.layoutAboutToBeChanged.emit()
 
-        #NOTE that python3 doesn't support mixed type sorting (e.g. 1<None,
-        # 'a' > 2. So convert everything to str.
-        self.arraydata=sorted(self.arraydata,key=lambda x: \
-                str(operator.itemgetter(col)(x)) or '')
-        if order==Qt.DescendingOrder:
-            self.arraydata.reverse()
+        keys=self.getSortKeys(col)
+        self._arraydata=sorted(self._arraydata, key=keys.__getitem__,
+                reverse=order==Qt.DescendingOrder)
+        self.sort_col=col
+        self.sort_order=order
 
         # for some reason there is always a lag if I do anything with settings
         # here. Therefore this short delay
@@ -188,6 +299,56 @@ class TableModel(QAbstractTableModel):
         return
 
 
+    def updateRow(self, row):
+        '''Replace the row of a doc, and move only this row to its sorted
+        position
+
+        Args:
+            row (DocRow): new row of a doc.
+
+        Returns: idx (int or None): new index of the row. None if the doc is
+                 not in the table.
+        '''
+
+        if self._doc_rows is None:
+            self._doc_rows=dict([(rii[0], rii) for rii in self._arraydata])
+
+        old=self._doc_rows.get(row[0])
+        if old is None:
+            return None
+
+        self.layoutAboutToBeChanged.emit()
+
+        idx=self._arraydata.index(old)
+        del self._arraydata[idx]
+        self._doc_rows[row[0]]=row
+        self._added_strs.pop(old, None)
+        for col, keys in self._sort_keys.items():
+            keys.pop(old, None)
+            keys[row]=getSortKey(row[col],
+                    self.headerdata[col] in self.numeric_columns)
+
+        #-------Binary search the position in sorted rows-------
+        if self.sort_col is not None:
+            keys=self._sort_keys[self.sort_col]
+            key=keys[row]
+            descending=self.sort_order==Qt.DescendingOrder
+            lo, hi=0, len(self._arraydata)
+            while lo<hi:
+                mid=(lo+hi)//2
+                kmid=keys[self._arraydata[mid]]
+                if (key>kmid) if descending else (key<kmid):
+                    hi=mid
+                else:
+                    lo=mid+1
+            idx=lo
+
+        self._arraydata.insert(idx, row)
+        self.layoutChanged.emit()
+
+        return idx
+
+
     @pyqtSlot(int, int)
     def saveSort(self, col, order):
         '''Save sorting column and order to settings
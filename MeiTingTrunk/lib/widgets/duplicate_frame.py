@@ -19,8 +19,9 @@ from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QSize
 from PyQt5.QtGui import QBrush, QColor, QIcon, QCursor, QFont
 from PyQt5.QtWidgets import QDialogButtonBox, QStyle
 from .. import sqlitedb
-from ..tools import fuzzyMatchPrepare, fuzzyMatch, dfsCC, getHLine, parseAuthors
-from .threadrun_dialog import Master
+from ..tools import fuzzyMatchPrepare, fuzzyMatch, dfsCC, getHLine, parseAuthors,\
+        findDuplicateCandidates
+from .threadrun_dialog import Master, PoolMaster
 from .search_res_frame import AdjustableTextEditWithFold
 
 
@@ -241,9 +242,13 @@ class CheckDuplicateFrame(QtWidgets.QScrollArea):
             jobid (int): dummy job id.
             job_list (list): list of tuples, each providing the args for a
                              fuzzyMatch() call.
+
+        Only pairs found by findDuplicateCandidates() are matched, instead
+        of all pairs. Pairs sharing a DOI or arXiv id are given a score of
+        100 without matching. Only positive scores are saved in
+        self.scores_dict.
         '''
 
-        n=len(docids1)
         job_list=[]
         cache_dict={}  # store strings for docs to avoid re-compute
 
@@ -255,74 +260,36 @@ class CheckDuplicateFrame(QtWidgets.QScrollArea):
                 cdict[key]=value
             return value
 
-        #----------------Check among docds----------------
-        if docid2 is None:
-            jobid2=0
-            for ii in range(n):
-                docii=docids1[ii]
-                _, authorsii, titleii, jyii=getFromCache(cache_dict, docii)
-                for jj in range(n):
-                    docjj=docids1[jj]
-                    if ii>=jj:
-                        self.scores_dict[(docii, docjj)]=0
-                    else:
-                        _, authorsjj, titlejj, jyjj=getFromCache(cache_dict,
-                                docjj)
+        if docid2 is not None and not isinstance(docid2, (tuple,list)):
+            # docid2 is a single doc
+            docid2=[docid2,]
 
-                        # shortcut: skip if author string len diff >= 50%
-                        if abs(len(authorsii)-len(authorsjj))>=\
-                                max(len(authorsii), len(authorsjj))//2:
-                            self.scores_dict[(docii, docjj)]=0
-                            continue
+        exact, candidates=findDuplicateCandidates(self.meta_dict, docids1,
+                docid2)
 
-                        # shortcut: skip if title string len diff >= 50%
-                        if abs(len(titleii)-len(titlejj))>=\
-                                max(len(titleii), len(titlejj))//2:
-                            self.scores_dict[(docii, docjj)]=0
-                            continue
+        for pairii in exact:
+            self.scores_dict[pairii]=100
 
-                        job_list.append((jobid2,
-                            getFromCache(cache_dict, docii),
-                            getFromCache(cache_dict, docjj),
-                            self.min_score))
-                        jobid2+=1
+        jobid2=0
+        for docii, docjj in sorted(candidates):
+            _, authorsii, titleii, jyii=getFromCache(cache_dict, docii)
+            _, authorsjj, titlejj, jyjj=getFromCache(cache_dict, docjj)
 
+            # shortcut: skip if author string len diff >= 50%
+            if abs(len(authorsii)-len(authorsjj))>=\
+                    max(len(authorsii), len(authorsjj))//2:
+                continue
 
-        #-----------------nxm compare-----------------
-        else:
-            if not isinstance(docid2, (tuple,list)):
-                # docid2 is a single doc
-                docid2=[docid2,]
-
-            m=len(docid2)
-            jobid2=0
-
-            for ii in range(m):
-                docii=docid2[ii]
-                _, authorsii, titleii, jyii=getFromCache(cache_dict, docii)
-                for jj in range(n):
-                    docjj=docids1[jj]
-                    if docii!=docjj:
-                        _, authorsjj, titlejj, jyjj=getFromCache(cache_dict,
-                                docjj)
-
-                        # shortcut: skip if author string len diff >= 50%
-                        if abs(len(authorsii)-len(authorsjj))>=\
-                                max(len(authorsii), len(authorsjj))//2:
-                            self.scores_dict[(docii, docjj)]=0
-                            continue
-
-                        # shortcut: skip if title string len diff >= 50%
-                        if abs(len(titleii)-len(titlejj))>=\
-                                max(len(titleii), len(titlejj))//2:
-                            self.scores_dict[(docii, docjj)]=0
-                            continue
-
-                        job_list.append((jobid2,
-                            getFromCache(cache_dict, docii),
-                            getFromCache(cache_dict, docjj),
-                            self.min_score))
-                        jobid2+=1
+            # shortcut: skip if title string len diff >= 50%
+            if abs(len(titleii)-len(titlejj))>=\
+                    max(len(titleii), len(titlejj))//2:
+                continue
+
+            job_list.append((jobid2,
+                getFromCache(cache_dict, docii),
+                getFromCache(cache_dict, docjj),
+                self.min_score))
+            jobid2+=1
 
         return 0,jobid,job_list
 
@@ -335,14 +302,18 @@ class CheckDuplicateFrame(QtWidgets.QScrollArea):
         rec,jobid,job_list=self.master1.results[0]
         LOGGER.debug('rec from job list prepare = %s' %rec)
 
-        if rec==0 and len(job_list)>0:
+        if rec==0 and len(job_list)==0:
+            self.addResults()
+        elif rec==0 and len(job_list)>0:
             self.parent.progressbar.setMaximum(0)
             self.parent.progressbar.setVisible(True)
             # make a separate master for fuzzy matching. This separation of
             # joblist-preparing and fuzzy matching is for easy aborting.
             # For large data size, it might take a few seconds to get the job
             # list prepared, therefore 2 threaded calls.
-            self.master2=Master(fuzzyMatch,job_list,1,self.parent.progressbar,
+            # Matching is cpu bound, so run in chunks in a pool of processes.
+            self.master2=PoolMaster(fuzzyMatch,job_list,None,
+                    self.parent.progressbar,
                     'classic',self.parent.status_bar,'Computing Fuzzy Matching...')
             self.master2.all_done_signal.connect(self.collectResults)
             self.clear_duplicate_button.clicked.connect(self.master2.abortJobs)
@@ -359,7 +330,8 @@ class CheckDuplicateFrame(QtWidgets.QScrollArea):
         for recii,jobidii,resii in new:
             if recii==0:
                 kii,vii=resii
-                self.scores_dict[kii]=vii
+                if vii>0:
+                    self.scores_dict[kii]=vii
 
         LOGGER.info('Duplicate search results collected.')
         self.addResults()
@@ -396,6 +368,7 @@ class CheckDuplicateFrame(QtWidgets.QScrollArea):
         '''Add matching results to treewidget'''
 
         edges=[kk for kk,vv in self.scores_dict.items() if vv>=self.min_score]
+        edge_set=set(edges)
         hi_color=self.settings.value('display/folder/highlight_color_br',
                 QBrush)
 
@@ -457,10 +430,11 @@ class CheckDuplicateFrame(QtWidgets.QScrollArea):
             # sort group members by scores
             scores=[]
             for djj in others:
-                if (docii, djj) in edges:
+                # pairs not matched or not scored have no entry
+                if (docii, djj) in edge_set:
                     sii=self.scores_dict[(docii, djj)]
                 else:
-                    sii=self.scores_dict[(djj, docii)]
+                    sii=self.scores_dict.get((djj, docii), 0)
                 scores.append(sii)
 
             others=[x for _,x in sorted(zip(scores,others), reverse=True)]
@@ -15,13 +15,12 @@ terms of the GPLv3 license.
 import os
 import logging
 from collections import OrderedDict
-from fuzzywuzzy import fuzz
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QModelIndex
 from PyQt5.QtGui import QFont, QBrush, QFontMetrics
 from PyQt5.QtWidgets import QDialogButtonBox
 from ..tools import getHLine, dfsCC, getSqlitePath,\
-        createDelButton
+        createDelButton, fuzzRatio
 from .threadrun_dialog import ThreadRunDialog
 from .doc_table import MyHeaderView, TableModel
 from .. import sqlitedb
@@ -386,24 +385,19 @@ class MergeNameDialog(QtWidgets.QDialog):
         QtWidgets.QApplication.processEvents() # seems needed
         LOGGER.debug('rec from job list prepare = %s' %rec)
 
-        def fuzzWrapper(jobid, t1, t2):
-            try:
-                s=fuzz.ratio(t1, t2)
-                return 0, jobid, ((t1, t2), s)
-            except:
-                return 1, jobid, None
-
         if rec==0 and len(job_list)>0:
+            # matching is cpu bound, so run in chunks in a pool of processes
             self.thread_run_dialog2=ThreadRunDialog(
-                    fuzzWrapper,
+                    fuzzRatio,
                     job_list,
                     show_message='Computing Fuzzy Matching...',
-                    max_threads=1,
+                    max_threads=None,
                     get_results=True,
                     close_on_finish=True,
                     progressbar_style='classic',
                     post_process_func=None,
-                    parent=self)
+                    parent=self,
+                    chunk_size=2000)
 
             self.thread_run_dialog2.master.all_done_signal.connect(
                     self.collectResults)
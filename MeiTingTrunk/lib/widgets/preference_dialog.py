@@ -122,6 +122,10 @@ class PreferenceDialog(QtWidgets.QDialog):
             self.parent.main_frame.auto_save_timer.setInterval(interval*60*1000)
             LOGGER.info('Set auto save timer to %s' %interval)
 
+        #-------------Refresh doc table fonts-------------
+        if 'display/fonts/doc_table' in self.new_values:
+            self.parent.main_frame.doc_table.model().clearRenderCache()
+
         self.new_values={}
 
         #---------------Create output folder---------------
@@ -636,6 +640,45 @@ class PreferenceDialog(QtWidgets.QDialog):
 
         va.addWidget(slider3)
 
+        label6=QtWidgets.QLabel('Number of Pages to Preview')
+        spinbox2=QtWidgets.QSpinBox()
+        spinbox2.setMinimum(1)
+        spinbox2.setMaximum(20)
+        spinbox2.setValue(self.settings.value('view/thumbnail_pages',1,type=int))
+        spinbox2.valueChanged.connect(self.changeThumbnailPages)
+
+        ha=QtWidgets.QHBoxLayout()
+        ha.addWidget(label6)
+        ha.addWidget(spinbox2)
+        va.addLayout(ha)
+
+        label7=QtWidgets.QLabel('Max Size of Thumbnail Cache (MB, Takes Effect on Next Opening)')
+        spinbox3=QtWidgets.QSpinBox()
+        spinbox3.setMinimum(10)
+        spinbox3.setMaximum(10000)
+        spinbox3.setSingleStep(50)
+        spinbox3.setValue(self.settings.value('view/thumbnail_cache_mb',200,type=int))
+        spinbox3.valueChanged.connect(self.changeThumbnailCacheSize)
+
+        ha=QtWidgets.QHBoxLayout()
+        ha.addWidget(label7)
+        ha.addWidget(spinbox3)
+        va.addLayout(ha)
+
+        #----------------lazy loading section----------------
+        va.addWidget(getHLine(self))
+        label5=QtWidgets.QLabel('Large Libraries')
+        label5.setStyleSheet(self.label_color)
+        label5.setFont(self.title_label_font)
+        va.addWidget(label5)
+
+        checkbox2=QtWidgets.QCheckBox(
+            'Load Abstracts, Notes, URLs and Files Only When Needed (Takes Effect on Next Opening)')
+        checkbox2.stateChanged.connect(self.changeLazyLoadMeta)
+        lazy_load=self.settings.value('file/lazy_load_meta',0,type=int)
+        checkbox2.setChecked(lazy_load==1)
+        va.addWidget(checkbox2)
+
         va.addStretch()
 
         return scroll
@@ -654,6 +697,19 @@ class PreferenceDialog(QtWidgets.QDialog):
         return
 
 
+    def changeLazyLoadMeta(self,on):
+        '''Store the check state of the lazy loading checkbox'''
+
+        if on:
+            self.new_values['file/lazy_load_meta']=1
+        else:
+            self.new_values['file/lazy_load_meta']=0
+
+        LOGGER.info('Change lazy load meta to %s' %on)
+
+        return
+
+
     def changeRecentNumber(self,value):
         '''Store the value on the recent open slider'''
 
@@ -672,6 +728,24 @@ class PreferenceDialog(QtWidgets.QDialog):
         return
 
 
+    def changeThumbnailPages(self,value):
+        '''Store the value in the thumbnail pages spinbox'''
+
+        LOGGER.debug('Change thumbnail page number to %s' %value)
+        self.new_values['view/thumbnail_pages']=value
+
+        return
+
+
+    def changeThumbnailCacheSize(self,value):
+        '''Store the value in the thumbnail cache size spinbox'''
+
+        LOGGER.debug('Change thumbnail cache size to %s MB' %value)
+        self.new_values['view/thumbnail_cache_mb']=value
+
+        return
+
+
     def changeDuplicateMinScore(self,value):
         '''Store the value in the duplicate minimum score spinbox'''
 
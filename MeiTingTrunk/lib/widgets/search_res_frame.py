@@ -20,12 +20,12 @@ import logging
 import subprocess
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QSize, QRegExp, QRect,\
-        QPoint
+        QPoint, QTimer
 from PyQt5.QtGui import QBrush, QColor, QFont, QSyntaxHighlighter,\
         QTextCharFormat, QFontMetrics
 from PyQt5.QtWidgets import QDialogButtonBox
 from .threadrun_dialog import Master
-from .. import sqlitefts
+from .. import sqlitefts, sqlitedb
 from ..tools import iterTreeWidgetItems, isXapianReady, getSqlitePath
 if isXapianReady():
     from .. import xapiandb
@@ -363,9 +363,21 @@ class SearchResFrame(QtWidgets.QScrollArea):
         self.tree.setDragDropMode(QtWidgets.QAbstractItemView.NoDragDrop)
         #self.tree.setContextMenuPolicy(Qt.CustomContextMenu)
         self.tree.itemSelectionChanged.connect(self.changeBGColor)
+        self.tree.itemExpanded.connect(self.loadSnippets)
+        self.tree.verticalScrollBar().valueChanged.connect(self.fetchNextPage)
 
         self.is_all_fold=False
 
+        # full text matches are fetched in pages, and snippets loaded when
+        # a doc is expanded
+        self.page_size=50
+        self.search_session=None
+        self.xapian_docids=None
+        self.xapian_estimate=0
+        self.xapian_next_offset=None
+        self.doc_items={}  # docid: header item
+        self.lazy_rows={}  # docid_in_str: rows waiting for snippets
+
         self.noMatchLabel=QtWidgets.QLabel('No match found.')
         self.noMatchLabel.setVisible(False)
         va.addWidget(self.noMatchLabel)
@@ -465,11 +477,13 @@ class SearchResFrame(QtWidgets.QScrollArea):
             if relpath is not None:
                 labelii=QtWidgets.QPushButton('%s: ' %label)
                 labelii.clicked.connect(lambda: self.openPDF(relpath))
-                # if text is list, a list of snippets
-                if isinstance(text, list):
+                # if text is list, a list of snippets. If None, snippets are
+                # loaded later, see loadSnippets()
+                if isinstance(text, list) or text is None:
+                    snip_list=[] if text is None else text
                     snip_button=QtWidgets.QPushButton('Snippets')
                     snip_button.clicked.connect(lambda: openSnippetsDialog(
-                        text, relpath))
+                        snip_list, relpath))
             else:
                 labelii=QtWidgets.QLabel('%s: ' %label)
 
@@ -480,9 +494,15 @@ class SearchResFrame(QtWidgets.QScrollArea):
             grid.addWidget(text_editii.fold_button,crow,1)
 
             if relpath is not None:
-                if isinstance(text, list):
+                if isinstance(text, list) or text is None:
                     text_editii.fold_above_nl=3
-                    text_editii.setText(text[0])
+                    if text is None:
+                        text_editii.setText('Loading snippets...')
+                        snip_button.setEnabled(False)
+                        self.lazy_rows.setdefault(str(meta['id']), []).append(
+                                (relpath, text_editii, snip_button, snip_list))
+                    elif len(text)>0:
+                        text_editii.setText(text[0])
                     va=QtWidgets.QVBoxLayout()
                     va.addWidget(labelii)
                     va.addWidget(snip_button)
@@ -597,6 +617,9 @@ class SearchResFrame(QtWidgets.QScrollArea):
         """
 
         self.tree.clear()
+        self.doc_items={}
+        self.lazy_rows={}
+        self.xapian_next_offset=None
         self.setVisible(True)
         self.meta_dict=meta_dict
         self.folder_data=folder_data
@@ -604,19 +627,42 @@ class SearchResFrame(QtWidgets.QScrollArea):
         self.desend=desend
         LOGGER.info('search text = %s. is desend = %s' %(text, desend))
 
-        # Didn't put it to separate thread as access to sqlite db is restricted
-        # to single thread.
-        search_res, search_folderids=sqlitefts.searchMultipleLike2(db, text, field_list,
-                folderid, desend)
+        #---------------Get docs in folder(s)---------------
+        if folderid=='-1':
+            docids=None
+        elif folderid=='-2':
+            docids=self.folder_data['-2']
+        else:
+            if desend:
+                search_folderids=sqlitedb.getSubFolders(
+                        self.parent.folder_dict, folderid)+[folderid,]
+            else:
+                search_folderids=[folderid,]
+            docids=[]
+            for fii in search_folderids:
+                docids.extend(self.folder_data[str(fii)])
+
+        #----------------Search meta data----------------
+        # the in-memory index has unsaved edits, and doesn't touch sqlite
+        meta_index=getattr(self.parent, 'meta_index', None)
+        if meta_index is not None and meta_index.hasFields(field_list):
+            search_res=meta_index.search(text, field_list, docids)
+        else:
+            # Didn't put it to separate thread as access to sqlite db is
+            # restricted to single thread.
+            search_res=sqlitefts.searchMultipleFTS(db, text, field_list,
+                    folderid, desend)
 
         #def searchXapian(jobid, dbpath, querystring, fields, docids):
         sqlitepath=getSqlitePath(db)
 
-        def searchXapian(jobid, dbpath, querystring, docids, sqlitepath ):
+        def searchXapian(jobid, session, querystring, docids):
             try:
                 #result=xapiandb.search(dbpath, querystring, fields,
                         #docids=docids)
-                result=xapiandb.search2(dbpath, sqlitepath, querystring, docids)
+                # only get the 1st page, without snippets
+                result=session.searchPage(querystring, docids, 0,
+                        self.page_size)
                 return 0, jobid, result
             except Exception:
                 LOGGER.exception('Failed to call searchXapian.')
@@ -626,20 +672,20 @@ class SearchResFrame(QtWidgets.QScrollArea):
         if 'PDF' in field_list:
             xapian_db=os.path.join(self.settings.value(
                 'saving/current_lib_folder', type=str), '_xapian_db')
+            self.search_session=self.parent.search_session
+            if self.search_session is None:
+                # keep it in the main frame to reuse, and to close it with
+                # the library, see stopIndexService()
+                self.search_session=xapiandb.SearchSession(xapian_db,
+                        sqlitepath)
+                self.parent.search_session=self.search_session
 
             # filter by docids
-            if folderid=='-1':
-                docids=None
-            elif folderid=='-2':
-                docids=self.folder_data['-2']
-            else:
-                docids=[]
-                for fii in search_folderids:
-                    docids.extend(self.folder_data[str(fii)])
+            self.xapian_docids=docids
 
             #self.master1=Master(searchXapian, [(0, xapian_db, text, ['pdf',],
-            self.master1=Master(searchXapian, [(0, xapian_db, text,
-                docids, sqlitepath)],
+            self.master1=Master(searchXapian, [(0, self.search_session, text,
+                docids)],
                     1, self.parent.progressbar,
                     'busy', self.parent.status_bar, 'Search PDFs...')
             self.master1.all_done_signal.connect(lambda: \
@@ -668,14 +714,17 @@ class SearchResFrame(QtWidgets.QScrollArea):
                         ]
         '''
 
-        rec, _, xapian_results=self.master1.results[0]
+        rec, _, result=self.master1.results[0]
         # xapian_results: dict, key = docid_in_str, value: dict:
-        #                       {relpath1: snippet1,
-        #                        relpath2: snippet2,
+        #                       {relpath1: None,
+        #                        relpath2: None,
         #                         ... }
+        # snippets are loaded when expanding a doc, see loadSnippets()
         if rec==1:
             LOGGER.error('Failed to retrieve xapian search results.')
+            xapian_results=None
         else:
+            xapian_results, self.xapian_estimate, self.xapian_next_offset=result
             sqlite_docs=[ii[0] for ii in sqlite_results]
 
             for idii in xapian_results.keys():
@@ -718,25 +767,6 @@ class SearchResFrame(QtWidgets.QScrollArea):
                 If None, xapian search was not performed.
         '''
 
-        def createEntry(docid, gid):
-            '''Create an entry for a matched doc
-
-            Args:
-                docid (int): id of matched doc.
-                gid (int): counter of the current doc.
-            '''
-
-            meta=self.meta_dict[docid]
-            item=QtWidgets.QTreeWidgetItem([
-                gid,
-                ', '.join(meta['authors_l']),
-                meta['title'],
-                meta['publication'],
-                str(meta['year']),
-                str(docid)
-                ])
-            return item
-
         #-------------------If no match-------------------
         if len(sqlite_res)==0:
             self.noMatchLabel.setVisible(True)
@@ -745,15 +775,11 @@ class SearchResFrame(QtWidgets.QScrollArea):
             return
 
         self.noMatchLabel.setVisible(False)
-        self.label.setText('%d searches results related to "%s"'\
-                %(len(sqlite_res),search_text))
 
         #-------------Create entries for docs-------------
         for ii,recii in enumerate(sqlite_res):
             docii, fieldii=recii
             fieldii=list(set(fieldii.split(','))) # str to list
-            itemii=createEntry(docii, str(ii+1))
-            self.tree.addTopLevelItem(itemii)
 
             # get xapian search results for doc if exists
             if xapian_res is not None and docii in xapian_res:
@@ -761,11 +787,9 @@ class SearchResFrame(QtWidgets.QScrollArea):
             else:
                 pdf_match_dict=None
 
-            # add group members
-            self.addFieldRows(itemii, fieldii, self.meta_dict[docii],
-                    pdf_match_dict, search_text)
+            self.addDocEntry(docii, fieldii, pdf_match_dict, search_text)
 
-        self.tree.expandAll()
+        self.updateResultLabel()
 
         # highlight header rows
         hi_color=self.settings.value('display/folder/highlight_color_br',
@@ -781,6 +805,132 @@ class SearchResFrame(QtWidgets.QScrollArea):
 
         self.search_done_sig.emit() # trigger main_frame.status_bar.clearMessage()
 
+        # fill the view if the 1st page is short
+        QTimer.singleShot(0, self.fetchNextPage)
+
+        return
+
+
+    def addDocEntry(self, docid, fields, pdf_match_dict, search_text):
+        '''Add a matched doc to the QTreeWidget
+
+        Args:
+            docid (int): id of matched doc.
+            fields (list): list of matched field names.
+            pdf_match_dict (dict or None): full text matches of doc, see
+                                           addFieldRows().
+            search_text (str): searched text.
+
+        Docs with full text matches are not expanded, so their snippets are
+        only computed when the user expands them.
+        '''
+
+        meta=self.meta_dict[docid]
+        item=QtWidgets.QTreeWidgetItem([
+            str(self.tree.topLevelItemCount()+1),
+            ', '.join(meta['authors_l']),
+            meta['title'],
+            meta['publication'],
+            str(meta['year']),
+            str(docid)
+            ])
+        self.tree.addTopLevelItem(item)
+        self.doc_items[docid]=item
+
+        # add group members
+        self.addFieldRows(item, fields, meta, pdf_match_dict, search_text)
+
+        if str(docid) not in self.lazy_rows:
+            item.setExpanded(True)
+
+        return
+
+
+    def updateResultLabel(self):
+
+        text='%d searches results related to "%s"'\
+                %(self.tree.topLevelItemCount(), self.search_text)
+        if self.xapian_next_offset is not None:
+            text+=' (about %d file matches, scroll for more)'\
+                    %self.xapian_estimate
+        self.label.setText(text)
+
+        return
+
+
+    @pyqtSlot(QtWidgets.QTreeWidgetItem)
+    def loadSnippets(self, item):
+        '''Compute the full text snippets of a doc when it is expanded
+
+        Args:
+            item (QTreeWidgetItem): expanded header item of a doc.
+        '''
+
+        rows=self.lazy_rows.pop(item.data(5,0), [])
+        for relpath, text_edit, snip_button, snip_list in rows:
+            try:
+                snips=self.search_session.getFileSnippets(self.search_text,
+                        relpath)
+            except Exception:
+                LOGGER.exception('Failed to get snippets of %s' %relpath)
+                snips=[]
+
+            if isinstance(snips, list):
+                snip_list.extend(snips)
+                snip_button.setEnabled(len(snips)>0)
+                text_edit.setText(snips[0] if len(snips)>0 else '')
+            else:
+                # no texts of file, snips is file name
+                snip_button.setVisible(False)
+                text_edit.setText(snips)
+
+        return
+
+
+    @pyqtSlot()
+    def fetchNextPage(self):
+        '''Add the next page of full text matches when scrolled to bottom'''
+
+        if self.xapian_next_offset is None:
+            return
+
+        scrollbar=self.tree.verticalScrollBar()
+        if scrollbar.value()<scrollbar.maximum()-scrollbar.pageStep()//2:
+            return
+
+        offset=self.xapian_next_offset
+        # set None first to avoid re-entering when adding items
+        self.xapian_next_offset=None
+
+        LOGGER.debug('Fetching full text matches from %d' %offset)
+        try:
+            matches, self.xapian_estimate, next_offset=\
+                    self.search_session.searchPage(self.search_text,
+                            self.xapian_docids, offset, self.page_size)
+        except Exception:
+            LOGGER.exception('Failed to get full text matches.')
+            return
+
+        for docid, matchii in matches.items():
+            if docid in self.doc_items:
+                # doc already shown, add rows of the new files to it
+                itemii=self.doc_items[docid]
+                self.addFieldRows(itemii, ['pdf'], self.meta_dict[docid],
+                        matchii['pdf'], self.search_text)
+                if itemii.isExpanded():
+                    self.loadSnippets(itemii)
+            elif docid in self.meta_dict:
+                self.addDocEntry(docid, ['pdf'], matchii['pdf'],
+                        self.search_text)
+
+        self.xapian_next_offset=next_offset
+        self.updateResultLabel()
+
+        # keep going if the view is still not filled, after the tree has
+        # updated its scroll range
+        if next_offset is not None:
+            QTimer.singleShot(0, self.fetchNextPage)
+
         return
 
 
@@ -19,6 +19,7 @@ import logging
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import QObject, QThread, Qt, pyqtSignal, pyqtSlot
 from PyQt5.QtWidgets import QDialogButtonBox
+from ..tools import poolJobs
 
 
 LOGGER=logging.getLogger(__name__)
@@ -46,6 +47,97 @@ class SimpleWorker(QObject):
 
 
 
+class ProgressWorker(QObject):
+
+    progress_signal=pyqtSignal(int, int) # NO. of finished steps, total steps
+    done_signal=pyqtSignal()
+
+    def __init__(self, id, func, args=()):
+        super().__init__()
+        '''Worker used in separate thread, running a single function that
+        reports its own progress.
+
+        Args:
+            id (int): id for the thread/worker.
+            func (function): function object to call in the thread. It is
+                called as func(*args, progress_callback=callback), where
+                callback(n_done, n_total) emits progress_signal.
+        Kwargs:
+            args (tuple): positional args for func.
+
+        Return of func is stored in the results attribute, which is None if
+        func raised an exception.
+        '''
+
+        self.id=id
+        self.func=func
+        self.args=args
+        self.results=None
+
+    @pyqtSlot()
+    def processJob(self):
+        try:
+            self.results=self.func(*self.args,
+                    progress_callback=self.progress_signal.emit)
+        except:
+            LOGGER.exception('Job in worker %s failed.' %self.id)
+            self.results=None
+        self.done_signal.emit()
+
+        return
+
+
+
+class StreamWorker(QObject):
+
+    data_signal=pyqtSignal(object) # a piece of the results
+    progress_signal=pyqtSignal(int, int) # NO. of finished steps, total steps
+    done_signal=pyqtSignal()
+
+    def __init__(self, id, func, args=()):
+        super().__init__()
+        '''Worker used in separate thread, running a generator function
+        whose results are sent out as they come.
+
+        Args:
+            id (int): id for the thread/worker.
+            func (function): generator function to call in the thread. It is
+                called as func(*args, progress_callback=callback), where
+                callback(n_done, n_total) emits progress_signal.
+        Kwargs:
+            args (tuple): positional args for func.
+
+        Each value yielded by func is emitted by data_signal. Setting the
+        abort attribute to True stops the job at the next value. The failed
+        attribute is True if func raised an exception.
+        '''
+
+        self.id=id
+        self.func=func
+        self.args=args
+        self.abort=False
+        self.failed=False
+
+    @pyqtSlot()
+    def processJob(self):
+        gen=self.func(*self.args, progress_callback=self.progress_signal.emit)
+        try:
+            for resii in gen:
+                if self.abort:
+                    break
+                self.data_signal.emit(resii)
+        except:
+            LOGGER.exception('Job in worker %s failed.' %self.id)
+            self.failed=True
+        finally:
+            # clean up an aborted generator in this thread
+            gen.close()
+        self.done_signal.emit()
+
+        return
+
+
+
 class Worker(QObject):
 
     worker_jobdone_signal=pyqtSignal(int) # jobid
@@ -138,7 +230,7 @@ class Master(QObject):
             parent (QWidget): parent widget.
 
         '''
-        super(self.__class__,self).__init__()
+        super(Master,self).__init__()
 
         self.func=func
         self.joblist=joblist
@@ -266,6 +358,116 @@ class Master(QObject):
         return
 
 
+class PoolMaster(Master):
+
+    def __init__(self, func, joblist, max_workers=None, progressbar=None,
+            progressbar_style='classic',
+            statusbar=None,
+            show_message='',
+            post_process_func=None,
+            post_process_func_args=(),
+            post_process_progress=1,
+            close_on_finish=True,
+            parent=None,
+            chunk_size=500):
+        '''A controller running cpu bound tasks in chunks in a pool of
+        processes, collecting results and sending feedbacks on task status
+
+        Args:
+            func (function): module level function object to call on each
+                job, see tools.poolJobs().
+            joblist( list): list of job tasks, in the format:
+                [(jobid1, jobargs), (jobid2, jobargs) ... ]
+
+        Kwargs:
+            max_workers (int or None): maximum number of processes. If None,
+                use the number of cores.
+            chunk_size (int): number of jobs sent to a process at a time.
+            Others are the same as Master.
+
+        The pool is driven by a StreamWorker in a separate thread, and
+        the progressbar is updated once for each chunk.
+        '''
+        super(PoolMaster,self).__init__(func, joblist, max_workers,
+                progressbar, progressbar_style, statusbar, show_message,
+                post_process_func, post_process_func_args,
+                post_process_progress, close_on_finish, parent)
+
+        self.chunk_size=chunk_size
+
+
+    def run(self):
+
+        if self.progressbar:
+            if self.progressbar_style=='classic':
+                if self.post_process_func is None:
+                    self.progressbar.setMaximum(len(self.joblist))
+                else:
+                    self.progressbar.setMaximum(len(self.joblist)+\
+                            self.post_process_progress)
+                self.progressbar.setValue(0)
+            elif self.progressbar_style=='busy':
+                self.progressbar.setMaximum(0)
+            else:
+                raise Exception("Not defined")
+            self.progressbar.setVisible(True)
+        if self.statusbar and self.show_message:
+            self.statusbar.showMessage(self.show_message)
+
+        self.results=[]
+        self.finished=0
+        self.aborted=False
+
+        tii=QThread()
+        wii=StreamWorker(0, poolJobs, args=(self.func, self.joblist,
+            self.chunk_size, self.max_threads))
+        self.threads=[(tii,wii)] # need to keep record of both!
+
+        wii.moveToThread(tii)
+        wii.data_signal.connect(self.collectChunk)
+        wii.done_signal.connect(self.poolDone)
+        tii.started.connect(wii.processJob)
+        tii.start()
+
+        return
+
+
+    @pyqtSlot(object)
+    def collectChunk(self, results):
+
+        self.results.extend(results)
+        self.finished+=len(results)
+        self.donejobs_count_signal.emit(self.finished)
+        if self.progressbar and self.progressbar_style=='classic':
+            self.progressbar.setValue(self.finished)
+
+        LOGGER.debug('finished = %s. NO of results = %d' %(self.finished,
+            len(self.results)))
+
+        return
+
+
+    @pyqtSlot()
+    def poolDone(self):
+
+        if self.aborted:
+            return
+        if self.threads[0][1].failed:
+            LOGGER.warning('Pool jobs failed. Got %d of %d results.'\
+                    %(len(self.results), len(self.joblist)))
+        self.all_done_signal.emit()
+
+        return
+
+
+    @pyqtSlot()
+    def abortJobs(self):
+        self.aborted=True
+        super(PoolMaster,self).abortJobs()
+
+        return
+
+
 class ThreadRunDialog(QtWidgets.QDialog):
 
     abort_job_signal=pyqtSignal()
@@ -276,7 +478,8 @@ class ThreadRunDialog(QtWidgets.QDialog):
             post_process_func=None,
             post_process_func_args=(),
             post_process_progress=1,
-            parent=None):
+            parent=None,
+            chunk_size=None):
         '''A modal dialog shown when calling some long-lasting tasks, with
         message label, progressbar giving feedbacks.
 
@@ -299,6 +502,9 @@ class ThreadRunDialog(QtWidgets.QDialog):
             post_process_progress (int): when using 'classic' progressbar,
                 how much percentage should the post-process count.
             parent (QWidget): parent widget.
+            chunk_size (int or None): if not None, run jobs in chunks of
+                <chunk_size> in <max_threads> processes, using PoolMaster.
+                <func> should be a module level function.
         '''
 
         super(self.__class__,self).__init__(parent=parent)
@@ -337,13 +543,23 @@ class ThreadRunDialog(QtWidgets.QDialog):
         self.buttons.accepted.connect(self.accept)
         self.buttons.rejected.connect(self.abortJobs)
 
-        self.master=Master(func,joblist,self.max_threads,self.progressbar,
-                self.progressbar_style, None, '',
-                self.post_process_func,
-                self.post_process_func_args,
-                self.post_process_progress,
-                self.close_on_finish,
-                None)
+        if chunk_size is None:
+            self.master=Master(func,joblist,self.max_threads,self.progressbar,
+                    self.progressbar_style, None, '',
+                    self.post_process_func,
+                    self.post_process_func_args,
+                    self.post_process_progress,
+                    self.close_on_finish,
+                    None)
+        else:
+            self.master=PoolMaster(func,joblist,self.max_threads,
+                    self.progressbar,
+                    self.progressbar_style, None, '',
+                    self.post_process_func,
+                    self.post_process_func_args,
+                    self.post_process_progress,
+                    self.close_on_finish,
+                    None, chunk_size)
 
         self.ok_button=self.buttons.button(QDialogButtonBox.Ok)
         self.ok_button.setEnabled(False)
@@ -16,11 +16,16 @@ import os
 from urllib.parse import unquote, quote
 from urllib.parse import urlparse
 import json
+from collections import OrderedDict
+import gzip
+import concurrent.futures
 import logging
 import subprocess
+import tempfile
+import threading
 import xapian
 import sqlite3
-import multiprocessing
+from .tools import fileHash
 
 LOGGER=logging.getLogger(__name__)
 
@@ -61,19 +66,24 @@ def createDatabase(dbpath):
         return None
 
 
-def delXapianDoc(dbpath, qid):
+def delXapianDoc(dbpath, qid, db=None):
     '''Delete a xapian doc by unique doc id
 
     Args:
         dbpath (str): path to xapian database folder.
         qid (str): unique doc id.
+    Kwargs:
+        db (xapian database or None): return value of
+                                      xapian.WritableDatabase(), to delete
+                                      several docs with one handle.
 
     Returns:
         rec (int): 0 if successful, 1 otherwise.
     '''
 
     try:
-        db=xapian.WritableDatabase(dbpath, xapian.DB_OPEN)
+        if db is None:
+            db=xapian.WritableDatabase(dbpath, xapian.DB_OPEN)
         db.delete_document(qid)
         return 0
     except:
@@ -119,26 +129,10 @@ def indexFile(dbpath, abspath, relpath, meta_dict, db=None):
     term_generator.set_stemmer(xapian.Stem('en'))
     term_generator.set_document(doc)
 
-    #with open(os.devnull, 'w') as devnull:
-    #discard stderr
-    #proc=subprocess.Popen(['pdftotext', abspath, '-'],
-    proc=subprocess.Popen("pdftotext '%s' -" %abspath,
-            bufsize=0,
-            shell=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-    # NOTE: don't use proc.communicate(), which is slow af. Writing and
-    # reading from a tmp file is no better
-
-    lines=[]
-    while True:
-        line=proc.stdout.readline()
-        if not line:
-            break
-        if len(line)>0:
-            line=line.decode('utf-8')
-            term_generator.index_text(line)
-            lines.append(line)
+    pdf=extractPDFText(abspath)
+    if pdf is None:
+        return 1
+    term_generator.index_text(pdf)
 
     #--------------------Add fields--------------------
     fields={}
@@ -159,7 +153,6 @@ def indexFile(dbpath, abspath, relpath, meta_dict, db=None):
     # save data for later use
     fields['qid']=idterm
     fields['rel_path']=relpath
-    pdf='\n'.join(lines)
     fields['pdf']=pdf
 
     doc.set_data(json.dumps(fields))
@@ -168,31 +161,36 @@ def indexFile(dbpath, abspath, relpath, meta_dict, db=None):
     return 0
 
 
-def getByDocid(dbpath, docid):
+def getByDocid(dbpath, docid, db=None):
     '''Get all xapian unique doc ids related to a given docid
 
     Args:
         dbpath (str): path to xapian database folder.
         docid (int): doc id.
+    Kwargs:
+        db (xapian database or None): an opened xapian database, to look up
+                                      several docs with one handle.
 
     Returns:
         docs (list): list of unique doc ids in str.
     '''
 
-    try:
-        db=xapian.Database(dbpath)
-    except:
-        raise Exception("Failed to connect to xapian database.")
+    if db is None:
+        try:
+            db=xapian.Database(dbpath)
+        except:
+            raise Exception("Failed to connect to xapian database.")
 
     #---------------Create query parser---------------
-    query=xapian.Query('XID%s' %docid)
+    term='XID%s' %docid
+    query=xapian.Query(term)
 
     #------------------Create Enquire------------------
     enquire=xapian.Enquire(db)
     enquire.set_query(query)
 
-    doc_count=db.get_doccount()
-    mset=enquire.get_mset(0, doc_count)
+    # only docs with the boolean term match, one for each file of the doc
+    mset=enquire.get_mset(0, db.get_termfreq(term))
     docs=[]
 
     for mm in mset:
@@ -214,14 +212,17 @@ def delByDocid(dbpath, docid):
         rec (int): 0 if successful, 1 otherwise.
     '''
 
-    qids=getByDocid(dbpath, docid)
+    db=xapian.WritableDatabase(dbpath, xapian.DB_OPEN)
+    qids=getByDocid(dbpath, docid, db=db)
     for idii in qids:
-        delXapianDoc(dbpath, idii)
+        delXapianDoc(dbpath, idii, db=db)
+    db.commit()
+    db.close()
 
     return 0
 
 
-def search(dbpath, querystring, fields, docids=None):
+def search(dbpath, querystring, fields, docids=None, db=None):
     '''Full text query within some docs
 
     Args:
@@ -232,6 +233,8 @@ def search(dbpath, querystring, fields, docids=None):
     Kwargs:
         docids (list or None): list of doc ids (note not unique xapian doc ids)
                                to filter the results. If None, no filtering.
+        db (xapian database or None): an opened xapian database, to search
+                                      several times with one handle.
 
     Returns:
         matches (dict): search results in the format of:
@@ -247,10 +250,11 @@ def search(dbpath, querystring, fields, docids=None):
     NOTE that this works on database indexed using indexFile().
     '''
 
-    try:
-        db=xapian.Database(dbpath)
-    except:
-        raise Exception("Failed to connect to xapian database.")
+    if db is None:
+        try:
+            db=xapian.Database(dbpath)
+        except:
+            raise Exception("Failed to connect to xapian database.")
 
     #---------------Create query parser---------------
     query_parser=xapian.QueryParser()
@@ -323,152 +327,169 @@ def search(dbpath, querystring, fields, docids=None):
     return matches
 
 
-class Worker(multiprocessing.Process):
-    def __init__(self, id, func, jobq, outq):
-        super(Worker,self).__init__()
-        self.id=id
-        self.func=func
-        self.jobq=jobq
-        self.outq=outq
+def extractPDFText(abspath):
+    '''Call pdftotext to convert a pdf file to plain texts
 
-    def run(self):
-        while True:
-            args=self.jobq.get()
-            self.jobq.task_done()
-            if args is None:
-                self.outq.put(None)
-                break
-            res=self.func(*args)
-            self.outq.put(res)
+    Args:
+        abspath (str): abs path to pdf file.
 
-        return
+    Returns:
+        text (str or None): extracted texts, None if failed.
+    '''
+
+    try:
+        proc=subprocess.run(['pdftotext', '-enc', 'UTF-8', abspath, '-'],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except:
+        LOGGER.exception('Failed to call pdftotext on %s' %abspath)
+        return None
+
+    if proc.returncode!=0:
+        LOGGER.debug('pdftotext returned %s on %s' %(proc.returncode, abspath))
+        return None
+
+    return proc.stdout.decode('utf-8', 'replace')
 
 
-def convertPDF(abspath, relpath, meta_dict):
-    '''Call pdftotext to convert a pdf file
+def createFileDoc(relpath, text, term_generator):
+    '''Create a xapian doc for an attachment file
 
     Args:
-        abspath (str): abs path to file to index.
-        relpath (str): relative (to lib_folder) path of file to index.
-                       The relpath will be used as a part of the unique id of
-                       a xapian doc.
-        meta_dict (DocMeta): meta data dict for the doc.
+        relpath (str): relative (to lib_folder) path of file.
+        text (str): plain texts of file.
+        term_generator (xapian.TermGenerator): term generator to index texts.
 
     Returns:
-        rec (int): 0 if indexed successfully, 1 otherwise.
+        doc (xapian.Document): xapian doc.
+        uterm (str): unique term of doc.
+
+    The doc has the same url term and data layout as those created by
+    omindex, so docs created by either are interchangeable. The texts are
+    not saved in the doc, snippets are made from the text cache instead,
+    see getFileText().
     '''
 
-    if not os.path.exists(abspath):
-        return 1
+    url='/%s' %quote(relpath)
+    uterm='U%s' %url
 
-    #with open(os.devnull, 'w') as devnull:
-    #discard stderr
-    #proc=subprocess.Popen(['pdftotext', abspath, '-'],
-    proc=subprocess.Popen("pdftotext '%s' -" %abspath,
-            bufsize=0,
-            shell=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    doc=xapian.Document()
+    term_generator.set_document(doc)
+    term_generator.index_text(text)
+    doc.add_boolean_term(uterm)
+    doc.add_boolean_term('Tapplication/pdf')
 
-    lines=[]
-    while True:
-        line=proc.stdout.readline()
-        if not line:
-            break
-        if len(line)>0:
-            line=line.decode('utf-8')
-            lines.append(line)
+    sample=' '.join(text[:300].split())
+    doc.set_data('url=%s\nsample=%s\ntype=application/pdf' %(url, sample))
 
-    return relpath, meta_dict, lines
+    return doc, uterm
 
 
-def writeToXapian(dbpath, jobq):
-    '''Update to xapian database
+def indexPDFs(dbpath, lib_folder, relpaths, hashes=None, n_workers=None,
+        batch_size=50, cancel_event=None, progress_callback=None):
+    '''Index pdf files using parallel pdftotext calls and a single writer
 
     Args:
-        dbpath (str): path to xapian database folder.
-        jobq (multiprocessing.Queue): queue sending in jobs.
-    Returns:
-        rec (int): 0 if indexed successfully, 1 otherwise.
+        dbpath (str): path to the xapian database.
+        lib_folder (str): path to the MTT library folder.
+        relpaths (list): paths of pdf files to index, relative to <lib_folder>.
+    Kwargs:
+        hashes (dict or None): {relpath: content_hash} of files, to look up
+                               the text cache. Computed if not given.
+        n_workers (int or None): number of concurrent pdftotext calls. If None,
+                                 use the number of cores.
+        batch_size (int): commit to xapian every <batch_size> files.
+        cancel_event (threading.Event or None): if set, stop after files
+                                                in progress are done.
+        progress_callback (callable or None): if not None, called as
+                                        progress_callback(n_done, n_total).
 
-    convertPDF() and writeToXapian() are my attempts to speed up the indexing
-    process. Using indexFile() is too slow. Using this consumer-provider
-    does gain speed, but i still have to handle formats other than PDFs.
-    Omega is still more appealing in that regard.
+    Returns:
+        done (list): relpaths processed and committed, including those
+                     without extractable texts. If cancelled, files not in
+                     <done> are left untouched and can be resumed in a later
+                     call.
+
+    Text extraction runs in a pool of <n_workers> pdftotext calls, with at
+    most 4*<n_workers> files in flight to bound memory use. Results are
+    consumed by the calling thread, which is the only xapian writer.
+    Texts are read from the text cache if available, see getFileText().
     '''
 
-    db=xapian.WritableDatabase(dbpath, xapian.DB_CREATE_OR_OPEN)
+    if n_workers is None:
+        n_workers=os.cpu_count() or 1
+    if hashes is None:
+        hashes={}
 
-    results=[]
-    while True:
-        args=jobq.get()
-        if args is None:
-            break
+    jobs=[]
+    for relii in set(relpaths):
+        absii=os.path.join(lib_folder, relii)
+        if os.path.exists(absii):
+            jobs.append((relii, absii))
 
-        relpath, meta_dict, lines=args
+    n_total=len(jobs)
+    if n_total==0:
+        return []
 
-        #--------------Create xapian document--------------
-        doc=xapian.Document()
-        term_generator=xapian.TermGenerator()
-        term_generator.set_stemmer(xapian.Stem('en'))
-        term_generator.set_document(doc)
+    db=xapian.WritableDatabase(dbpath, xapian.DB_CREATE_OR_OPEN)
+    term_generator=xapian.TermGenerator()
+    term_generator.set_stemmer(xapian.Stem('en'))
 
-        lines='\n'.join(lines)
-        term_generator.index_text(lines)
+    def extract(job):
+        return job[0], getFileText(lib_folder, job[0], hashes.get(job[0]))
 
-        #--------------------Add fields--------------------
-        fields={}
+    jobs=iter(jobs)
+    done=[]
+    batch=[]
+    # each job mostly waits on its pdftotext process, so threads suffice
+    with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+        running=set()
+        while True:
+            #----------------Fill the job queue----------------
+            while len(running)<4*n_workers and not (cancel_event is not None\
+                    and cancel_event.is_set()):
+                jobii=next(jobs, None)
+                if jobii is None:
+                    break
+                running.add(executor.submit(extract, jobii))
+
+            if len(running)==0:
+                break
 
-        def addBooleanTerm(key):
-            value=meta_dict.get(key)
-            if value is not None and len(str(value))>0:
-                doc.add_boolean_term('%s%s' %(FIELDS[key], str(value)))
-                fields[key]=value
-            return
+            finished, running=concurrent.futures.wait(running,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
 
-        # add doc id
-        addBooleanTerm('id')
+            #-------------------Write to xapian-------------------
+            for fii in finished:
+                relii, textii=fii.result()
+                if textii is None or len(textii.strip())==0:
+                    db.delete_document('U/%s' %quote(relii))
+                else:
+                    docii, utermii=createFileDoc(relii, textii, term_generator)
+                    db.replace_document(utermii, docii)
+                batch.append(relii)
 
-        # add unique id
-        idterm='Q%s-%s' %(meta_dict['id'],relpath)
-        doc.add_boolean_term(idterm)
-        # save data for later use
-        fields['qid']=idterm
-        fields['rel_path']=relpath
-        pdf=lines
-        fields['pdf']=pdf
+            if len(batch)>=batch_size:
+                db.commit()
+                done.extend(batch)
+                batch=[]
+                if progress_callback is not None:
+                    progress_callback(len(done), n_total)
 
-        doc.set_data(json.dumps(fields))
-        db.replace_document(idterm, doc)
+    db.commit()
+    db.close()
+    done.extend(batch)
+    if progress_callback is not None:
+        progress_callback(len(done), n_total)
 
-        results.append(0)
+    LOGGER.info('Indexed %d of %d pdf files' %(len(done), n_total))
 
-    return results
+    return done
 
 
 #######################################################################
 #                           Use xapian-omega                           #
 #######################################################################
 
-class OmindexWorker(multiprocessing.Process):
-    def __init__(self, dbpath, lib_folder):
-        super(Worker,self).__init__()
-        self.func=indexFolder
-        self.dbpath=dbpath
-        self.lib_folder=lib_folder
-
-    def run(self):
-        while True:
-            args=self.jobq.get()
-            self.jobq.task_done()
-            if args is None:
-                self.outq.put(None)
-                break
-            res=self.func(*args)
-            self.outq.put(res)
-
-        return
-
-
 def indexFolder(dbpath, lib_folder):
     '''Use omindex to index a folder
 
@@ -498,80 +519,792 @@ def indexFolder(dbpath, lib_folder):
         return 1
 
 
-def search2(xapianpath, sqlitepath, querystring, docids=None):
-    '''Full text query within some docs
+def indexFiles(dbpath, lib_folder, relpaths):
+    '''Use omindex to index some files in a library folder
 
     Args:
-        xapianpath (str): path to xapian database folder.
-        sqlitepath (str): path to sqlite database folder.
-        querystring (str): query string.
+        dbpath (str): path to the xapian database.
+        lib_folder (str): path to the MTT library folder.
+        relpaths (list): paths of files to index, relative to <lib_folder>,
+                         e.g. '_collections/xxx.pdf'.
+
+    Returns:
+        rec (int): 0 if successful, 1 otherwise.
+
+    Links to the given files are put in a temporary folder with the same
+    layout as <lib_folder>, and omindex only walks that folder. The urls of
+    the indexed docs are therefore the same as those from indexFolder().
+    Docs of files not in <relpaths> are preserved, and files not modified
+    since last indexed are skipped by omindex.
+    '''
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        n_files=0
+        for relii in set(relpaths):
+            absii=os.path.join(lib_folder, relii)
+            if not os.path.exists(absii):
+                continue
+            linkii=os.path.join(tmp_folder, relii)
+            os.makedirs(os.path.dirname(linkii), exist_ok=True)
+            os.symlink(os.path.abspath(absii), linkii)
+            n_files+=1
+
+        if n_files==0:
+            return 0
+
+        try:
+            proc=subprocess.Popen(['omindex', '-d', 'replace', # replace duplicate
+                '-p',         # preserve docs not seen in this run
+                '-e', 'skip', # documents without extracted text
+                '-f',         # follow links
+                '--db', dbpath,
+                '--url', '/', tmp_folder, '_collections'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            rec=proc.communicate()
+            if len(rec[0])>0:
+                LOGGER.debug('stdout = %s' %rec[0])
+            if len(rec[1])>0:
+                LOGGER.debug('stderr = %s' %rec[1])
+            return 0
+        except:
+            LOGGER.exception('Failed to call omindex')
+            return 1
+
+
+def checkManifest(sqlitedb, lib_folder, relpaths):
+    '''Get files that need indexing, using the IndexManifest table
+
+    Args:
+        sqlitedb (sqlite connection): connection to the library sqlite.
+        lib_folder (str): path to the MTT library folder.
+        relpaths (list): paths of files to check, relative to <lib_folder>.
+
+    Returns:
+        results (list): list of (relpath, size, mtime, hash) tuples, for
+                        files that are new or modified since last indexed.
+
+    A file whose size and mtime match its manifest entry is skipped without
+    reading it. If only the mtime has changed but the content hash has
+    not, e.g. after a copy, the new mtime is recorded and the file is
+    skipped as well. Files not found on disk are ignored. Files that
+    failed to index are not retried until they are modified.
+    '''
+
+    query='''SELECT size, mtime, hash, state FROM IndexManifest
+    WHERE relpath=?'''
+
+    results=[]
+    for relii in set(relpaths):
+        absii=os.path.join(lib_folder, relii)
+        try:
+            stat=os.stat(absii)
+        except OSError:
+            continue
+
+        row=sqlitedb.execute(query, (relii,)).fetchone()
+        if row is not None and row[0]==stat.st_size and row[1]==stat.st_mtime:
+            continue
+
+        hashii=fileHash(absii)
+        if row is not None and row[2]==hashii:
+            sqlitedb.execute('''UPDATE IndexManifest SET size=?, mtime=?
+            WHERE relpath=?''', (stat.st_size, stat.st_mtime, relii))
+            continue
+
+        results.append((relii, stat.st_size, stat.st_mtime, hashii))
+
+    sqlitedb.commit()
+    LOGGER.debug('%d of %d files need indexing' %(len(results), len(relpaths)))
+
+    return results
+
+
+def updateManifest(sqlitedb, dbpath, entries):
+    '''Record indexed files in the IndexManifest table
+
+    Args:
+        sqlitedb (sqlite connection): connection to the library sqlite.
+        dbpath (str): path to the xapian database.
+        entries (list): list of (relpath, size, mtime, hash) tuples, as
+                        returned by checkManifest().
+
+    The xapian doc id of each file is looked up by its url term and saved,
+    so later lookups don't need a query. Files that omindex didn't add,
+    e.g. those without extractable texts, get the state 'failed'.
+    '''
+
+    db=xapian.Database(dbpath)
+    rows=[]
+    for relii, sizeii, mtimeii, hashii in entries:
+        term='U/%s' %quote(relii)
+        xapian_id=None
+        for pii in db.postlist(term):
+            xapian_id=pii.docid
+            break
+        state='failed' if xapian_id is None else 'indexed'
+        rows.append((relii, sizeii, mtimeii, hashii, xapian_id, state))
+
+    sqlitedb.executemany('''INSERT OR REPLACE INTO IndexManifest
+    (relpath, size, mtime, hash, xapian_docid, state)
+    VALUES (?,?,?,?,?,?)''', rows)
+    sqlitedb.commit()
+
+    return
+
+
+def pruneManifest(sqlitedb, dbpath, lib_folder, check_disk=False):
+    '''Remove index entries of deleted files
+
+    Args:
+        sqlitedb (sqlite connection): connection to the library sqlite.
+        dbpath (str): path to the xapian database.
+        lib_folder (str): path to the MTT library folder.
     Kwargs:
-        docids (list or None): list of doc ids (note not unique xapian doc ids)
-                               to filter the results. If None, no filtering.
+        check_disk (bool): if True, also remove entries whose file no longer
+                           exists on disk. Otherwise only check sqlite.
 
     Returns:
-        matches (dict): search results in the format of:
-            {docid1: {'title': title_text,
-                      'authors': authors_text,
-                      'pdf': {relpath1: snippet1,
-                              relpath2: snippet2, ...
-                              }
-                        ...}
+        n (int): number of entries removed.
 
-            ...}
-    NOTE that this works on database indexed using indexFolder().
+    Entries whose file is no longer attached to any doc are deleted from
+    the manifest and from xapian.
+    '''
+
+    rows=sqlitedb.execute('''SELECT IndexManifest.relpath,
+    IndexManifest.xapian_docid, DocumentFiles.did
+    FROM IndexManifest
+    LEFT JOIN DocumentFiles ON DocumentFiles.relpath=IndexManifest.relpath
+    ''').fetchall()
+
+    deleted={}
+    for relii, xapian_id, did in rows:
+        if did is None or (check_disk and\
+                not os.path.exists(os.path.join(lib_folder, relii))):
+            deleted[relii]=xapian_id
+
+    if len(deleted)==0:
+        return 0
+
+    db=xapian.WritableDatabase(dbpath, xapian.DB_OPEN)
+    for relii, xapian_id in deleted.items():
+        LOGGER.debug('Removing deleted file from index: %s' %relii)
+        try:
+            if xapian_id is not None:
+                db.delete_document(xapian_id)
+            else:
+                db.delete_document('U/%s' %quote(relii))
+        except xapian.DocNotFoundError:
+            pass
+    db.commit()
+    db.close()
+
+    sqlitedb.executemany('DELETE FROM IndexManifest WHERE relpath=?',
+            [(ii,) for ii in deleted])
+    sqlitedb.commit()
+
+    return len(deleted)
+
+
+def getTextCachePath(lib_folder, file_hash):
+    '''Get path of the cached texts of a file
+
+    Args:
+        lib_folder (str): path to the MTT library folder.
+        file_hash (str): content hash of file, see fileHash().
+
+    Returns:
+        path (str): path to gzipped text file in <lib_folder>/_cache/text.
     '''
 
+    return os.path.join(lib_folder, '_cache', 'text', '%s.txt.gz' %file_hash)
+
+
+def readTextCache(lib_folder, file_hash):
+    '''Read the cached texts of a file
+
+    Args:
+        lib_folder (str): path to the MTT library folder.
+        file_hash (str or None): content hash of file, see fileHash().
+
+    Returns:
+        text (str or None): cached texts, None if not cached.
+    '''
+
+    if file_hash is None:
+        return None
+
     try:
-        db=xapian.Database(xapianpath)
-    except:
-        raise Exception("Failed to connect to xapian database.")
+        with gzip.open(getTextCachePath(lib_folder, file_hash), 'rt',
+                encoding='utf-8') as fin:
+            return fin.read()
+    except (OSError, EOFError):
+        return None
+
 
+def writeTextCache(lib_folder, file_hash, text):
+    '''Save the extracted texts of a file to cache
+
+    Args:
+        lib_folder (str): path to the MTT library folder.
+        file_hash (str): content hash of file, see fileHash().
+        text (str): extracted texts.
+    '''
+
+    path=getTextCachePath(lib_folder, file_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # write to a tmp file first, in case a reader comes in between
+    tmp_path='%s.%d.tmp' %(path, threading.get_ident())
     try:
-        sqlitedb=sqlite3.connect(sqlitepath, check_same_thread=False)
-    except:
-        raise Exception("Failed to connect to sqlite database.")
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as fout:
+            fout.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        LOGGER.exception('Failed to write text cache %s' %path)
 
-    #--------------Get path-docid mapping--------------
-    query='''SELECT relpath, did FROM DocumentFiles'''
-    ret=sqlitedb.execute(query)
-    idmap=dict(ret.fetchall())
+    return
 
-    #---------------Create query parser---------------
-    query_parser=xapian.QueryParser()
-    query_parser.set_stemmer(xapian.Stem('en'))
-    query_parser.set_stemming_strategy(query_parser.STEM_SOME)
-    query=query_parser.parse_query(querystring)
 
-    #----------------Add docid filter----------------
-    if docids is not None:
-        # get relpath(s) from docid
-        filter_paths=[quote('/%s' %kk) for kk,vv in idmap.items() if vv in docids]
-        docid_queries=[xapian.Query('U%s' %str(ii)) for ii in filter_paths]
-        docid_query=xapian.Query(xapian.Query.OP_OR, docid_queries)
-        query=xapian.Query(xapian.Query.OP_FILTER, query, docid_query)
+def getFileText(lib_folder, relpath, file_hash=None):
+    '''Get the plain texts of a pdf file, from cache if possible
 
-    #------------------Create Enquire------------------
-    enquire=xapian.Enquire(db)
-    enquire.set_query(query)
+    Args:
+        lib_folder (str): path to the MTT library folder.
+        relpath (str): path of file, relative to <lib_folder>.
+    Kwargs:
+        file_hash (str or None): content hash of file. If None, compute it.
 
-    #-------------------Get matches-------------------
-    offset=0
-    doc_count=db.get_doccount()
-    mset=enquire.get_mset(offset, doc_count)
-    matches={}
+    Returns:
+        text (str or None): texts of file, None if failed to extract.
+
+    pdftotext is only called if the texts of the same file content are not
+    cached yet, and the results are cached for later calls.
+    '''
+
+    abspath=os.path.join(lib_folder, relpath)
+    if file_hash is None:
+        try:
+            file_hash=fileHash(abspath)
+        except OSError:
+            return None
+
+    text=readTextCache(lib_folder, file_hash)
+    if text is not None:
+        return text
+
+    text=extractPDFText(abspath)
+    if text is not None:
+        writeTextCache(lib_folder, file_hash, text)
+
+    return text
+
+
+def pruneTextCache(sqlitedb, lib_folder):
+    '''Remove cached texts not used by any file in the manifest
+
+    Args:
+        sqlitedb (sqlite connection): connection to the library sqlite.
+        lib_folder (str): path to the MTT library folder.
+
+    Returns:
+        n (int): number of cache files removed.
+    '''
+
+    cache_folder=os.path.join(lib_folder, '_cache', 'text')
+    if not os.path.exists(cache_folder):
+        return 0
+
+    hashes=set([ii[0] for ii in sqlitedb.execute(
+        'SELECT hash FROM IndexManifest')])
+
+    n=0
+    for fii in os.listdir(cache_folder):
+        if fii.split('.')[0] not in hashes:
+            try:
+                os.remove(os.path.join(cache_folder, fii))
+                n+=1
+            except OSError:
+                pass
+
+    LOGGER.debug('Removed %d text cache files' %n)
+
+    return n
+
+
+class IndexService(object):
+
+    def __init__(self, dbpath, lib_folder, sqlitepath, delay=3,
+            status_callback=None, changed_callback=None):
+        '''Background service indexing attachment files of a library
+
+        Args:
+            dbpath (str): path to the xapian database.
+            lib_folder (str): path to the MTT library folder.
+            sqlitepath (str): path to the sqlite database of the library,
+                              storing the IndexManifest table.
+
+        Kwargs:
+            delay (float): seconds to wait for more changes before indexing.
+                A burst of changes is indexed in a single omindex run.
+            status_callback (callable or None): if not None, called as
+                status_callback(status, queue_size) when the status or queue
+                changes. status is 'idle' or 'indexing', queue_size the
+                number of files waiting to be indexed.
+            changed_callback (callable or None): if not None, called as
+                changed_callback(relpaths) after the index is changed, with
+                relpaths the list of files indexed, or None if files have
+                also been removed. See SearchSession.markChanged().
+
+        One service is started per opened library, and stopped when the
+        library is closed. See _MainWindow._openDatabase().
+        Only files that are new or modified according to the IndexManifest
+        table are indexed, see checkManifest(). Pdf files are indexed by
+        indexPDFs(), other files by omindex.
+        '''
+
+        self.dbpath=dbpath
+        self.lib_folder=lib_folder
+        self.sqlitepath=sqlitepath
+        self.delay=delay
+        self.status_callback=status_callback
+        self.changed_callback=changed_callback
+        self.status='idle'
+
+        self._pending=set()
+        self._full=False
+        self._stopping=False
+        self._cancel=threading.Event()
+        self._lock=threading.Lock()
+        self._wake=threading.Event()
+        self._thread=threading.Thread(target=self._run, daemon=True)
+
+
+    def start(self):
+
+        self._thread.start()
+        LOGGER.info('Indexing service started for %s' %self.lib_folder)
+
+        return
+
+
+    def addFiles(self, relpaths):
+        '''Queue files for indexing
+
+        Args:
+            relpaths (list): paths of files to index, relative to lib_folder.
+        '''
+
+        with self._lock:
+            self._pending.update(relpaths)
+        self._wake.set()
+        self._notify()
+
+        return
+
+
+    def addFolder(self):
+        '''Queue a full indexing of the _collections folder'''
+
+        with self._lock:
+            self._full=True
+        self._wake.set()
+        self._notify()
+
+        return
+
+
+    def queueSize(self):
+
+        with self._lock:
+            return len(self._pending)
+
+
+    def stop(self, wait=True, cancel=False):
+        '''Stop the service, after indexing the files still in queue
+
+        Kwargs:
+            wait (bool): if True, block until the service has stopped.
+            cancel (bool): if True, drop the queue and stop the current run
+                           after the files in progress. Files not indexed
+                           are not in the manifest, so a later full run
+                           resumes them.
+        '''
+
+        self._stopping=True
+        if cancel:
+            with self._lock:
+                self._pending=set()
+                self._full=False
+            self._cancel.set()
+        self._wake.set()
+        if wait and self._thread.is_alive():
+            self._thread.join()
+        LOGGER.info('Indexing service stopped for %s' %self.lib_folder)
+
+        return
+
+
+    def _notify(self):
+
+        if self.status_callback is not None:
+            self.status_callback(self.status, self.queueSize())
+
+        return
+
+
+    def _index(self, sqlitedb, relpaths, full):
+        '''Index new or modified files and remove deleted ones
+
+        Args:
+            sqlitedb (sqlite connection): connection to the library sqlite.
+            relpaths (list): paths of files to index, relative to lib_folder.
+            full (bool): if True, check all files in the _collections folder.
+
+        Returns:
+            changed (list or None): relpaths indexed, or None if entries have
+                                    also been removed.
+        '''
+
+        if full:
+            LOGGER.debug('Indexing folder %s' %self.lib_folder)
+            folder=os.path.join(self.lib_folder, '_collections')
+            relpaths=[os.path.join('_collections', ii.name) for ii in\
+                    os.scandir(folder) if ii.is_file()]
+
+        changed=[]
+        entries=checkManifest(sqlitedb, self.lib_folder, relpaths)
+        pdfs=[ii for ii in entries if ii[0].lower().endswith('.pdf')]
+        others=[ii for ii in entries if not ii[0].lower().endswith('.pdf')]
+
+        if len(pdfs)>0:
+            LOGGER.debug('Indexing %d pdf files' %len(pdfs))
+            hashes=dict((ii[0], ii[3]) for ii in pdfs)
+            done=indexPDFs(self.dbpath, self.lib_folder,
+                    [ii[0] for ii in pdfs], hashes, cancel_event=self._cancel)
+            done=set(done)
+            updateManifest(sqlitedb, self.dbpath,
+                    [ii for ii in pdfs if ii[0] in done])
+            changed.extend(done)
+
+        if len(others)>0 and not self._cancel.is_set():
+            LOGGER.debug('Indexing %d files' %len(others))
+            indexFiles(self.dbpath, self.lib_folder, [ii[0] for ii in others])
+            updateManifest(sqlitedb, self.dbpath, others)
+            changed.extend([ii[0] for ii in others])
+
+        n_pruned=pruneManifest(sqlitedb, self.dbpath, self.lib_folder,
+                check_disk=full)
+        if full:
+            pruneTextCache(sqlitedb, self.lib_folder)
+
+        if n_pruned>0:
+            return None
+        return changed
+
+
+    def _run(self):
+
+        # sqlite connections can't be shared across threads
+        sqlitedb=sqlite3.connect(self.sqlitepath)
+
+        while True:
+            self._wake.wait()
+
+            # coalesce: keep waiting as long as new changes keep coming
+            while not self._stopping:
+                self._wake.clear()
+                if not self._wake.wait(self.delay):
+                    break
+            self._wake.clear()
+
+            with self._lock:
+                relpaths=list(self._pending)
+                full=self._full
+                self._pending=set()
+                self._full=False
+
+            if full or len(relpaths)>0:
+                self.status='indexing'
+                self._notify()
+                try:
+                    changed=self._index(sqlitedb, relpaths, full)
+                    if self.changed_callback is not None and\
+                            (changed is None or len(changed)>0):
+                        self.changed_callback(changed)
+                except:
+                    LOGGER.exception('Failed to index files.')
+                self.status='idle'
+                self._notify()
+
+            # on stopping, finish files queued during the last run first
+            if self._stopping:
+                with self._lock:
+                    if len(self._pending)==0 and not self._full:
+                        break
+
+        sqlitedb.close()
+
+        return
+
+
+class SearchSession(object):
+
+    def __init__(self, dbpath, sqlitepath, lib_folder=None):
+        '''Full text search session of a library
+
+        Args:
+            dbpath (str): path to xapian database folder.
+            sqlitepath (str): path to sqlite database file.
+        Kwargs:
+            lib_folder (str or None): path to the MTT library folder, to read
+                                      cached texts for snippets. If None, use
+                                      the parent folder of <dbpath>.
+
+        A session is created when a library is opened, see
+        _MainWindow._openDatabase(). It keeps a xapian reader and a sqlite
+        connection open, and caches the relpath->docid map of DocumentFiles.
+        The reader is only reopened after markChanged(), which is called
+        by the indexing service, or after updateDocs() finds changed files.
+        '''
+
+        if lib_folder is None:
+            lib_folder=os.path.dirname(os.path.normpath(dbpath))
+
+        self.dbpath=dbpath
+        self.sqlitepath=sqlitepath
+        self.lib_folder=lib_folder
+
+        self._db=None
+        self._sqlitedb=None
+        self._changed=False
+        self._idmap=None  # relpath: docid
+        self._files={}    # docid: list of relpaths
+        self._hashmap={}  # relpath: content hash
+        # searches run in worker threads, and markChanged() in the indexing
+        # thread
+        self._lock=threading.RLock()
+
+
+    def getDatabase(self):
+        '''Get the xapian reader, reopened if index has changed'''
+
+        with self._lock:
+            if self._db is None:
+                try:
+                    self._db=xapian.Database(self.dbpath)
+                except:
+                    raise Exception("Failed to connect to xapian database.")
+            elif self._changed:
+                self._db.reopen()
+            self._changed=False
+
+            return self._db
+
+
+    def getSqlite(self):
+
+        with self._lock:
+            if self._sqlitedb is None:
+                try:
+                    self._sqlitedb=sqlite3.connect(self.sqlitepath,
+                            check_same_thread=False)
+                except:
+                    raise Exception("Failed to connect to sqlite database.")
+
+            return self._sqlitedb
+
+
+    def _loadMaps(self):
+        '''Read the relpath->docid map, if not yet'''
+
+        if self._idmap is not None:
+            return
+
+        self._idmap={}
+        self._files={}
+        query='''SELECT relpath, did FROM DocumentFiles'''
+        for relii, didii in self.getSqlite().execute(query):
+            self._idmap[relii]=didii
+            self._files.setdefault(didii, []).append(relii)
+
+        self._loadHashes()
+
+        return
+
+
+    def _loadHashes(self, relpaths=None):
+        '''Read content hashes from IndexManifest
+
+        Kwargs:
+            relpaths (list or None): files to update. If None, read all.
+        '''
+
+        sqlitedb=self.getSqlite()
+        try:
+            if relpaths is None:
+                ret=sqlitedb.execute('SELECT relpath, hash FROM IndexManifest')
+                self._hashmap=dict(ret.fetchall())
+            else:
+                query='SELECT hash FROM IndexManifest WHERE relpath=?'
+                for relii in relpaths:
+                    row=sqlitedb.execute(query, (relii,)).fetchone()
+                    if row is None:
+                        self._hashmap.pop(relii, None)
+                    else:
+                        self._hashmap[relii]=row[0]
+        except sqlite3.OperationalError:
+            # no manifest table
+            pass
+
+        return
+
+
+    def markChanged(self, relpaths=None):
+        '''Mark the xapian index as changed
+
+        Kwargs:
+            relpaths (list or None): files re-indexed. If None, all files
+                                     may have changed.
+        '''
+
+        with self._lock:
+            self._changed=True
+            if self._idmap is not None:
+                self._loadHashes(relpaths)
+
+        return
+
+
+    def updateDocs(self, docids):
+        '''Update the relpath->docid map for some docs
+
+        Args:
+            docids (list): ids of docs that have been saved or deleted.
+        '''
+
+        with self._lock:
+            if self._idmap is None:
+                return
+
+            query='''SELECT relpath FROM DocumentFiles WHERE did=?'''
+            for idii in docids:
+                old=self._files.pop(idii, [])
+                for relii in old:
+                    if self._idmap.get(relii)==idii:
+                        del self._idmap[relii]
+
+                new=[ii[0] for ii in self.getSqlite().execute(query, (idii,))]
+                for relii in new:
+                    self._idmap[relii]=idii
+                if len(new)>0:
+                    self._files[idii]=new
+
+                # files removed from a doc are also removed from xapian
+                if set(old)!=set(new):
+                    self._changed=True
+                    self._loadHashes(new)
+
+        return
+
+
+    def close(self):
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db=None
+            if self._sqlitedb is not None:
+                self._sqlitedb.close()
+                self._sqlitedb=None
+            self._idmap=None
+
+        return
+
+
+    def _createEnquire(self, querystring, docids=None, relpaths=None):
+        '''Create a xapian Enquire for a query
+
+        Args:
+            querystring (str): query string.
+        Kwargs:
+            docids (list or None): list of doc ids to filter the results.
+                                   If None, no filtering.
+            relpaths (list or None): list of file relpaths to filter the
+                                     results. If None, no filtering.
+
+        Returns:
+            enquire (xapian.Enquire): enquire with query set.
+        '''
+
+        db=self.getDatabase()
+        self._loadMaps()
+
+        #---------------Create query parser---------------
+        query_parser=xapian.QueryParser()
+        query_parser.set_stemmer(xapian.Stem('en'))
+        query_parser.set_stemming_strategy(query_parser.STEM_SOME)
+        query=query_parser.parse_query(querystring)
+
+        #----------------Add docid filter----------------
+        if docids is not None:
+            # get relpath(s) from docid
+            relpaths=(relpaths or [])+[kk for idii in set(docids)\
+                    for kk in self._files.get(idii, [])]
+
+        if relpaths is not None:
+            filter_paths=[quote('/%s' %kk) for kk in relpaths]
+            docid_queries=[xapian.Query('U%s' %str(ii)) for ii in filter_paths]
+            docid_query=xapian.Query(xapian.Query.OP_OR, docid_queries)
+            query=xapian.Query(xapian.Query.OP_FILTER, query, docid_query)
+
+        #------------------Create Enquire------------------
+        enquire=xapian.Enquire(db)
+        enquire.set_query(query)
+
+        return enquire
+
+
+    def _parseMatch(self, mm):
+        '''Get relpath and docid of a match
+
+        Args:
+            mm (xapian.MSetItem): a match.
+
+        Returns:
+            url (str): relpath of matched file.
+            docid (int or None): id of the doc the file belongs to. None if
+                                 file has been removed from doc.
+            dlist (list): lines of the xapian doc data.
+        '''
 
-    for mm in mset:
         dd=mm.document.get_data().decode('utf-8')
         dlist=dd.split('\n')
         url=dlist[0]
         url=converturl2abspath(url)[5:]
-        docid=idmap[url]
 
-        #-------------------Get snippet-------------------
-        # NOTE this only works if the omindex source has been modified to save
-        # the 'dump' as document data. To make the change, one needs to add
-        # these lines to the index_file.cc:
+        return url, self._idmap.get(url), dlist
+
+
+    def _matchSnippets(self, mset, url, dlist):
+        '''Get snippets of a matched file
+
+        Args:
+            mset (xapian.MSet): search results containing the match.
+            url (str): relpath of matched file.
+            dlist (list): lines of the xapian doc data.
+
+        Returns:
+            snips (list or str): list of snippets, or file name if no texts
+                                 found for file.
+        '''
+
+        # texts are cached when indexing by indexPDFs()
+        text=readTextCache(self.lib_folder, self._hashmap.get(url))
+
+        # otherwise, look for the 'dump' field.
+        # NOTE this only works if the omindex source has been modified
+        # to save the 'dump' as document data. To make the change, one
+        # needs to add these lines to the index_file.cc:
         #
         #        if (dump.empty()) {
         #            record = "dump=";
@@ -586,91 +1319,298 @@ def search2(xapianpath, sqlitepath, querystring, docids=None):
         #
         # then re-compile xapian-omega.
         # . This is tricker than allowing the
-        # user to use package managers to install xapian. Plus, their snippet()
-        # function seems to only give 1 snippet at most. Probably not worth
-        # doing snippet in that case.
-
-        # find dump field
-        ii=1
-        while True:
-            if ii>=len(dlist):
-                break
-            lii=dlist[ii]
-            if lii[:5]=='dump=':
-                break
-            else:
-                ii+=1
+        # user to use package managers to install xapian. Plus, their
+        # snippet() function seems to only give 1 snippet at most.
+        # Probably not worth doing snippet in that case.
+        if text is None:
+            ii=1
+            while True:
+                if ii>=len(dlist):
+                    break
+                lii=dlist[ii]
+                if lii[:5]=='dump=':
+                    text=' '.join(dlist[ii:])[5:]
+                    break
+                else:
+                    ii+=1
 
-        #---------------------Has dump---------------------
-        if ii<len(dlist):
-            dump=' '.join(dlist[ii:])
+        #---------------------Has texts---------------------
+        if text is not None:
             snip_size=400
-            if len(dump)>0:
-                snips=getSnippets(mset, dump[5:], snip_size)
+            if len(text)>0:
+                snips=getSnippets(mset, text, snip_size)
             else:
                 snips=[]
-            dictmm={'pdf': {url: snips}}
-        #---------------------No dump---------------------
+        #---------------------No texts---------------------
         else:
-            dictmm={'pdf': {url: os.path.split(url)[1]}}
+            snips=os.path.split(url)[1]
 
-        if docid not in matches:
-            matches[docid]=dictmm
+        return snips
+
+
+    def search(self, querystring, docids=None):
+        '''Full text query within some docs
+
+        Args:
+            querystring (str): query string.
+        Kwargs:
+            docids (list or None): list of doc ids (note not unique xapian doc
+                                   ids) to filter the results. If None, no
+                                   filtering.
+
+        Returns:
+            matches (dict): search results, see search2().
+
+        This gets all matches with snippets, see searchPage() for a paged
+        version.
+        '''
+
+        with self._lock:
+            enquire=self._createEnquire(querystring, docids)
+
+            #-------------------Get matches-------------------
+            offset=0
+            doc_count=self.getDatabase().get_doccount()
+            mset=enquire.get_mset(offset, doc_count)
+            matches={}
+
+            for mm in mset:
+                url, docid, dlist=self._parseMatch(mm)
+                if docid is None:
+                    # file removed from doc, not yet pruned from index
+                    continue
+
+                dictmm={'pdf': {url: self._matchSnippets(mset, url, dlist)}}
+
+                if docid not in matches:
+                    matches[docid]=dictmm
+                else:
+                    pdf1=matches[docid].get('pdf',{})
+                    pdf2=dictmm.get('pdf',{})
+                    pdf1.update(pdf2)
+                    matches[docid]['pdf']=pdf1
+
+        return matches
+
+
+    def searchPage(self, querystring, docids=None, offset=0, pagesize=50):
+        '''Get a page of full text matches, without snippets
+
+        Args:
+            querystring (str): query string.
+        Kwargs:
+            docids (list or None): list of doc ids to filter the results.
+                                   If None, no filtering.
+            offset (int): rank of the first match to get.
+            pagesize (int): max number of matched files to get.
+
+        Returns:
+            matches (OrderedDict): matches in the order of rank, in the format
+                of {docid1: {'pdf': {relpath1: None, relpath2: None, ...}},
+                    ...}. Use getFileSnippets() to get snippets of a file.
+            estimate (int): estimated total number of matched files.
+            next_offset (int or None): offset of the next page, None if
+                                       no more.
+        '''
+
+        with self._lock:
+            enquire=self._createEnquire(querystring, docids)
+            mset=enquire.get_mset(offset, pagesize)
+            estimate=mset.get_matches_estimated()
+            matches=OrderedDict()
+
+            for mm in mset:
+                url, docid, dlist=self._parseMatch(mm)
+                if docid is None:
+                    continue
+                matches.setdefault(docid, {'pdf': OrderedDict()})
+                matches[docid]['pdf'][url]=None
+
+        if mset.size()==pagesize:
+            next_offset=offset+pagesize
         else:
-            pdf1=matches[docid].get('pdf',{})
-            pdf2=dictmm.get('pdf',{})
-            pdf1.update(pdf2)
-            matches[docid]['pdf']=pdf1
+            next_offset=None
 
+        return matches, estimate, next_offset
 
-    return matches
 
+    def getFileSnippets(self, querystring, relpath):
+        '''Get snippets of a file matching a query
 
-def getByDocid2(dbpath, sqlitepath, docid):
-    '''Get all xapian unique doc ids related to a given docid
+        Args:
+            querystring (str): query string.
+            relpath (str): relpath of matched file.
+
+        Returns:
+            snips (list or str): list of snippets, or file name if no texts
+                                 found for file.
+        '''
+
+        with self._lock:
+            enquire=self._createEnquire(querystring, relpaths=[relpath])
+            mset=enquire.get_mset(0, 1)
+            for mm in mset:
+                url, docid, dlist=self._parseMatch(mm)
+                return self._matchSnippets(mset, url, dlist)
+
+        return []
+
+
+    def getByDocid(self, docid, relpaths=None):
+        '''Get all xapian unique doc ids related to a given docid
+
+        Args:
+            docid (int): doc id.
+        Kwargs:
+            relpaths (list or None): relpaths of files of the doc. If None,
+                                     read from DocumentFiles, and use the
+                                     manifest if all are in it.
+
+        Returns:
+            docs (list): list of unique doc ids.
+        '''
+
+        with self._lock:
+            if relpaths is not None:
+                return self._getByPaths(relpaths)
+
+            sqlitedb=self.getSqlite()
+
+            #--------------Get relpaths of docid--------------
+            query='''SELECT DocumentFiles.relpath, IndexManifest.xapian_docid,
+            IndexManifest.state
+            FROM DocumentFiles
+            LEFT JOIN IndexManifest
+            ON IndexManifest.relpath=DocumentFiles.relpath
+            WHERE (DocumentFiles.did=?)'''
+            try:
+                ret=sqlitedb.execute(query,(docid,)).fetchall()
+            except sqlite3.OperationalError:
+                # no manifest table
+                query='''SELECT relpath, NULL, NULL FROM DocumentFiles
+                WHERE (DocumentFiles.did=?)'''
+                ret=sqlitedb.execute(query,(docid,)).fetchall()
+
+            # if all files are in the manifest, no need to query xapian
+            if len(ret)>0 and all([uii[2] is not None for uii in ret]):
+                return [uii[1] for uii in ret if uii[1] is not None]
+
+            return self._getByPaths([uii[0] for uii in ret])
+
+
+    def _getByPaths(self, relpaths):
+        '''Get xapian unique doc ids of files
+
+        Args:
+            relpaths (list): relpaths of files.
+
+        Returns:
+            docs (list): list of unique doc ids.
+        '''
+
+        if len(relpaths)==0:
+            return []
+
+        # add / at the begining, and quote
+        filter_paths=['/%s' %quote(ii) for ii in relpaths]
+
+        #------------------Create Enquire------------------
+        db=self.getDatabase()
+        docid_queries=[xapian.Query('U%s' %ii) for ii in filter_paths]
+        query=xapian.Query(xapian.Query.OP_OR, docid_queries)
+        enquire=xapian.Enquire(db)
+        enquire.set_query(query)
+
+        # the U term is unique, at most one doc for each file
+        mset=enquire.get_mset(0, len(filter_paths))
+
+        return [mm.docid for mm in mset]
+
+
+    def delByDocid(self, docid, relpaths=None):
+        '''Delete xapian doc(s) by doc id
+
+        Args:
+            docid (int): doc id.
+        Kwargs:
+            relpaths (list or None): relpaths of files of the doc, see
+                                     getByDocid().
+
+        Returns:
+            rec (int): 0 if successful.
+
+        Entries in the IndexManifest table are left to the caller, e.g.
+        sqlitedb.delDocFromDatabase() deletes them in its own transaction.
+        '''
+
+        with self._lock:
+            qids=self.getByDocid(docid, relpaths)
+            if len(qids)>0:
+                db=xapian.WritableDatabase(self.dbpath, xapian.DB_OPEN)
+                for idii in qids:
+                    delXapianDoc(self.dbpath, idii, db=db)
+                db.commit()
+                db.close()
+                self._changed=True
+
+        return 0
+
+
+def search2(xapianpath, sqlitepath, querystring, docids=None,
+        lib_folder=None):
+    '''Full text query within some docs
 
     Args:
-        dbpath (str): path to xapian database folder.
+        xapianpath (str): path to xapian database folder.
         sqlitepath (str): path to sqlite database folder.
-        docid (int): doc id.
+        querystring (str): query string.
+    Kwargs:
+        docids (list or None): list of doc ids (note not unique xapian doc ids)
+                               to filter the results. If None, no filtering.
+        lib_folder (str or None): path to the MTT library folder, to read
+                                  cached texts for snippets. If None, use
+                                  the parent folder of <xapianpath>.
 
     Returns:
-        docs (list): list of unique doc ids in str.
+        matches (dict): search results in the format of:
+            {docid1: {'title': title_text,
+                      'authors': authors_text,
+                      'pdf': {relpath1: snippet1,
+                              relpath2: snippet2, ...
+                              }
+                        ...}
+
+            ...}
+    NOTE that this works on database indexed using indexFolder() or
+    indexPDFs().
+    For repeated searches use a SearchSession instead, which keeps the
+    databases open.
     '''
 
+    session=SearchSession(xapianpath, sqlitepath, lib_folder)
     try:
-        db=xapian.Database(dbpath)
-    except:
-        raise Exception("Failed to connect to xapian database.")
+        return session.search(querystring, docids)
+    finally:
+        session.close()
 
-    try:
-        sqlitedb=sqlite3.connect(sqlitepath, check_same_thread=False)
-    except:
-        raise Exception("Failed to connect to sqlite database.")
-
-    #--------------Get relpaths of docid--------------
-    query='''SELECT relpath FROM DocumentFiles
-    WHERE (DocumentFiles.did=?)'''
-    ret=sqlitedb.execute(query,(docid,))
-    filter_paths=[]
-    for uii in ret.fetchall():
-        # add / at the begining, and quote
-        filter_paths.append('/%s' %quote(uii[0]))
 
-    #------------------Create Enquire------------------
-    docid_queries=[xapian.Query('U%s' %ii) for ii in filter_paths]
-    query=xapian.Query(xapian.Query.OP_OR, docid_queries)
-    enquire=xapian.Enquire(db)
-    enquire.set_query(query)
+def getByDocid2(dbpath, sqlitepath, docid):
+    '''Get all xapian unique doc ids related to a given docid
 
-    doc_count=db.get_doccount()
-    mset=enquire.get_mset(0, doc_count)
-    docs=[]
+    Args:
+        dbpath (str): path to xapian database folder.
+        sqlitepath (str): path to sqlite database folder.
+        docid (int): doc id.
 
-    for mm in mset:
-        docs.append(mm.docid)
+    Returns:
+        docs (list): list of unique doc ids.
+    '''
 
-    return docs
+    session=SearchSession(dbpath, sqlitepath)
+    try:
+        return session.getByDocid(docid)
+    finally:
+        session.close()
 
 
 def delByDocid2(dbpath, sqlitepath, docid):
@@ -686,8 +1626,21 @@ def delByDocid2(dbpath, sqlitepath, docid):
     '''
 
     qids=getByDocid2(dbpath, sqlitepath, docid)
-    for idii in qids:
-        delXapianDoc(dbpath, idii)
+    if len(qids)>0:
+        db=xapian.WritableDatabase(dbpath, xapian.DB_OPEN)
+        for idii in qids:
+            delXapianDoc(dbpath, idii, db=db)
+        db.commit()
+        db.close()
+
+    sqlitedb=sqlite3.connect(sqlitepath)
+    try:
+        sqlitedb.execute('''DELETE FROM IndexManifest WHERE relpath IN
+        (SELECT relpath FROM DocumentFiles WHERE did=?)''', (docid,))
+        sqlitedb.commit()
+    except sqlite3.OperationalError:
+        pass
+    sqlitedb.close()
 
     return 0
 
@@ -719,93 +1672,33 @@ def getSnippets(mset, text, snip_size):
 
 if __name__=='__main__':
 
-    #dbpath='/home/guangzhi/testdb/tt/'
-    dbpath='/home/guangzhi/codes/pyrefman_deleted/men/_xapian_db'
-
-    #lib_folder='/home/guangzhi/testxap/'
-    lib_folder='/home/guangzhi/codes/pyrefman_deleted/men/'
-    sqlitepath='/home/guangzhi/codes/pyrefman_deleted/men.sqlite'
-
-    #aa=indexFolder(dbpath, lib_folder)
-    #aa=search2(dbpath, sqlitepath, 'atmosphere', list(range(0,200)))
-
-    #bb=getByDocid2(dbpath, sqlitepath, 1008)
-    pp=multiprocessing.Process(target=indexFolder, args=(dbpath,lib_folder))
-    pp.start()
-
-    '''
-    jobq=multiprocessing.JoinableQueue()
-    outq=multiprocessing.Queue()
-
-    def func(arg):
-        print(arg)
-    #worker=Worker(0, func, jobq, outq)
-    worker=Worker(0, indexFolder, jobq, outq)
-    worker.daemon=False
-    worker.start()
-
+    # compare indexing throughput of omindex and indexPDFs(), on a copy of
+    # a library, from the repo root:
+    #   python -m MeiTingTrunk.lib.xapiandb <lib_folder>
+    # the copy is made so that the text cache, see getFileText(), is written
+    # to the temporary folder and not into the library.
+    import sys
     import time
-
-    for ii in range(15):
-        time.sleep(1)
-        print(ii)
-
-        if ii==5:
-            jobq.put((dbpath, lib_folder))
-            #jobq.put(('aaa',))
-            jobq.put(None)
-
-        if ii==10:
-            #jobq.put(('aaa',))
-            jobq.put((dbpath, lib_folder))
-            jobq.put(None)
-
-    '''
-
-
-
-    """
-    dbpath='./xapian_db'
-
-    #aa=checkDatabase(dbpath, None)
-
-    #dbpath='/home/guangzhi/codes/pyrefman_deleted/men2/_xapian_db'
-    #recii=indexFile(dbpath, '../samples/testpdf.pdf', 'testpdf.pdf',
-            #{'id':0}, None)
-    '''
-    aa=search(dbpath, 'enso', ['pdf'], None)
-    print(aa)
-
-    '''
-    jobq=multiprocessing.JoinableQueue()
-    outq=multiprocessing.Queue()
-
-    workers=[]
-    for ii in range(4):
-        wii=Worker(ii,convertPDF,jobq,outq)
-        workers.append(wii)
-        wii.daemon=True
-        wii.start()
-
-    dirname='/home/guangzhi/Documents/Mendeley Desktop'
-    files=os.listdir(dirname)
-
-    for ii,fii in enumerate(files):
-        pii=os.path.join(dirname,fii)
-        #recii=indexFile(dbpath, pii, fii,  {'id':ii}, None)
-        #print('############### ii=',ii,'recii=',recii)
-        jobq.put((pii, fii, {'id':ii}))
-        if ii>=300:
-            for jj in range(len(workers)):
-                jobq.put(None)
-            break
-
-    #outq2=multiprocessing.Queue()
-    #writer=Worker(10, writeToXapian, outq, outq2)
-    #writer.start()
-    #pp=multiprocessing.Process(target=writeToXapian, args=(dbpath,outq))
-    #pp.start()
-    aa=writeToXapian(dbpath, outq)
-    """
-
-
+    import shutil
+
+    relpaths=[os.path.join('_collections', ii) for ii in
+            os.listdir(os.path.join(sys.argv[1], '_collections'))
+            if ii.lower().endswith('.pdf')]
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        lib_folder=os.path.join(tmp_folder, 'lib')
+        shutil.copytree(os.path.join(sys.argv[1], '_collections'),
+                os.path.join(lib_folder, '_collections'))
+
+        dbpath=os.path.join(tmp_folder, 'omindex')
+        t0=time.time()
+        indexFolder(dbpath, lib_folder)
+        t1=time.time()-t0
+        print('indexFolder: %d files in %.2f s' %(len(relpaths), t1))
+
+        dbpath=os.path.join(tmp_folder, 'pipeline')
+        t0=time.time()
+        indexPDFs(dbpath, lib_folder, relpaths)
+        t2=time.time()-t0
+        print('indexPDFs: %d files in %.2f s (%d cores)'\
+                %(len(relpaths), t2, os.cpu_count()))
@@ -0,0 +1,83 @@
+import os
+import logging
+from unittest import mock
+from MeiTingTrunk.lib import sqlitedb
+from MeiTingTrunk._MainFrameDataSlots import MainFrameDataSlots
+
+
+class Settings(object):
+
+    def __init__(self, lib_folder):
+        self.values={'saving/current_lib_folder': lib_folder,
+                'saving/rename_files': 0,
+                'saving/file_move_manner': 'copy'}
+
+    def value(self, key, type=None):
+        return self.values[key]
+
+    def sync(self):
+        pass
+
+
+class Frame(MainFrameDataSlots):
+
+    def __init__(self, db, lib_folder):
+        self.db=db
+        self.logger=logging.getLogger(__name__)
+        self.settings=Settings(lib_folder)
+        self.meta_dict={}
+        self.folder_dict={}
+        self.changed_folder_ids=[]
+        self.changed_doc_ids=[]
+        self.save_worker=None
+        self.search_session=None
+        self.meta_index=None
+        self.lib_loading=False
+        self.index_service=None
+        self._current_docids=None
+        self.status_bar=mock.MagicMock()
+        self.progressbar=mock.MagicMock()
+        self.doc_table=mock.MagicMock()
+        self.loadDocTable=mock.MagicMock()
+
+
+def test_edit_during_save_keeps_edit_and_saved_files(tmp_path, monkeypatch):
+    dbfile=os.path.join(str(tmp_path), 'lib.sqlite')
+    db,lib_folder,_=sqlitedb.createNewDatabase(dbfile)
+    collections=os.path.join(lib_folder, 'lib', '_collections')
+    frame=Frame(db, os.path.join(lib_folder, 'lib'))
+
+    pdf=os.path.join(str(tmp_path), 'paper.pdf')
+    with open(pdf, 'w') as fout:
+        fout.write('pdf')
+
+    doc=sqlitedb.DocMeta()
+    doc['title']='Old title'
+    doc['files_l']=[pdf]
+    frame.meta_dict[1]=doc
+    frame.changed_doc_ids=[1]
+
+    # the user edits the doc while it is being saved
+    save_batch=sqlitedb.saveToDatabaseBatch
+    def saveAndEdit(*args, **kwargs):
+        frame.meta_dict[1]['title']='New title'
+        frame.changed_doc_ids.append(1)
+        return save_batch(*args, **kwargs)
+
+    monkeypatch.setattr(sqlitedb, 'saveToDatabaseBatch', saveAndEdit)
+    frame.saveToDatabase(block=True)
+    monkeypatch.setattr(sqlitedb, 'saveToDatabaseBatch', save_batch)
+
+    # the edit is kept, and the saved relpath is taken
+    assert frame.meta_dict[1]['title']=='New title'
+    assert frame.meta_dict[1]['files_l']==[os.path.join('_collections',
+        'paper.pdf')]
+    assert frame.changed_doc_ids==[1]
+
+    # the next save writes the edit, without touching the attachment
+    frame.saveToDatabase(block=True)
+    assert frame.changed_doc_ids==[]
+    assert os.listdir(collections)==['paper.pdf']
+    assert sqlitedb.getMetaData(db, 1)['title']=='New title'
+    assert sqlitedb.getMetaData(db, 1)['files_l']==\
+            [os.path.join('_collections', 'paper.pdf')]
@@ -0,0 +1,48 @@
+import logging
+from MeiTingTrunk.lib import sqlitedb
+from MeiTingTrunk.lib.metaindex import MetaIndex
+from MeiTingTrunk._MainFrameLoadData import MainFrameLoadData
+
+
+class Frame(MainFrameLoadData):
+
+    def __init__(self, meta_dict):
+        self.logger=logging.getLogger(__name__)
+        self.meta_dict=meta_dict
+        self.changed_doc_ids=[]
+        self.meta_index=None
+        self.lib_loading=True
+        self._unindexed_ids=set()
+
+
+def makeDoc(title):
+    doc=sqlitedb.DocMeta()
+    doc['title']=title
+    return doc
+
+
+def searchIds(meta_index, text):
+    return set(docid for docid, _ in meta_index.search(text, ['Title']))
+
+
+def test_index_from_worker_includes_changes_during_loading():
+    meta_dict={1: makeDoc('Ocean heat'), 2: makeDoc('Sea ice'),
+            3: makeDoc('Cloud cover')}
+    # built from the docs as read from sqlite
+    meta_index=MetaIndex(dict(meta_dict))
+    frame=Frame(meta_dict)
+
+    # doc 1 is edited and saved, doc 2 is edited, doc 3 is deleted
+    meta_dict[1]['title']='Ocean salinity'
+    frame._unindexed_ids.add(1)
+    meta_dict[2]['title']='Sea level'
+    del meta_dict[3]
+    frame.changed_doc_ids=[2, 3]
+
+    frame.setMetaIndex(meta_index)
+
+    assert frame.meta_index is meta_index
+    assert searchIds(meta_index, 'salinity') == {1}
+    assert searchIds(meta_index, 'heat') == set()
+    assert searchIds(meta_index, 'level') == {2}
+    assert searchIds(meta_index, 'cloud') == set()
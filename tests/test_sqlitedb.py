@@ -0,0 +1,93 @@
+import os
+import sqlite3
+from MeiTingTrunk.lib import sqlitedb
+
+
+def newDoc(title, tags):
+    doc=sqlitedb.DocMeta()
+    doc['title']=title
+    doc['firstNames_l']=['Guang-zhi', 'Ada']
+    doc['lastName_l']=['Xu', 'Lovelace']
+    doc['tags_l']=tags
+    doc['keywords_l']=['climate']
+    doc['year']=2019
+    return doc
+
+
+def test_save_new_doc_on_migrated_db(tmp_path):
+    dbfile=os.path.join(str(tmp_path), 'lib.sqlite')
+    db,lib_folder,_=sqlitedb.createNewDatabase(dbfile)
+    assert db.execute('PRAGMA user_version').fetchone()[0]==\
+            sqlitedb.SCHEMA_VERSION
+
+    meta_dict={1: newDoc('A first title', ['tag1', 'tag2'])}
+    rec,_=sqlitedb.saveToDatabaseBatch(db, [], {}, [1], meta_dict,
+            lib_folder, False, 'copy')
+    assert rec==0
+
+    # update the same doc, re-writing its authors and tags
+    meta_dict[1]['tags_l']=['tag3']
+    meta_dict[2]=newDoc('Another title', ['tag1'])
+    rec,_=sqlitedb.saveToDatabaseBatch(db, [], {}, [1, 2], meta_dict,
+            lib_folder, False, 'copy')
+    assert rec==0
+
+    rows=db.execute('''SELECT rowid, title, authors, tags FROM
+        DocumentSearch ORDER BY rowid''').fetchall()
+    assert [rr[0] for rr in rows]==[1, 2]
+    assert rows[0][1]=='A first title'
+    assert 'Lovelace' in rows[0][2]
+    assert rows[0][3]=='tag3'
+
+    query='SELECT rowid FROM DocumentSearch WHERE DocumentSearch MATCH ?'
+    assert db.execute(query, ('tags:tag1',)).fetchall()==[(2,)]
+
+
+def test_migrate_replaces_search_triggers(tmp_path):
+    dbfile=os.path.join(str(tmp_path), 'lib.sqlite')
+    db,lib_folder,_=sqlitedb.createNewDatabase(dbfile)
+
+    # a library migrated to version 3 with the 'INSERT OR REPLACE' triggers
+    for query in sqlitedb._dropSearchIndexTriggers():
+        db.execute(query)
+    db.execute('''CREATE TRIGGER DocumentSearch_DocumentTags_i
+        AFTER INSERT ON DocumentTags BEGIN %s; END'''\
+            %sqlitedb.SEARCH_INDEX_SYNC.replace('INSERT INTO',
+                'INSERT OR REPLACE INTO') %{'did': 'Documents.id=NEW.did'})
+    db.execute('PRAGMA user_version = 4')
+    db.commit()
+
+    assert sqlitedb.migrateDatabase(db)==sqlitedb.SCHEMA_VERSION
+    meta_dict={1: newDoc('A title', ['tag1', 'tag2'])}
+    rec,_=sqlitedb.saveToDatabaseBatch(db, [], {}, [1], meta_dict,
+            lib_folder, False, 'copy')
+    assert rec==0
+    assert db.execute('SELECT tags FROM DocumentSearch').fetchall()==\
+            [('tag1; tag2',)]
+
+
+def test_write_while_reading_in_chunks(tmp_path):
+    dbfile=os.path.join(str(tmp_path), 'lib.sqlite')
+    db,lib_folder,_=sqlitedb.createNewDatabase(dbfile)
+    meta_dict=dict([(ii, newDoc('Title %d' %ii, ['tag1']))
+        for ii in range(1, 31)])
+    rec,_=sqlitedb.saveToDatabaseBatch(db, [], {}, list(meta_dict),
+            meta_dict, lib_folder, False, 'copy')
+    assert rec==0
+
+    chunks=sqlitedb.iterSqlite(db, chunk_size=10)
+    next(chunks)
+    kind,meta,_=next(chunks)
+    assert kind=='docs' and sorted(meta)==list(range(1, 11))
+
+    # e.g. a save from another thread while the library is being read
+    db2=sqlite3.connect(dbfile, timeout=0.1)
+    db2.execute("UPDATE Documents SET title='New title' WHERE id=25")
+    db2.commit()
+    db2.close()
+
+    rest={}
+    for kind,meta,_ in chunks:
+        rest.update(meta)
+    assert sorted(rest)==list(range(11, 31))
+    assert rest[25]['title']=='New title'
@@ -0,0 +1,22 @@
+import os
+from MeiTingTrunk.lib import sqlitedb
+from MeiTingTrunk.lib import sqlitefts
+
+
+def test_folder_doc_count_of_subtree(tmp_path):
+    dbfile=os.path.join(str(tmp_path), 'lib.sqlite')
+    db,_,_=sqlitedb.createNewDatabase(dbfile)
+
+    # 1 -> 2 -> 3, and 4 outside
+    db.executemany('INSERT INTO Folders (id, name, parentId) VALUES (?,?,?)',
+            [(1, 'a', -1), (2, 'b', 1), (3, 'c', 2), (4, 'd', -1)])
+    # doc 10 is in two folders of the subtree, and counted once
+    db.executemany('INSERT INTO DocumentFolders (did, folderid) VALUES (?,?)',
+            [(10, 1), (10, 3), (11, 2), (12, 3), (13, 4)])
+    db.commit()
+
+    assert sqlitefts.getFolderDocCount(db, '1') == 3
+    assert sqlitefts.getFolderDocCount(db, '1', desend=False) == 1
+    assert sqlitefts.getFolderDocCount(db, '2') == 3
+    assert sqlitefts.getFolderDocCount(db, '4') == 1
+    assert sorted(sqlitefts.getSubFolderIds(db, '1')) == ['1', '2', '3']
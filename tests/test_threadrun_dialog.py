@@ -0,0 +1,70 @@
+import os
+import pytest
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QEventLoop, QTimer
+from MeiTingTrunk.lib import sqlitedb
+from MeiTingTrunk.lib.tools import fuzzRatio, fuzzyMatch
+from MeiTingTrunk.lib.widgets.threadrun_dialog import PoolMaster
+
+
+@pytest.fixture(scope='module')
+def app():
+    app=QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    yield app
+
+
+def runMaster(master, timeout=60000):
+    loop=QEventLoop()
+    master.all_done_signal.connect(loop.quit)
+    QTimer.singleShot(timeout, loop.quit)
+    master.run()
+    loop.exec_()
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_pool_master_ratio(app, max_workers):
+    terms=['climate', 'climat', 'ocean', 'oceans', 'rain', 'brain']
+    job_list=[]
+    for ii in range(len(terms)):
+        for jj in range(ii+1, len(terms)):
+            job_list.append((len(job_list), terms[ii], terms[jj]))
+
+    progressbar=QtWidgets.QProgressBar()
+    done=[]
+    master=PoolMaster(fuzzRatio, job_list, max_workers, progressbar,
+            chunk_size=4)
+    master.donejobs_count_signal.connect(done.append)
+    runMaster(master)
+
+    assert sorted(master.results)==sorted(fuzzRatio(*jii) for jii in job_list)
+    # progress is reported per chunk
+    assert done==sorted(done) and done[-1]==len(job_list)
+    assert len(done)==(len(job_list)+3)//4
+    assert progressbar.value()==len(job_list)
+
+
+def test_pool_master_fuzzy_match(app):
+    docs=[(1, 'Xu, G', 'A study of rain', 'J Clim 2019'),
+          (2, 'Xu, G', 'A study on rain', 'J Clim 2019'),
+          (3, 'Lovelace, A', 'Notes on the engine', 'Sketch 1843')]
+    job_list=[(0, docs[0], docs[1], 60), (1, docs[0], docs[2], 60)]
+    master=PoolMaster(fuzzyMatch, job_list, 2, chunk_size=1)
+    runMaster(master)
+
+    scores=dict(rii[2] for rii in master.results)
+    assert scores[(1, 2)]>90
+    assert scores[(1, 3)]==0
+
+
+def test_pool_master_abort(app):
+    job_list=[(ii, 'a'*50, 'b'*50) for ii in range(20000)]
+    master=PoolMaster(fuzzRatio, job_list, 2, chunk_size=100)
+    finished=[]
+    master.all_done_signal.connect(lambda: finished.append(1))
+    master.run()
+    master.abortJobs()
+    app.processEvents()
+
+    assert len(finished)==0
+    assert len(master.results)<len(job_list)